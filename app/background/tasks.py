@@ -1,39 +1,242 @@
 import asyncio
 import time
 import logging
-from app.services.zk_service import DeviceConnection
+import random
+from app.services import zk_service
+from app.services.capture_hub import hub as capture_hub, follow
+from app.services.device_registry import registry
+from app.services.event_log import event_log
+from app.services.leader_proxy import leader_proxy
+from app.services.scheduler import PRIORITY_BACKGROUND
+from app.services.shared_state import leader, shared_state
+from app.services.template_sync import template_sync
+from app.services.webhooks import webhooks
+from app.services.ws_service import manager
 from app.config import settings
+from app.utils.network import tcp_probe
 
 logger = logging.getLogger(__name__)
 device_status = {}
-lock = asyncio.Lock()
+# Estado del sondeo por IP: fallos consecutivos, próximo sondeo y última consulta completa
+probe_state = {}
+# Tareas que solo corren en el líder; se cancelan si deja de serlo
+leader_tasks = []
+background_tasks = []
+
+def backoff_delay(failures: int) -> float:
+    """Backoff exponencial con jitter para dispositivos caídos"""
+    delay = min(settings.PROBE_MAX_BACKOFF, settings.DEVICE_CHECK_INTERVAL * 2 ** (failures - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def mark_offline(ip: str, state: dict, error: str, now: float):
+    state["failures"] += 1
+    state["next_probe"] = now + backoff_delay(state["failures"])
+    previous = device_status.get(ip, {})
+    device_status[ip] = {
+        "status": "offline",
+        "error": error,
+        "info": previous.get("info"),
+        "latency_ms": previous.get("latency_ms"),
+        "last_seen": previous.get("last_seen"),
+        "failures": state["failures"],
+        "timestamp": now
+    }
 
 async def check_device(ip: str):
-    async with lock:
-        try:
-            device = DeviceConnection(ip)
-            info = await asyncio.to_thread(device.get_device_info)
-            
-            device_status[ip] = {
-                "status": "online",
-                "info": info,
-                "timestamp": time.time()
-            }
-        except Exception as e:
-            device_status[ip] = {
-                "status": "offline",
-                "error": str(e),
-                "timestamp": time.time()
-            }
+    state = probe_state.setdefault(ip, {"failures": 0, "next_probe": 0.0, "last_full_check": 0.0})
+    previous = device_status.get(ip, {})
+    now = time.time()
+
+    # Primer nivel: alcanzabilidad TCP, sin sesión ni hilo del executor
+    try:
+        latency = await tcp_probe(ip, settings.DEVICE_PORT, settings.PROBE_TIMEOUT)
+    except Exception as e:
+        mark_offline(ip, state, str(e) or "Dispositivo inalcanzable", now)
+    else:
+        status = {
+            "status": "online",
+            "info": previous.get("info"),
+            "latency_ms": round(latency, 1),
+            "last_seen": now,
+            "failures": 0,
+            "timestamp": now
+        }
+        # Segundo nivel: consulta completa solo al cambiar de estado o con cadencia lenta.
+        # Pasa por la cola del dispositivo con prioridad baja: las llamadas de la API se adelantan
+        if previous.get("status") != "online" or now - state["last_full_check"] >= settings.DEVICE_FULL_CHECK_INTERVAL:
+            try:
+                # Consulta siempre el dispositivo y deja el resultado en la caché para la API
+                status["info"] = await zk_service.get_device_info(ip, priority=PRIORITY_BACKGROUND, use_cache=False)
+                state["last_full_check"] = time.time()
+            except Exception as e:
+                mark_offline(ip, state, str(e), now)
+                status = None
+        if status:
+            state["failures"] = 0
+            state["next_probe"] = now + settings.DEVICE_CHECK_INTERVAL
+            device_status[ip] = status
+
+    if leader.enabled:
+        # Los demás workers responden /health desde el estado compartido
+        await asyncio.to_thread(shared_state.set_device_status, ip, device_status[ip])
+    if device_status[ip]["status"] != previous.get("status"):
+        await manager.broadcast(
+            {"type": "device_status", "device_ip": ip, "status": device_status[ip]["status"]},
+            ip, "device_status"
+        )
+
+async def forget_device(ip: str):
+    """Un dispositivo quitado del registro deja de aparecer en /health"""
+    device_status.pop(ip, None)
+    probe_state.pop(ip, None)
+    if leader.enabled:
+        await asyncio.to_thread(shared_state.delete_device_status, ip)
 
 async def monitor_devices():
+    in_flight = set()
+    while True:
+        now = time.time()
+        devices = registry.ips()
+        for ip in device_status.keys() - set(devices) - in_flight:
+            await forget_device(ip)
+        for ip in devices:
+            if ip and ip not in in_flight and probe_state.get(ip, {}).get("next_probe", 0) <= now:
+                # Cada dispositivo avanza a su ritmo; uno lento no retrasa a los demás
+                in_flight.add(ip)
+                task = asyncio.create_task(check_device(ip))
+                task.add_done_callback(lambda _, ip=ip: in_flight.discard(ip))
+        await asyncio.sleep(settings.PROBE_TICK)
+
+async def sync_device_attendance(ip: str):
+    try:
+        await zk_service.sync_attendance(ip)
+    except Exception as e:
+        logger.error(f"Error sincronizando asistencia de {ip}: {str(e)}")
+
+async def sync_attendance_devices():
+    while True:
+        await asyncio.gather(*(sync_device_attendance(ip) for ip in registry.ips()))
+        await asyncio.sleep(settings.ATTENDANCE_SYNC_INTERVAL)
+
+async def rotate_device_attendance(ip: str):
+    try:
+        if await zk_service.rotation_due(ip):
+            await zk_service.rotate_attendance(ip)
+    except Exception as e:
+        logger.error(f"Error rotando asistencia de {ip}: {str(e)}")
+
+async def rotate_attendance_devices():
+    while True:
+        await asyncio.gather(*(rotate_device_attendance(ip) for ip in registry.ips()))
+        await asyncio.sleep(settings.ATTENDANCE_ROTATION_CHECK_INTERVAL)
+
+async def forward_live_events(ip: str):
+    """Mantiene abierta la captura del dispositivo y lleva sus eventos al outbox de webhooks"""
+    key = f"realtime:{ip}"
     while True:
-        tasks = []
-        for ip in settings.KNOWN_DEVICES:
-            if ip:
-                tasks.append(asyncio.create_task(check_device(ip)))
-        await asyncio.gather(*tasks)
-        await asyncio.sleep(settings.DEVICE_CHECK_INTERVAL)
+        # Tras un reinicio se continúa desde el último evento encolado, repitiendo el registro
+        offset = await webhooks.position(key)
+        subscription = capture_hub.subscribe(ip)
+        try:
+            async for event in follow(subscription, offset):
+                if "offset" not in event:
+                    continue
+                await webhooks.publish([{"type": "attendance.realtime", **event}], {key: event["offset"] + 1})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error enviando eventos en vivo de {ip} a webhooks: {str(e)}")
+            await asyncio.sleep(settings.CAPTURE_RETRY_DELAY)
+        finally:
+            capture_hub.unsubscribe(subscription)
+
+async def forward_registry_events():
+    """Un reenvío de eventos en vivo por dispositivo de la flota, siguiendo los cambios del registro"""
+    forwarders = {}
+    try:
+        while True:
+            devices = set(registry.ips())
+            for ip in devices - forwarders.keys():
+                forwarders[ip] = asyncio.create_task(forward_live_events(ip))
+            for ip in forwarders.keys() - devices:
+                forwarders.pop(ip).cancel()
+            await asyncio.sleep(settings.DEVICE_REGISTRY_WATCH_INTERVAL)
+    finally:
+        for task in forwarders.values():
+            task.cancel()
+        await asyncio.gather(*forwarders.values(), return_exceptions=True)
+
+async def hold_captures():
+    """Con varios workers el líder captura solo los dispositivos que siguen otros workers"""
+    pinned = set()
+    try:
+        while True:
+            # Los avisos de los demás workers se renuevan cada LEADER_RENEW_INTERVAL mientras tengan
+            # suscriptores; uno sin renovar vence y la captura se cierra tras el periodo de gracia
+            expired = time.time() - 3 * settings.LEADER_RENEW_INTERVAL
+            await asyncio.to_thread(shared_state.expire_documents, "capture", expired)
+            wanted = set(await asyncio.to_thread(shared_state.list_documents, "capture", expired))
+            for ip in wanted - pinned:
+                capture_hub.pin(ip)
+            for ip in pinned - wanted:
+                capture_hub.unpin(ip)
+            pinned = wanted
+            await asyncio.sleep(settings.LEADER_RENEW_INTERVAL)
+    finally:
+        for ip in pinned:
+            capture_hub.unpin(ip)
+
+async def start_leader_tasks():
+    """Sondeo, sincronización, capturas y webhooks: lo que habla con los dispositivos"""
+    event_log.set_writer(True)
+    try:
+        await template_sync.recover()
+    except Exception as e:
+        logger.error(f"Error recuperando sincronizaciones de plantillas: {str(e)}")
+    # Las capturas que seguían el registro pasan a capturar del dispositivo
+    capture_hub.interrupt()
+    leader_tasks.append(asyncio.create_task(monitor_devices()))
+    if settings.ATTENDANCE_SYNC_INTERVAL > 0:
+        leader_tasks.append(asyncio.create_task(sync_attendance_devices()))
+    if settings.ATTENDANCE_ROTATION_THRESHOLD or settings.ATTENDANCE_ROTATION_INTERVAL_HOURS:
+        leader_tasks.append(asyncio.create_task(rotate_attendance_devices()))
+    if leader.enabled:
+        leader_proxy.start()
+        leader_tasks.append(asyncio.create_task(hold_captures()))
+    if webhooks.enabled:
+        webhooks.start()
+        if settings.WEBHOOK_REALTIME:
+            leader_tasks.append(asyncio.create_task(forward_registry_events()))
+
+async def stop_leader_tasks():
+    tasks = list(leader_tasks)
+    leader_tasks.clear()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await leader_proxy.stop()
+    await webhooks.shutdown()
+    # Otro worker toma el relevo: este deja de capturar y pasa a seguir el registro
+    capture_hub.interrupt()
+    event_log.set_writer(False)
 
 async def start_background_tasks():
-    asyncio.create_task(monitor_devices())
\ No newline at end of file
+    background_tasks.append(asyncio.create_task(zk_service.pool.run_reaper()))
+    if registry.path:
+        # Todos los workers vigilan el archivo: cada uno ve la flota actual sin reiniciar
+        background_tasks.append(asyncio.create_task(registry.watch()))
+    if leader.enabled:
+        logger.info(f"Modo multi-worker: {leader.worker_id} compite por el arriendo de líder")
+        background_tasks.append(asyncio.create_task(leader.run(start_leader_tasks, stop_leader_tasks)))
+    else:
+        await start_leader_tasks()
+
+async def stop_background_tasks():
+    """Cancela las tareas; el líder libera el arriendo para que otro worker lo tome sin esperar"""
+    tasks = background_tasks + leader_tasks
+    background_tasks.clear()
+    leader_tasks.clear()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await leader_proxy.stop()
\ No newline at end of file
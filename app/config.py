@@ -32,13 +32,94 @@ class Settings:
     DEVICE_TIMEOUT = int(os.getenv("DEVICE_TIMEOUT", "5"))
     DEVICE_PORT = int(os.getenv("DEVICE_PORT", "4370"))
     DEVICE_PASSWORD = os.getenv("DEVICE_PASSWORD", "0")
+    # "asyncio" (cliente nativo, sin hilos) o "zk" (librería bloqueante en el executor)
+    ZK_BACKEND = os.getenv("ZK_BACKEND", "asyncio")
     MAX_WORKERS = int(os.getenv("MAX_WORKERS", "10"))
     DEVICE_CHECK_INTERVAL = int(os.getenv("DEVICE_CHECK_INTERVAL", "60"))
+    DEVICE_FULL_CHECK_INTERVAL = int(os.getenv("DEVICE_FULL_CHECK_INTERVAL", "600"))
+    PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "2"))
+    PROBE_MAX_BACKOFF = int(os.getenv("PROBE_MAX_BACKOFF", "900"))
+    PROBE_TICK = float(os.getenv("PROBE_TICK", "1"))
     RECONNECT_ATTEMPTS = int(os.getenv("RECONNECT_ATTEMPTS", "3"))
     DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+    POOL_MAX_SESSIONS = int(os.getenv("POOL_MAX_SESSIONS", "50"))
+    POOL_IDLE_TIMEOUT = int(os.getenv("POOL_IDLE_TIMEOUT", "300"))
+    POOL_HEALTH_CHECK_INTERVAL = int(os.getenv("POOL_HEALTH_CHECK_INTERVAL", "30"))
+    ATTENDANCE_DB_PATH = os.getenv("ATTENDANCE_DB_PATH", "data/attendance.db")
+    ATTENDANCE_SYNC_INTERVAL = int(os.getenv("ATTENDANCE_SYNC_INTERVAL", "300"))
+    ATTENDANCE_PAGE_SIZE = int(os.getenv("ATTENDANCE_PAGE_SIZE", "1000"))
+    # Archivar y vaciar el log del dispositivo: por número de registros, por antigüedad o ambos (0 = desactivado)
+    ATTENDANCE_ROTATION_THRESHOLD = int(os.getenv("ATTENDANCE_ROTATION_THRESHOLD", "0"))
+    ATTENDANCE_ROTATION_INTERVAL_HOURS = float(os.getenv("ATTENDANCE_ROTATION_INTERVAL_HOURS", "0"))
+    ATTENDANCE_ROTATION_CHECK_INTERVAL = int(os.getenv("ATTENDANCE_ROTATION_CHECK_INTERVAL", "3600"))
+    STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+    SCHEDULER_IDLE_TIMEOUT = int(os.getenv("SCHEDULER_IDLE_TIMEOUT", "60"))
+    LIVE_CAPTURE_POLL_INTERVAL = int(os.getenv("LIVE_CAPTURE_POLL_INTERVAL", "1"))
+    CAPTURE_SEGMENT = int(os.getenv("CAPTURE_SEGMENT", "60"))
+    CAPTURE_GRACE_PERIOD = int(os.getenv("CAPTURE_GRACE_PERIOD", "30"))
+    CAPTURE_QUEUE_SIZE = int(os.getenv("CAPTURE_QUEUE_SIZE", "100"))
+    CAPTURE_RETRY_DELAY = int(os.getenv("CAPTURE_RETRY_DELAY", "5"))
+    WS_CLIENT_QUEUE_SIZE = int(os.getenv("WS_CLIENT_QUEUE_SIZE", "100"))
+    WS_SLOW_CLIENT_POLICY = os.getenv("WS_SLOW_CLIENT_POLICY", "drop_oldest")
+    CACHE_TTL = int(os.getenv("CACHE_TTL", "60"))
+    CACHE_INFO_TTL = int(os.getenv("CACHE_INFO_TTL", "300"))
+    # Última asistencia descargada por dispositivo, reutilizada mientras sus contadores no cambien
+    ATTENDANCE_CACHE_TTL = int(os.getenv("ATTENDANCE_CACHE_TTL", "3600"))
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+    BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", os.getenv("MAX_WORKERS", "10")))
+    BULK_SUBNET_CONCURRENCY = int(os.getenv("BULK_SUBNET_CONCURRENCY", "4"))
+    BULK_SUBNET_PREFIX = int(os.getenv("BULK_SUBNET_PREFIX", "24"))
+    REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+    REQUEST_TIMEOUT_LONG = float(os.getenv("REQUEST_TIMEOUT_LONG", "300"))
+    REQUEST_TIMEOUT_MAX = float(os.getenv("REQUEST_TIMEOUT_MAX", "600"))
+    DEVICE_QUEUE_MAX_DEPTH = int(os.getenv("DEVICE_QUEUE_MAX_DEPTH", "20"))
+    QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", "1000"))
+    TEMPLATE_SYNC_BATCH_SIZE = int(os.getenv("TEMPLATE_SYNC_BATCH_SIZE", "50"))
+    TEMPLATE_SYNC_CONCURRENCY = int(os.getenv("TEMPLATE_SYNC_CONCURRENCY", os.getenv("BULK_MAX_CONCURRENCY", "10")))
+    TEMPLATE_SYNC_MAX_JOBS = int(os.getenv("TEMPLATE_SYNC_MAX_JOBS", "20"))
+    WORKDAY_HOURS = float(os.getenv("WORKDAY_HOURS", "8"))
+    ANALYTICS_DUPLICATE_WINDOW = int(os.getenv("ANALYTICS_DUPLICATE_WINDOW", "60"))
+    ANALYTICS_CACHE_DAYS = int(os.getenv("ANALYTICS_CACHE_DAYS", "1000"))
+    ANALYTICS_MAX_DAYS = int(os.getenv("ANALYTICS_MAX_DAYS", "366"))
+    EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", "data/events")
+    EVENT_LOG_SEGMENT_BYTES = int(os.getenv("EVENT_LOG_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+    EVENT_LOG_RETENTION_BYTES = int(os.getenv("EVENT_LOG_RETENTION_BYTES", str(512 * 1024 * 1024)))
+    EVENT_LOG_RETENTION_HOURS = float(os.getenv("EVENT_LOG_RETENTION_HOURS", "168"))
+    EVENT_LOG_FSYNC_INTERVAL = float(os.getenv("EVENT_LOG_FSYNC_INTERVAL", "1"))
+    EVENT_LOG_FSYNC_BATCH = int(os.getenv("EVENT_LOG_FSYNC_BATCH", "100"))
+    EVENT_LOG_REPLAY_BATCH = int(os.getenv("EVENT_LOG_REPLAY_BATCH", "1000"))
+    WEBHOOK_OUTBOX_PATH = os.getenv("WEBHOOK_OUTBOX_PATH", "data/webhooks.db")
+    WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "500"))
+    WEBHOOK_BATCH_WINDOW = float(os.getenv("WEBHOOK_BATCH_WINDOW", "1"))
+    WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "4"))
+    WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+    WEBHOOK_RETRY_DELAY = float(os.getenv("WEBHOOK_RETRY_DELAY", "1"))
+    WEBHOOK_MAX_BACKOFF = float(os.getenv("WEBHOOK_MAX_BACKOFF", "300"))
+    WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "0"))
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    # Mantiene abierta la captura en vivo de todos los dispositivos de la flota para enviar sus eventos
+    WEBHOOK_REALTIME = os.getenv("WEBHOOK_REALTIME", "false").lower() == "true"
+    # Varios workers de uvicorn: estado compartido en SQLite y un único líder que habla con los dispositivos
+    MULTI_WORKER = os.getenv("MULTI_WORKER", "false").lower() == "true"
+    SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "data/shared.db")
+    LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "15"))
+    LEADER_RENEW_INTERVAL = float(os.getenv("LEADER_RENEW_INTERVAL", "5"))
+    # Socket Unix por el que los demás workers reenvían al líder las peticiones que usan un dispositivo
+    LEADER_SOCKET_PATH = os.getenv("LEADER_SOCKET_PATH", "data/leader.sock")
+    EVENT_LOG_POLL_INTERVAL = float(os.getenv("EVENT_LOG_POLL_INTERVAL", "0.5"))
+    # Flota editable sin reiniciar: se suma a KNOWN_DEVICES y se recarga al cambiar ("" = solo en memoria)
+    DEVICE_REGISTRY_FILE = os.getenv("DEVICE_REGISTRY_FILE", "data/devices.json")
+    DEVICE_REGISTRY_WATCH_INTERVAL = float(os.getenv("DEVICE_REGISTRY_WATCH_INTERVAL", "5"))
+    # Descubrimiento por subred: sondeos TCP simultáneos, plazo por host y tamaño máximo del barrido
+    DISCOVERY_CONCURRENCY = int(os.getenv("DISCOVERY_CONCURRENCY", "256"))
+    DISCOVERY_TIMEOUT = float(os.getenv("DISCOVERY_TIMEOUT", "0.5"))
+    DISCOVERY_MAX_HOSTS = int(os.getenv("DISCOVERY_MAX_HOSTS", "4096"))
+    METRICS_TIMING_HEADER = os.getenv("METRICS_TIMING_HEADER", "false").lower() == "true"
     
     def __init__(self):
         devices = os.getenv("KNOWN_DEVICES", "")
         self.KNOWN_DEVICES = [ip.strip() for ip in devices.split(",") if ip.strip()]
+        urls = os.getenv("WEBHOOK_URLS", "")
+        self.WEBHOOK_URLS = [url.strip() for url in urls.split(",") if url.strip()]
 
 settings = Settings()
\ No newline at end of file
@@ -1,7 +1,28 @@
-from fastapi import Header, HTTPException
+from fastapi import Header, HTTPException, Query, WebSocketException, status
+from starlette.requests import HTTPConnection
 from app.config import settings
+from app.services.scheduler import set_deadline
+from typing import Optional
 
 def validate_api_key(api_key: str = Header(..., alias="X-API-Key")):
     if api_key != settings.API_KEY:
         raise HTTPException(status_code=401, detail="Invalid API Key")
-    return api_key
\ No newline at end of file
+    return api_key
+
+def validate_ws_api_key(api_key: Optional[str] = Header(None, alias="X-API-Key"),
+                        token: Optional[str] = Query(None, alias="api_key")):
+    """Como validate_api_key; un navegador no puede poner cabeceras al abrir un WebSocket,
+    así que la clave también se acepta en el parámetro ?api_key="""
+    api_key = api_key or token
+    if api_key is None or api_key != settings.API_KEY:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid API Key")
+    return api_key
+
+def request_timeout(default: float):
+    """Plazo de la petición: cabecera X-Request-Timeout (segundos) o el valor por defecto del endpoint"""
+    async def dependency(connection: HTTPConnection,
+                         timeout: Optional[float] = Header(None, alias="X-Request-Timeout", gt=0)):
+        # Los WebSocket son sesiones largas: sin plazo
+        if connection.scope["type"] == "http":
+            set_deadline(min(timeout, settings.REQUEST_TIMEOUT_MAX) if timeout else default)
+    return dependency
\ No newline at end of file
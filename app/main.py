@@ -1,8 +1,13 @@
-from fastapi import FastAPI
-from app.routers import devices, health, ws
-from app.background.tasks import start_background_tasks
+from fastapi import FastAPI, Request
+from app.config import settings
+from app.routers import devices, health, metrics, reports, ws
+from app.background.tasks import start_background_tasks, stop_background_tasks
+from app.services.metrics import format_server_timing, request_timings
+from app.services.leader_proxy import leader_proxy
+from app.utils.asgi import CancelOnDisconnectMiddleware, LeaderForwardMiddleware
 import logging
 import asyncio
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +23,31 @@ app = FastAPI(
 app.include_router(devices.router)
 app.include_router(health.router)
 app.include_router(ws.router)
+app.include_router(metrics.router)
+app.include_router(reports.router)
+
+# Desglose de tiempos por petición en la cabecera Server-Timing
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    if not settings.METRICS_TIMING_HEADER:
+        return await call_next(request)
+    timings = {}
+    token = request_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    timings["total"] = time.perf_counter() - start
+    response.headers["Server-Timing"] = format_server_timing(timings)
+    return response
+
+# Con varios workers, lo que requiere un dispositivo lo atiende el líder
+if leader_proxy.enabled:
+    app.add_middleware(LeaderForwardMiddleware, proxy=leader_proxy)
+
+# Las peticiones abandonadas por el cliente no siguen ocupando la cola del dispositivo
+app.add_middleware(CancelOnDisconnectMiddleware)
 
 # Iniciar tareas en segundo plano
 @app.on_event("startup")
@@ -33,8 +63,17 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     try:
+        from app.services.capture_hub import hub
+        from app.services.event_log import event_log
+        from app.services.template_sync import template_sync
+        from app.services.webhooks import webhooks
         from app.services.zk_service import cleanup_devices
+        await stop_background_tasks()
+        await hub.shutdown()
+        await template_sync.shutdown()
+        await webhooks.shutdown()
         await cleanup_devices()
+        event_log.close()
         logger.info("Recursos liberados y tareas detenidas")
     except ImportError:
         logger.warning("La función cleanup_devices no está disponible")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import Optional, List
 
@@ -24,8 +24,33 @@ class DeviceInfo(BaseModel):
     platform: str
     device_time: str
 
-# Añade este nuevo modelo
 class UserTemplate(BaseModel):
     user_id: str
-    finger_index: int
-    template_data: bytes
\ No newline at end of file
+    finger_index: int = Field(..., ge=0, le=9)
+    # Plantilla en base64
+    template_data: bytes
+
+class BulkRequest(BaseModel):
+    devices: Optional[List[str]] = None
+    concurrency: Optional[int] = Field(None, ge=1)
+    subnet_concurrency: Optional[int] = Field(None, ge=1)
+
+class TemplateSyncRequest(BaseModel):
+    source: str
+    devices: Optional[List[str]] = None
+    delete_missing: bool = False
+    batch_size: Optional[int] = Field(None, ge=1, le=500)
+    concurrency: Optional[int] = Field(None, ge=1)
+
+class RegistryDevice(BaseModel):
+    ip: str
+    name: Optional[str] = None
+
+class DiscoveryRequest(BaseModel):
+    # Subredes en notación CIDR (o IPs sueltas)
+    networks: List[str]
+    port: Optional[int] = Field(None, ge=1, le=65535)
+    concurrency: Optional[int] = Field(None, ge=1, le=4096)
+    timeout: Optional[float] = Field(None, gt=0, le=30)
+    # Agrega al registro los terminales compatibles encontrados
+    auto_register: bool = False
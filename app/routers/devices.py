@@ -1,81 +1,266 @@
-from typing import List
-from fastapi import APIRouter, HTTPException, WebSocket, Depends
-from app.services import zk_service
-from app.dependencies import validate_api_key
-from app.models.schemas import AttendanceRecord, User, DeviceInfo
+from typing import List, Optional, Literal
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, WebSocket, Depends, Query, Response, Header
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.services import zk_service, fleet_service
+from app.services.attendance_store import store
+from app.services.device_registry import normalize_ip, registry
+from app.services.discovery import discover
+from app.services.scheduler import PRIORITY_INTERACTIVE
+from app.services.capture_hub import hub as capture_hub, follow
+from app.services.cache import wants_fresh, device_cache
+from app.services.change_tracker import attendance_etag, device_etag, etag_matches
+from app.services.template_sync import template_sync
+from app.config import settings
+from app.dependencies import validate_api_key, request_timeout
+from app.models.schemas import (AttendanceRecord, User, DeviceInfo, BulkRequest, UserTemplate, TemplateSyncRequest,
+                                RegistryDevice, DiscoveryRequest)
+from email.utils import formatdate
+import base64
+import binascii
 import logging
 import asyncio
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(
-    dependencies=[Depends(validate_api_key)],
+    dependencies=[Depends(validate_api_key), Depends(request_timeout(settings.REQUEST_TIMEOUT))],
     prefix="/devices",
     tags=["devices"]
 )
 
-@router.get("/{ip}/attendance", response_model=List[AttendanceRecord])
-async def get_device_attendance(ip: str):
+def _bulk_response(request: BulkRequest, operation):
+    devices = fleet_service.resolve_devices(request.devices)
+    if not devices:
+        raise HTTPException(status_code=400, detail="No hay dispositivos para consultar")
+    results = fleet_service.fan_out(devices, operation, request.concurrency, request.subnet_concurrency)
+    return StreamingResponse(fleet_service.ndjson_results(results), media_type="application/x-ndjson")
+
+def _version_headers(etag: str, changed_at: float) -> dict:
+    return {"ETag": etag, "Last-Modified": formatdate(changed_at, usegmt=True)}
+
+# Descargas completas y consultas a toda la flota tienen un plazo por defecto más largo
+long_timeout = [Depends(request_timeout(settings.REQUEST_TIMEOUT_LONG))]
+
+@router.post("/bulk/attendance", dependencies=long_timeout)
+async def bulk_attendance(request: BulkRequest):
+    return _bulk_response(request, zk_service.get_attendance)
+
+@router.post("/bulk/users", dependencies=long_timeout)
+async def bulk_users(request: BulkRequest):
+    return _bulk_response(request, zk_service.get_users)
+
+@router.get("/registry")
+async def list_registry():
+    return registry.list()
+
+@router.post("/registry", status_code=201)
+async def add_to_registry(device: RegistryDevice):
+    """Agrega un dispositivo a la flota sin reiniciar; el sondeo y la sincronización lo toman solos"""
+    try:
+        return await asyncio.to_thread(registry.add, device.ip, name=device.name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/registry/{ip}")
+async def remove_from_registry(ip: str):
+    try:
+        ip = normalize_ip(ip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        removed = await asyncio.to_thread(registry.remove, ip)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not removed:
+        raise HTTPException(status_code=404, detail="Dispositivo no registrado")
+    await device_cache.invalidate_device(ip)
+    return {"message": "Dispositivo quitado del registro"}
+
+@router.post("/discover", dependencies=long_timeout)
+async def discover_devices(request: DiscoveryRequest):
+    """Barre subredes en DEVICE_PORT e identifica los terminales que responden"""
+    try:
+        return await discover(request.networks, request.port, request.concurrency, request.timeout,
+                              request.auto_register)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/templates/sync", status_code=202)
+async def start_template_sync(request: TemplateSyncRequest):
+    devices = fleet_service.resolve_devices(request.devices)
+    if not [ip for ip in devices if ip != request.source]:
+        raise HTTPException(status_code=400, detail="No hay dispositivos destino para sincronizar")
+    job = template_sync.start(request.source, devices, request.delete_missing, request.batch_size,
+                              request.concurrency)
+    return job.to_dict()
+
+@router.get("/templates/sync/{job_id}")
+async def get_template_sync(job_id: str):
+    status = await template_sync.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Sincronización no encontrada")
+    return status
+
+@router.post("/templates/sync/{job_id}/resume", status_code=202)
+async def resume_template_sync(job_id: str):
+    job = await template_sync.resume(job_id)
+    if job is None:
+        if await template_sync.status(job_id) is not None:
+            raise HTTPException(status_code=409, detail="La sincronización está en curso en otro proceso")
+        raise HTTPException(status_code=404, detail="Sincronización no encontrada")
+    return job.to_dict()
+
+@router.get("/{ip}/attendance", response_model=List[AttendanceRecord], dependencies=long_timeout)
+async def get_device_attendance(
+    ip: str,
+    response: Response,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user_id: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=10000),
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
+    if_none_match: Optional[str] = Header(None)
+):
+    filtered = any(value is not None for value in (since, until, user_id, limit, cursor))
+    if if_none_match and not filtered:
+        # Los contadores y el último registro del log deciden si hace falta descargar algo
+        state = await zk_service.check_changes(ip, tail=True)
+        etag = attendance_etag(state)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=_version_headers(etag, state["records_changed_at"]))
+    if format == "ndjson":
+        # Transmisión por bloques sin construir la lista completa ni validarla de nuevo
+        if filtered:
+            stream = zk_service.stream_stored_attendance(ip, since, until, user_id, limit, cursor)
+        else:
+            stream = zk_service.stream_attendance(ip)
+        return StreamingResponse(stream, media_type="application/x-ndjson")
+    # Con filtros se responde desde el almacén local sincronizado
+    if filtered:
+        try:
+            records, next_cursor = await zk_service.query_attendance(ip, since, until, user_id, limit, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return records
     try:
-        attendance = await zk_service.get_attendance(ip)
-        return attendance
+        state, attendance = await zk_service.get_attendance_versioned(ip)
+        # Datos del dispositivo ya tipados: se serializan sin validar registro por registro
+        return Response(content=attendance.to_json(), media_type="application/json",
+                        headers=_version_headers(attendance_etag(state), state["records_changed_at"]))
+    except HTTPException:
+        # Rechazos por carga o plazo conservan su código y Retry-After
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo asistencia de {ip}: {str(e)}")
         raise HTTPException(status_code=503, detail=f"Error al obtener asistencia: {str(e)}")
 
+@router.post("/{ip}/attendance/rotate", dependencies=long_timeout)
+async def rotate_device_attendance(ip: str):
+    """Archiva el log del dispositivo en el almacén local, lo verifica y lo vacía"""
+    return await zk_service.rotate_attendance(ip, priority=PRIORITY_INTERACTIVE)
+
+@router.get("/{ip}/attendance/rotations")
+async def get_attendance_rotations(ip: str, limit: int = Query(100, ge=1, le=1000)):
+    return await asyncio.to_thread(store.rotations, ip, limit)
+
 @router.get("/{ip}/users", response_model=List[User])
-async def get_device_users(ip: str):
+async def get_device_users(ip: str, cache_control: Optional[str] = Header(None)):
     try:
-        users = await zk_service.get_users(ip)
+        users = await zk_service.get_users(ip, use_cache=not wants_fresh(cache_control))
         return users
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo usuarios de {ip}: {str(e)}")
         raise HTTPException(status_code=503, detail=f"Error al obtener usuarios: {str(e)}")
 
 @router.get("/{ip}/info", response_model=DeviceInfo)
-async def get_device_info(ip: str):
+async def get_device_info(ip: str, cache_control: Optional[str] = Header(None)):
     try:
-        device_info = await zk_service.get_device_info(ip)
+        device_info = await zk_service.get_device_info(ip, use_cache=not wants_fresh(cache_control))
         return device_info
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo info de {ip}: {str(e)}")
         raise HTTPException(status_code=503, detail=f"Error al obtener info del dispositivo: {str(e)}")
 
+@router.get("/{ip}/changes")
+async def get_device_changes(ip: str, if_none_match: Optional[str] = Header(None)):
+    """Contadores del dispositivo y cuándo cambiaron; barato para que los clientes sondeen"""
+    state = await zk_service.check_changes(ip)
+    etag = device_etag(state)
+    headers = _version_headers(etag, max(state["records_changed_at"], state["users_changed_at"]))
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"device_ip": ip, "etag": etag, **state}, headers=headers)
+
+@router.delete("/{ip}/cache")
+async def invalidate_device_cache(ip: str):
+    await device_cache.invalidate_device(ip)
+    return {"message": "Caché del dispositivo invalidada"}
+
 @router.post("/{ip}/test-voice")
 async def test_device_voice(ip: str):
     try:
         await zk_service.test_voice(ip)
         return {"message": "Prueba de voz ejecutada"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error en prueba de voz en {ip}: {str(e)}")
         raise HTTPException(status_code=503, detail=f"Error en prueba de voz: {str(e)}")
 
 @router.websocket("/{ip}/realtime")
-async def websocket_realtime(websocket: WebSocket, ip: str):
+async def websocket_realtime(websocket: WebSocket, ip: str, offset: Optional[int] = Query(None, ge=0)):
     await websocket.accept()
+    # Todos los clientes del mismo dispositivo comparten una sola sesión de captura
+    subscription = capture_hub.subscribe(ip)
+
+    async def forward_events():
+        # Con offset se repite primero lo registrado desde ahí y se continúa en vivo
+        async for event in follow(subscription, offset):
+            await websocket.send_json(event)
+
+    async def wait_disconnect():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    tasks = [asyncio.create_task(forward_events()), asyncio.create_task(wait_disconnect())]
     try:
-        async def send_event(event):
-            await websocket.send_json({
-                "user_id": event["user_id"],
-                "timestamp": event["timestamp"].isoformat(),
-                "status": event["status"],
-                "punch": event["punch"],
-                "device_ip": event["device_ip"]
-            })
-        
-        # Usar timeout configurable (ej: 300 segundos = 5 minutos)
-        await zk_service.realtime_events(ip, send_event, timeout=300)
-    except Exception as e:
-        logger.error(f"Error en WebSocket realtime {ip}: {str(e)}")
-        await websocket.send_json({"error": str(e)})
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception():
+                logger.error(f"Error en WebSocket realtime {ip}: {str(task.exception())}")
     finally:
-        await websocket.close()
-
-# @router.post("/{ip}/upload-templates")
-# async def upload_templates(ip: str, templates: List[UserTemplate]):
-#     try:
-#         user_templates = [(user, templates) for user, templates in templates]
-#         await asyncio.to_thread(zk_service.save_user_templates, ip, user_templates)
-#         return {"message": "Plantillas subidas exitosamente"}
-#     except Exception as e:
-#         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        for task in tasks:
+            task.cancel()
+        capture_hub.unsubscribe(subscription)
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+@router.post("/{ip}/upload-templates")
+async def upload_templates(ip: str, templates: List[UserTemplate]):
+    try:
+        user_templates = [
+            (template.user_id, template.finger_index, base64.b64decode(template.template_data, validate=True))
+            for template in templates
+        ]
+    except binascii.Error:
+        raise HTTPException(status_code=422, detail="template_data debe venir en base64")
+    try:
+        count = await zk_service.upload_templates(ip, user_templates)
+        return {"message": "Plantillas subidas exitosamente", "templates": count}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error subiendo plantillas a {ip}: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"Error al subir plantillas: {str(e)}")
@@ -1,5 +1,7 @@
 from fastapi import APIRouter
 from app.background.tasks import device_status
+from app.services.change_tracker import change_tracker
+from app.services.shared_state import leader, shared_state
 from typing import Dict, Any
 import time
 
@@ -7,28 +9,42 @@ router = APIRouter(tags=["health"])
 
 @router.get("/health", response_model=Dict[str, Any])
 def health_check():
-    if not device_status:
-        return {
+    # Con varios workers solo el líder sondea: los demás leen su estado compartido
+    statuses = shared_state.device_statuses() if leader.enabled else device_status
+    worker = {"worker_id": leader.worker_id, "leader": leader.is_leader} if leader.enabled else None
+    if not statuses:
+        response = {
             "service_status": "running",
             "devices": {
                 "message": "Aún no se han verificado dispositivos"
             }
         }
+        if worker:
+            response["worker"] = worker
+        return response
     
-    total_devices = len(device_status)
-    online_devices = sum(1 for status in device_status.values() if status["status"] == "online")
+    total_devices = len(statuses)
+    online_devices = sum(1 for status in statuses.values() if status["status"] == "online")
     offline_devices = total_devices - online_devices
     
     current_time = time.time()
     device_details = {}
-    for ip, status in device_status.items():
+    for ip, status in statuses.items():
         last_update = status.get("timestamp", current_time)
+        last_seen = status.get("last_seen")
         device_details[ip] = {
             "status": status["status"],
-            "last_update_seconds": round(current_time - last_update, 1)
+            "last_update_seconds": round(current_time - last_update, 1),
+            "latency_ms": status.get("latency_ms"),
+            "last_seen_seconds": round(current_time - last_seen, 1) if last_seen else None,
+            "failures": status.get("failures", 0)
         }
+        changes = change_tracker.state(ip)
+        if changes:
+            device_details[ip]["records_changed_at"] = changes["records_changed_at"]
+            device_details[ip]["users_changed_at"] = changes["users_changed_at"]
     
-    return {
+    response = {
         "service_status": "running",
         "devices": {
             "total": total_devices,
@@ -36,4 +52,7 @@ def health_check():
             "offline": offline_devices,
             "details": device_details
         }
-    }
\ No newline at end of file
+    }
+    if worker:
+        response["worker"] = worker
+    return response
\ No newline at end of file
@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.services import metrics
+from app.services.capture_hub import hub
+from app.services.ws_service import manager
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    metrics.WS_CLIENTS.set(len(manager.active_connections))
+    for ip, stats in hub.stats().items():
+        metrics.CAPTURE_SUBSCRIBERS.set(stats["subscribers"], device=ip)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,41 @@
+from datetime import date
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app.config import settings
+from app.dependencies import validate_api_key
+from app.services.attendance_analytics import analytics
+import asyncio
+
+router = APIRouter(
+    dependencies=[Depends(validate_api_key)],
+    prefix="/reports",
+    tags=["reports"]
+)
+
+def _check_period(since: date, until: date):
+    if until < since:
+        raise HTTPException(status_code=400, detail="until debe ser igual o posterior a since")
+    if (until - since).days + 1 > settings.ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"El periodo no puede superar {settings.ANALYTICS_MAX_DAYS} días")
+
+@router.get("/daily", response_model=List[Dict[str, Any]])
+async def daily_attendance(
+    since: date,
+    until: date,
+    devices: Optional[List[str]] = Query(None),
+    user_id: Optional[str] = None
+):
+    """Presencia por usuario y día fusionando las marcaciones de todos los dispositivos"""
+    _check_period(since, until)
+    return await asyncio.to_thread(analytics.daily, since, until, devices, user_id)
+
+@router.get("/summary", response_model=List[Dict[str, Any]])
+async def attendance_summary(
+    since: date,
+    until: date,
+    devices: Optional[List[str]] = Query(None),
+    user_id: Optional[str] = None
+):
+    """Totales del periodo por usuario: días presentes, horas trabajadas, horas extra y marcaciones faltantes"""
+    _check_period(since, until)
+    return await asyncio.to_thread(analytics.summary, since, until, devices, user_id)
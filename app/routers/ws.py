@@ -1,14 +1,16 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+from app.dependencies import validate_ws_api_key
 from app.services.ws_service import manager
 
 router = APIRouter(tags=["websocket"])
 
-@router.websocket("/ws")
+@router.websocket("/ws", dependencies=[Depends(validate_ws_api_key)])
 async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
         while True:
-            await websocket.receive_text()
+            # Mensajes de suscripción por tópico (device_ip, event_type)
+            await manager.handle_message(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
         await manager.disconnect(websocket)
     except Exception as e:
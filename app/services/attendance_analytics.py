@@ -0,0 +1,203 @@
+from app.config import settings
+from app.services.attendance_batch import SECONDS_PER_DAY, EPOCH_ORDINAL, format_epoch
+from app.services.attendance_store import store
+from app.services.shared_state import shared_state
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, Hashable, List, NamedTuple, Optional, Tuple
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class DayTable(NamedTuple):
+    """Presencia de un día, una fila por usuario, en columnas NumPy"""
+    user_ids: np.ndarray
+    first: np.ndarray
+    last: np.ndarray
+    punches: np.ndarray
+    worked: np.ndarray
+
+def day_number(value: date) -> int:
+    return value.toordinal() - EPOCH_ORDINAL
+
+def day_date(day: int) -> date:
+    return date.fromordinal(EPOCH_ORDINAL + day)
+
+def _empty_table() -> DayTable:
+    empty = np.empty(0, dtype=np.int64)
+    return DayTable(np.empty(0, dtype=object), empty, empty, empty, empty)
+
+def compute_days(user_ids: np.ndarray, timestamps: np.ndarray, duplicate_window: int = 0) -> Dict[int, DayTable]:
+    """Agrupa las marcaciones de todos los dispositivos por (día, usuario).
+
+    Las marcaciones del mismo usuario a menos de duplicate_window segundos de la anterior
+    (p. ej. en dos terminales contiguas) cuentan como una. Las horas trabajadas son la suma
+    de los pares entrada/salida en orden; un número impar de marcaciones deja una sin pareja.
+    """
+    if len(timestamps) == 0:
+        return {}
+    users, user_index = np.unique(user_ids, return_inverse=True)
+    days = timestamps // SECONDS_PER_DAY
+    order = np.lexsort((timestamps, user_index, days))
+    user_index, days, timestamps = user_index[order], days[order], timestamps[order]
+
+    same_group = (user_index[1:] == user_index[:-1]) & (days[1:] == days[:-1])
+    keep = np.ones(len(timestamps), dtype=bool)
+    keep[1:] = ~same_group | (timestamps[1:] - timestamps[:-1] > duplicate_window)
+    user_index, days, timestamps = user_index[keep], days[keep], timestamps[keep]
+
+    starts = np.flatnonzero(np.r_[True, (user_index[1:] != user_index[:-1]) | (days[1:] != days[:-1])])
+    ends = np.r_[starts[1:], len(timestamps)]
+    counts = ends - starts
+    # Posición de cada marcación dentro de su grupo: las pares abren un tramo que cierra la siguiente
+    position = np.arange(len(timestamps)) - np.repeat(starts, counts)
+    gaps = np.zeros(len(timestamps), dtype=np.int64)
+    gaps[:-1] = timestamps[1:] - timestamps[:-1]
+    closes_pair = (position % 2 == 0) & (position + 1 < np.repeat(counts, counts))
+    worked = np.add.reduceat(np.where(closes_pair, gaps, 0), starts)
+
+    group_days = days[starts]
+    bounds = np.flatnonzero(np.r_[True, group_days[1:] != group_days[:-1], True])
+    tables = {}
+    for begin, end in zip(bounds[:-1], bounds[1:]):
+        groups = slice(begin, end)
+        tables[int(group_days[begin])] = DayTable(
+            users[user_index[starts[groups]]],
+            timestamps[starts[groups]],
+            timestamps[ends[groups] - 1],
+            counts[groups],
+            worked[groups]
+        )
+    return tables
+
+class AttendanceAnalytics:
+    """Presencia diaria y por periodo a partir del almacén local, fusionando todos los dispositivos.
+
+    Los días cerrados (anteriores a hoy) se guardan ya calculados y no se vuelven a leer;
+    una sincronización que trae marcaciones atrasadas invalida desde el día afectado.
+    """
+    def __init__(self, max_days: int = None):
+        self.max_days = max_days or settings.ANALYTICS_CACHE_DAYS
+        self._days: "OrderedDict[Tuple[Hashable, int], DayTable]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._invalidation_id = 0
+
+    def invalidate_from(self, timestamp: datetime):
+        day = day_number(timestamp.date())
+        if settings.MULTI_WORKER:
+            # La sincronización corre en el líder; los demás workers lo ven en su próxima consulta
+            shared_state.add_analytics_invalidation(day)
+        self._invalidate_days(day)
+
+    def _invalidate_days(self, day: int):
+        with self._lock:
+            for key in [key for key in self._days if key[1] >= day]:
+                del self._days[key]
+
+    def clear(self):
+        with self._lock:
+            self._days.clear()
+
+    def day_tables(self, since: date, until: date, devices: Optional[List[str]] = None) -> Dict[int, DayTable]:
+        """Tablas de los días [since, until], las cerradas desde la caché"""
+        if settings.MULTI_WORKER:
+            self._invalidation_id, day = shared_state.analytics_invalidations(self._invalidation_id)
+            if day is not None:
+                self._invalidate_days(day)
+        scope = tuple(sorted(devices)) if devices else "*"
+        first, last = day_number(since), day_number(until)
+        today = day_number(date.today())
+        tables: Dict[int, DayTable] = {}
+        missing = []
+        with self._lock:
+            for day in range(first, last + 1):
+                table = self._days.get((scope, day))
+                if table is None:
+                    missing.append(day)
+                else:
+                    self._days.move_to_end((scope, day))
+                    tables[day] = table
+            self.hits += len(tables)
+            self.misses += len(missing)
+        if not missing:
+            return tables
+
+        # Un solo rango de lectura que cubre todos los días pendientes
+        rows = store.load_punches(
+            datetime.combine(day_date(missing[0]), datetime.min.time()),
+            datetime.combine(day_date(missing[-1] + 1), datetime.min.time()),
+            devices
+        )
+        user_ids = np.array([row[0] for row in rows], dtype=object)
+        timestamps = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+        computed = compute_days(user_ids, timestamps, settings.ANALYTICS_DUPLICATE_WINDOW)
+        with self._lock:
+            for day in missing:
+                table = computed.get(day, _empty_table())
+                tables[day] = table
+                if day < today:
+                    self._days[(scope, day)] = table
+            while len(self._days) > self.max_days:
+                self._days.popitem(last=False)
+        return tables
+
+    def daily(self, since: date, until: date, devices: Optional[List[str]] = None,
+              user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Primera entrada, última salida, horas trabajadas, marcación faltante y horas extra por usuario y día"""
+        workday = settings.WORKDAY_HOURS * 3600
+        report = []
+        for day, table in sorted(self.day_tables(since, until, devices).items()):
+            rows = np.flatnonzero(table.user_ids == user_id) if user_id is not None else range(len(table.user_ids))
+            overtime = np.maximum(table.worked - workday, 0)
+            for row in rows:
+                report.append({
+                    "user_id": table.user_ids[row],
+                    "date": day_date(day).isoformat(),
+                    "first_in": format_epoch(int(table.first[row])),
+                    "last_out": format_epoch(int(table.last[row])) if table.punches[row] > 1 else None,
+                    "punches": int(table.punches[row]),
+                    "worked_hours": round(float(table.worked[row]) / 3600, 2),
+                    "overtime_hours": round(float(overtime[row]) / 3600, 2),
+                    "missing_punch": bool(table.punches[row] % 2)
+                })
+        return report
+
+    def summary(self, since: date, until: date, devices: Optional[List[str]] = None,
+                user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Totales del periodo por usuario"""
+        tables = [table for table in self.day_tables(since, until, devices).values() if len(table.user_ids)]
+        if not tables:
+            return []
+        user_ids = np.concatenate([table.user_ids for table in tables])
+        worked = np.concatenate([table.worked for table in tables])
+        punches = np.concatenate([table.punches for table in tables])
+        if user_id is not None:
+            selected = user_ids == user_id
+            user_ids, worked, punches = user_ids[selected], worked[selected], punches[selected]
+            if not len(user_ids):
+                return []
+        users, index = np.unique(user_ids, return_inverse=True)
+        overtime = np.maximum(worked - settings.WORKDAY_HOURS * 3600, 0)
+        days_present = np.bincount(index, minlength=len(users))
+        worked_total = np.bincount(index, weights=worked, minlength=len(users))
+        overtime_total = np.bincount(index, weights=overtime, minlength=len(users))
+        missing_days = np.bincount(index, weights=punches % 2, minlength=len(users))
+        return [
+            {
+                "user_id": users[row],
+                "since": since.isoformat(),
+                "until": until.isoformat(),
+                "days_present": int(days_present[row]),
+                "worked_hours": round(float(worked_total[row]) / 3600, 2),
+                "overtime_hours": round(float(overtime_total[row]) / 3600, 2),
+                "missing_punch_days": int(missing_days[row])
+            }
+            for row in range(len(users))
+        ]
+
+analytics = AttendanceAnalytics()
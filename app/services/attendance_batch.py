@@ -0,0 +1,147 @@
+from array import array
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Tuple
+import hashlib
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa el codificador de la biblioteca estándar
+    orjson = None
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+SECONDS_PER_DAY = 86400
+
+def dumps(value: Any) -> bytes:
+    """JSON compacto en bytes con el codificador más rápido disponible"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+def loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def records_digest(rows: Iterable[Tuple[str, str, int, int]]) -> str:
+    """SHA-256 de registros (user_id, hora ISO, status, punch) sin importar su orden"""
+    digest = hashlib.sha256()
+    for user_id, timestamp, status, punch in sorted(rows):
+        digest.update(f"{user_id}\x1f{timestamp}\x1f{status}\x1f{punch}\n".encode())
+    return digest.hexdigest()
+
+def to_epoch(timestamp: datetime) -> int:
+    """Segundos desde 1970 de una hora local del dispositivo (sin zona horaria)"""
+    days = timestamp.toordinal() - EPOCH_ORDINAL
+    return days * SECONDS_PER_DAY + timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second
+
+def from_epoch(seconds: int) -> datetime:
+    return EPOCH + timedelta(seconds=seconds)
+
+@lru_cache(maxsize=4096)
+def _day_prefix(day: int) -> str:
+    return date.fromordinal(EPOCH_ORDINAL + day).isoformat() + "T"
+
+def format_epoch(seconds: int) -> str:
+    """Misma salida que datetime.isoformat() para horas sin microsegundos"""
+    day, seconds = divmod(seconds, SECONDS_PER_DAY)
+    return f"{_day_prefix(day)}{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+class AttendanceRow(NamedTuple):
+    user_id: str
+    timestamp: datetime
+    status: int
+    punch: int
+
+class AttendanceBatch:
+    """Registros de asistencia en columnas paralelas.
+
+    Los datos del dispositivo son confiables: se guardan sin un objeto ni una validación
+    pydantic por registro y se serializan directamente a JSON.
+    """
+    __slots__ = ("user_ids", "timestamps", "statuses", "punches")
+
+    def __init__(self):
+        self.user_ids: List[str] = []
+        # Hora local del dispositivo en segundos desde 1970
+        self.timestamps = array("q")
+        self.statuses = array("i")
+        self.punches = array("i")
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> "AttendanceBatch":
+        batch = cls()
+        for record in records:
+            batch.append(record["user_id"], record["timestamp"], record["status"], record["punch"])
+        return batch
+
+    def append(self, user_id: str, timestamp: datetime, status: int, punch: int):
+        self.append_epoch(user_id, to_epoch(timestamp), status, punch)
+
+    def append_epoch(self, user_id: str, timestamp: int, status: int, punch: int):
+        self.user_ids.append(user_id)
+        self.timestamps.append(timestamp)
+        self.statuses.append(status)
+        self.punches.append(punch)
+
+    def extend(self, other: "AttendanceBatch"):
+        self.user_ids.extend(other.user_ids)
+        self.timestamps.extend(other.timestamps)
+        self.statuses.extend(other.statuses)
+        self.punches.extend(other.punches)
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def __getitem__(self, index: slice) -> "AttendanceBatch":
+        batch = AttendanceBatch()
+        batch.user_ids = self.user_ids[index]
+        batch.timestamps = self.timestamps[index]
+        batch.statuses = self.statuses[index]
+        batch.punches = self.punches[index]
+        return batch
+
+    def __iter__(self) -> Iterator[AttendanceRow]:
+        for user_id, timestamp, status, punch in zip(self.user_ids, self.timestamps, self.statuses, self.punches):
+            yield AttendanceRow(user_id, from_epoch(timestamp), status, punch)
+
+    def tuples(self) -> Iterator[Tuple[str, str, int, int]]:
+        """(user_id, timestamp ISO, status, punch) sin crear datetimes"""
+        return zip(self.user_ids, map(format_epoch, self.timestamps), self.statuses, self.punches)
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [
+            {"user_id": user_id, "timestamp": timestamp, "status": status, "punch": punch}
+            for user_id, timestamp, status, punch in self.tuples()
+        ]
+
+    def to_columns(self) -> Dict[str, List[Any]]:
+        """Columnas como listas JSON, para guardar el lote sin un dict por registro"""
+        return {
+            "user_ids": self.user_ids,
+            "timestamps": self.timestamps.tolist(),
+            "statuses": self.statuses.tolist(),
+            "punches": self.punches.tolist()
+        }
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, List[Any]]) -> "AttendanceBatch":
+        batch = cls()
+        batch.user_ids = list(columns["user_ids"])
+        batch.timestamps = array("q", columns["timestamps"])
+        batch.statuses = array("i", columns["statuses"])
+        batch.punches = array("i", columns["punches"])
+        return batch
+
+    def digest(self) -> str:
+        """Digest de los registros distintos, comparable con el del archivo local"""
+        return records_digest(set(self.tuples()))
+
+    def to_json(self) -> bytes:
+        """Lista JSON con la misma forma que List[AttendanceRecord]"""
+        return dumps(self.to_dicts())
+
+    def to_ndjson(self) -> bytes:
+        return b"".join(dumps(row) + b"\n" for row in self.to_dicts())
@@ -0,0 +1,248 @@
+from app.config import settings
+from app.services.attendance_batch import AttendanceBatch, records_digest
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import base64
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attendance (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    punch INTEGER NOT NULL,
+    UNIQUE (device, user_id, timestamp, status, punch)
+);
+CREATE INDEX IF NOT EXISTS idx_attendance_device_user_ts ON attendance (device, user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_attendance_device_ts ON attendance (device, timestamp);
+CREATE INDEX IF NOT EXISTS idx_attendance_ts ON attendance (timestamp);
+CREATE TABLE IF NOT EXISTS rotations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device TEXT NOT NULL,
+    rotated_at REAL NOT NULL,
+    records INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    first_timestamp TEXT,
+    last_timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_rotations_device ON rotations (device, rotated_at);
+CREATE TABLE IF NOT EXISTS sync_state (
+    device TEXT PRIMARY KEY,
+    record_count INTEGER NOT NULL DEFAULT 0,
+    last_timestamp TEXT,
+    last_sync REAL
+);
+"""
+
+def format_timestamp(value: datetime) -> str:
+    return value.strftime(TIMESTAMP_FORMAT)
+
+def encode_cursor(timestamp: str, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return timestamp, int(row_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+class AttendanceStore:
+    """Copia local indexada de la asistencia de cada dispositivo"""
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+            logger.info(f"Almacén de asistencia abierto en {self.path}")
+        return self._conn
+
+    def get_sync_state(self, device: str) -> Dict[str, Any]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT record_count, last_timestamp, last_sync FROM sync_state WHERE device = ?",
+                (device,)
+            ).fetchone()
+        if not row:
+            return {"record_count": 0, "last_timestamp": None, "last_sync": None}
+        return {"record_count": row[0], "last_timestamp": row[1], "last_sync": row[2]}
+
+    def add_records(self, device: str, records: AttendanceBatch, record_count: int) -> int:
+        """Inserta registros nuevos y avanza la marca de agua del dispositivo"""
+        # El formato ISO del lote coincide con TIMESTAMP_FORMAT
+        rows = [(device, *record) for record in records.tuples()]
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                before = conn.total_changes
+                conn.executemany(
+                    "INSERT OR IGNORE INTO attendance (device, user_id, timestamp, status, punch) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                inserted = conn.total_changes - before
+                last_timestamp = max((row[2] for row in rows), default=None)
+                conn.execute(
+                    "INSERT INTO sync_state (device, record_count, last_timestamp, last_sync) "
+                    "VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(device) DO UPDATE SET record_count = excluded.record_count, "
+                    "last_timestamp = COALESCE(MAX(excluded.last_timestamp, sync_state.last_timestamp), "
+                    "excluded.last_timestamp, sync_state.last_timestamp), "
+                    "last_sync = excluded.last_sync",
+                    (device, record_count, last_timestamp, time.time())
+                )
+        return inserted
+
+    def query(self, device: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+              user_id: Optional[str] = None, limit: int = 1000,
+              cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Consulta paginada por (timestamp, id); devuelve los registros y el siguiente cursor"""
+        clauses = ["device = ?"]
+        params: List[Any] = [device]
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(format_timestamp(since))
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(format_timestamp(until))
+        if cursor:
+            clauses.append("(timestamp, id) > (?, ?)")
+            params.extend(decode_cursor(cursor))
+        sql = (
+            "SELECT id, user_id, timestamp, status, punch FROM attendance "
+            f"WHERE {' AND '.join(clauses)} ORDER BY timestamp, id LIMIT ?"
+        )
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._connection().execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][2], rows[-1][0])
+        records = [
+            {
+                "user_id": user_id,
+                "timestamp": datetime.strptime(timestamp, TIMESTAMP_FORMAT),
+                "status": status,
+                "punch": punch
+            }
+            for _, user_id, timestamp, status, punch in rows
+        ]
+        return records, next_cursor
+
+    def last_row_id(self, device: str) -> int:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT MAX(id) FROM attendance WHERE device = ?", (device,)
+            ).fetchone()
+        return row[0] or 0
+
+    def records_after(self, device: str, row_id: int) -> List[Dict[str, Any]]:
+        """Registros insertados después de row_id, en orden de inserción"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT user_id, timestamp, status, punch FROM attendance WHERE device = ? AND id > ? ORDER BY id",
+                (device, row_id)
+            ).fetchall()
+        return [
+            {"user_id": user_id, "timestamp": timestamp, "status": status, "punch": punch}
+            for user_id, timestamp, status, punch in rows
+        ]
+
+    def load_punches(self, since: datetime, until: datetime,
+                     devices: Optional[List[str]] = None) -> List[Tuple[str, int]]:
+        """(user_id, segundos desde 1970) de todas las marcaciones del rango, de todos o algunos dispositivos"""
+        clauses = ["timestamp >= ?", "timestamp < ?"]
+        params: List[Any] = [format_timestamp(since), format_timestamp(until)]
+        if devices:
+            clauses.append(f"device IN ({', '.join('?' for _ in devices)})")
+            params.extend(devices)
+        sql = (
+            "SELECT user_id, CAST(strftime('%s', timestamp) AS INTEGER) FROM attendance "
+            f"WHERE {' AND '.join(clauses)}"
+        )
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def checkpoint(self):
+        """Lleva el WAL a la base y sincroniza a disco: lo archivado sobrevive a un corte de energía"""
+        with self._lock:
+            self._connection().execute("PRAGMA wal_checkpoint(FULL)")
+
+    def verify_archived(self, device: str, records: AttendanceBatch) -> Tuple[int, str]:
+        """Cuántos registros distintos del lote están archivados y el digest de lo archivado"""
+        rows = list(set(records.tuples()))
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS rotation_check "
+                    "(user_id TEXT, timestamp TEXT, status INTEGER, punch INTEGER)"
+                )
+                conn.execute("DELETE FROM rotation_check")
+                conn.executemany("INSERT INTO rotation_check VALUES (?, ?, ?, ?)", rows)
+                archived = conn.execute(
+                    "SELECT a.user_id, a.timestamp, a.status, a.punch FROM rotation_check c "
+                    "JOIN attendance a ON a.device = ? AND a.user_id = c.user_id AND a.timestamp = c.timestamp "
+                    "AND a.status = c.status AND a.punch = c.punch",
+                    (device,)
+                ).fetchall()
+                conn.execute("DELETE FROM rotation_check")
+        return len(archived), records_digest(archived)
+
+    def add_rotation(self, device: str, records: int, digest: str,
+                     first_timestamp: Optional[str], last_timestamp: Optional[str]):
+        """Registra el vaciado del dispositivo y reinicia su marca de agua"""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT INTO rotations (device, rotated_at, records, digest, first_timestamp, last_timestamp) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (device, time.time(), records, digest, first_timestamp, last_timestamp)
+                )
+                conn.execute("UPDATE sync_state SET record_count = 0 WHERE device = ?", (device,))
+
+    def rotations(self, device: str, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT rotated_at, records, digest, first_timestamp, last_timestamp FROM rotations "
+                "WHERE device = ? ORDER BY rotated_at DESC LIMIT ?",
+                (device, limit)
+            ).fetchall()
+        return [
+            {"rotated_at": rotated_at, "records": records, "digest": digest,
+             "first_timestamp": first_timestamp, "last_timestamp": last_timestamp}
+            for rotated_at, records, digest, first_timestamp, last_timestamp in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+store = AttendanceStore(settings.ATTENDANCE_DB_PATH)
@@ -0,0 +1,128 @@
+from app.config import settings
+from app.models.schemas import DeviceInfo, User
+from app.services.attendance_batch import AttendanceBatch, dumps, loads
+from app.services.shared_state import shared_state
+from collections import OrderedDict
+from fastapi.encoders import jsonable_encoder
+from typing import Any, Dict, Hashable, Optional, Tuple
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+class TTLCache:
+    """Caché LRU con expiración por entrada; las claves son (ip, recurso)"""
+    def __init__(self, ttl: int = None, max_entries: int = None):
+        self.ttl = ttl or settings.CACHE_TTL
+        self.max_entries = max_entries or settings.CACHE_MAX_ENTRIES
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    async def set(self, key: Hashable, value: Any, ttl: Optional[int] = None):
+        self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    async def invalidate_device(self, ip: str):
+        """Descarta todo lo cacheado de un dispositivo (tras escrituras)"""
+        for key in [key for key in self._entries if isinstance(key, tuple) and key[0] == ip]:
+            del self._entries[key]
+        logger.debug(f"Caché invalidada para {ip}")
+
+    async def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+def encode_value(resource: str, value: Any) -> bytes:
+    """JSON del valor cacheado; la asistencia se guarda en columnas"""
+    if resource == "attendance":
+        etag, batch = value
+        return dumps({"etag": etag, "batch": batch.to_columns()})
+    return dumps(jsonable_encoder(value))
+
+def decode_value(resource: str, data: bytes) -> Any:
+    value = loads(data)
+    if resource == "attendance":
+        return value["etag"], AttendanceBatch.from_columns(value["batch"])
+    if resource == "users":
+        return [User(**user) for user in value]
+    if resource == "info":
+        return DeviceInfo(**value)
+    raise ValueError(f"Recurso sin codificación para la caché compartida: {resource}")
+
+class SharedTTLCache:
+    """Misma interfaz que TTLCache pero en el estado compartido, para que todos los
+    workers vean lo mismo y una invalidación en uno valga para los demás"""
+    def __init__(self, ttl: int = None):
+        self.ttl = ttl or settings.CACHE_TTL
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key: Tuple[str, str]) -> Any:
+        found, data = shared_state.cache_get(*key)
+        if not found:
+            return MISSING
+        try:
+            return decode_value(key[1], data)
+        except Exception as e:
+            # Entrada de una versión anterior o corrupta: cuenta como fallo y se vuelve a leer
+            logger.debug(f"Entrada de caché ilegible {key}: {str(e)}")
+            return MISSING
+
+    def _set(self, key: Tuple[str, str], value: Any, ttl: float):
+        shared_state.cache_set(key[0], key[1], encode_value(key[1], value), ttl)
+
+    # SQLite y la (de)codificación van en un hilo: un bloqueo de escritura no frena el loop
+    async def get(self, key: Tuple[str, str]) -> Any:
+        value = await asyncio.to_thread(self._get, key)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: Tuple[str, str], value: Any, ttl: Optional[int] = None):
+        await asyncio.to_thread(self._set, key, value, ttl or self.ttl)
+
+    async def invalidate(self, key: Tuple[str, str]):
+        await asyncio.to_thread(shared_state.cache_delete, *key)
+
+    async def invalidate_device(self, ip: str):
+        await asyncio.to_thread(shared_state.cache_delete, ip)
+        logger.debug(f"Caché compartida invalidada para {ip}")
+
+    async def clear(self):
+        await asyncio.to_thread(shared_state.cache_delete)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": shared_state.cache_count(), "hits": self.hits, "misses": self.misses}
+
+device_cache = SharedTTLCache() if settings.MULTI_WORKER else TTLCache()
+
+def wants_fresh(cache_control: Optional[str]) -> bool:
+    """True si el cliente pidió saltarse la caché con Cache-Control: no-cache"""
+    if not cache_control:
+        return False
+    directives = {directive.strip().lower() for directive in cache_control.split(",")}
+    return "no-cache" in directives or "no-store" in directives
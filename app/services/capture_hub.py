@@ -0,0 +1,250 @@
+from app.config import settings
+from app.services import zk_service
+from app.services.event_log import event_log
+from app.services.scheduler import PRIORITY_CAPTURE
+from app.services.shared_state import leader, shared_state
+from fastapi import HTTPException
+from typing import Any, AsyncIterator, Dict, Optional, Set
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def event_payload(event: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "user_id": event["user_id"],
+        "timestamp": event["timestamp"].isoformat(),
+        "status": event["status"],
+        "punch": event["punch"],
+        "device_ip": event["device_ip"]
+    }
+
+class Subscription:
+    """Cola acotada de un suscriptor; si se llena se descarta el evento más antiguo"""
+    def __init__(self, ip: str, maxsize: int):
+        self.ip = ip
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, payload: Dict[str, Any]):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(payload)
+
+    async def get(self) -> Dict[str, Any]:
+        return await self.queue.get()
+
+class DeviceCapture:
+    """Una única sesión de captura en vivo por dispositivo, compartida por todos sus suscriptores"""
+    def __init__(self, hub: "CaptureHub", ip: str):
+        self.hub = hub
+        self.ip = ip
+        self.subscribers: Set[Subscription] = set()
+        self.stop = threading.Event()
+        # Corta solo el segmento en curso (p. ej. al dejar de ser líder); stop detiene la captura
+        self.segment = threading.Event()
+        self.events = 0
+        # Fijada por el líder: se mantiene aunque no tenga suscriptores locales
+        self.pinned = False
+        self._grace: Optional[asyncio.TimerHandle] = None
+        self.task = asyncio.create_task(self._run())
+
+    def publish(self, payload: Dict[str, Any]):
+        for subscription in list(self.subscribers):
+            subscription.put(payload)
+
+    async def _on_event(self, event: Dict[str, Any]):
+        if not leader.is_leader:
+            # Llega tras ceder el liderazgo: el registro ya es del nuevo líder
+            return
+        self.events += 1
+        # Se registra antes de publicar: todo evento entregado en vivo ya puede repetirse
+        self.publish(event_log.append(event_payload(event)))
+
+    async def _follow_log(self):
+        """En un worker que no es líder se siguen los eventos que el líder deja en el registro"""
+        await event_log.catch_up()
+        position = event_log.next_offset
+        requested = 0.0
+        while not self.stop.is_set() and not leader.is_leader:
+            # Se avisa al líder de que alguien sigue este dispositivo, para que lo capture
+            if time.monotonic() - requested >= settings.LEADER_RENEW_INTERVAL:
+                await asyncio.to_thread(shared_state.put_document, "capture", self.ip, {"worker": leader.worker_id})
+                requested = time.monotonic()
+            await asyncio.sleep(settings.EVENT_LOG_POLL_INTERVAL)
+            await event_log.catch_up()
+            end = event_log.next_offset
+            async for event in event_log.replay(position, self.ip, end):
+                self.events += 1
+                self.publish(event)
+            position = max(position, end)
+
+    async def _detach(self):
+        """Libera la sesión del dispositivo de los eventos en vivo al dejar de capturar"""
+        if self.hub._captures.get(self.ip) not in (None, self):
+            # Otra captura del mismo dispositivo ya usa la sesión registrada
+            return
+        try:
+            await zk_service.stop_realtime(self.ip, priority=PRIORITY_CAPTURE)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.warning(f"No se pudo desregistrar la captura de {self.ip}: {detail}")
+
+    async def _run(self):
+        logger.info(f"Iniciando captura compartida en {self.ip}")
+        try:
+            while not self.stop.is_set():
+                try:
+                    self.segment = threading.Event()
+                    if self.stop.is_set():
+                        break
+                    if not leader.is_leader:
+                        await self._detach()
+                        await self._follow_log()
+                        continue
+                    # Se captura por segmentos para poder cortarla (p. ej. al ceder el liderazgo);
+                    # con el backend asyncio las demás operaciones comparten la sesión mientras tanto
+                    await zk_service.realtime_events(
+                        self.ip, self._on_event, timeout=settings.CAPTURE_SEGMENT,
+                        stop=self.segment, priority=PRIORITY_CAPTURE
+                    )
+                except Exception as e:
+                    detail = e.detail if isinstance(e, HTTPException) else str(e)
+                    logger.error(f"Error en captura compartida de {self.ip}: {detail}")
+                    self.publish({"error": detail, "device_ip": self.ip})
+                    await asyncio.sleep(settings.CAPTURE_RETRY_DELAY)
+        finally:
+            # Fuera del hub antes de esperar: un suscriptor nuevo abre otra captura en vez de
+            # quedar en esta, que ya está saliendo
+            self.hub._finished(self)
+            await self._detach()
+            logger.info(f"Captura compartida detenida en {self.ip}")
+
+    def reactivate(self):
+        # Un suscriptor que llega durante el periodo de gracia reactiva la captura
+        if self._grace is not None:
+            self._grace.cancel()
+            self._grace = None
+        self.stop.clear()
+
+    def add(self, subscription: Subscription):
+        self.reactivate()
+        self.subscribers.add(subscription)
+
+    def remove(self, subscription: Subscription):
+        self.subscribers.discard(subscription)
+        self.release()
+
+    def release(self):
+        if not self.subscribers and not self.pinned and self._grace is None:
+            loop = asyncio.get_running_loop()
+            self._grace = loop.call_later(settings.CAPTURE_GRACE_PERIOD, self._expire)
+
+    def _expire(self):
+        self._grace = None
+        if not self.subscribers and not self.pinned:
+            self.halt()
+
+    def halt(self):
+        self.stop.set()
+        self.segment.set()
+
+async def follow(subscription: Subscription, offset: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Eventos de la suscripción; con offset, primero repite el registro desde ahí.
+
+    La suscripción ya existe antes de leer el registro, así que lo repetido y lo que llega
+    en vivo se solapan y se descarta por offset. Si la cola del suscriptor pierde eventos,
+    el hueco se rellena desde el registro.
+    """
+    if offset is None:
+        while True:
+            yield await subscription.get()
+    await event_log.catch_up()
+    earliest = event_log.earliest_offset
+    if offset < earliest:
+        yield {
+            "warning": "Los eventos anteriores ya no están en el registro",
+            "earliest_offset": earliest,
+            "device_ip": subscription.ip
+        }
+    end = event_log.next_offset
+    async for event in event_log.replay(offset, subscription.ip, end):
+        yield event
+    next_offset = max(offset, end)
+    dropped = subscription.dropped
+    while True:
+        event = await subscription.get()
+        event_offset = event.get("offset")
+        if event_offset is None:
+            yield event
+            continue
+        if event_offset < next_offset:
+            continue
+        if subscription.dropped != dropped:
+            dropped = subscription.dropped
+            async for missed in event_log.replay(next_offset, subscription.ip, event_offset):
+                yield missed
+        next_offset = event_offset + 1
+        yield event
+
+class CaptureHub:
+    def __init__(self):
+        self._captures: Dict[str, DeviceCapture] = {}
+
+    def subscribe(self, ip: str) -> Subscription:
+        """Suscribe al dispositivo; la captura arranca con el primer suscriptor"""
+        capture = self._captures.get(ip)
+        if capture is None:
+            capture = self._captures[ip] = DeviceCapture(self, ip)
+        subscription = Subscription(ip, settings.CAPTURE_QUEUE_SIZE)
+        capture.add(subscription)
+        return subscription
+
+    def pin(self, ip: str):
+        """Mantiene la captura abierta sin suscriptor, para que otros workers la sigan en el registro"""
+        capture = self._captures.get(ip)
+        if capture is None:
+            capture = self._captures[ip] = DeviceCapture(self, ip)
+        capture.reactivate()
+        capture.pinned = True
+
+    def unpin(self, ip: str):
+        capture = self._captures.get(ip)
+        if capture is not None:
+            capture.pinned = False
+            capture.release()
+
+    def interrupt(self):
+        """Corta los segmentos de captura en curso; cada captura decide de nuevo si captura o sigue el registro"""
+        for capture in self._captures.values():
+            capture.segment.set()
+
+    def unsubscribe(self, subscription: Subscription):
+        capture = self._captures.get(subscription.ip)
+        if capture is not None:
+            capture.remove(subscription)
+
+    def _finished(self, capture: DeviceCapture):
+        if self._captures.get(capture.ip) is capture:
+            del self._captures[capture.ip]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            ip: {
+                "subscribers": len(capture.subscribers),
+                "events": capture.events,
+                "dropped": sum(subscription.dropped for subscription in capture.subscribers)
+            }
+            for ip, capture in self._captures.items()
+        }
+
+    async def shutdown(self):
+        captures = list(self._captures.values())
+        for capture in captures:
+            capture.halt()
+        await asyncio.gather(*(capture.task for capture in captures), return_exceptions=True)
+
+hub = CaptureHub()
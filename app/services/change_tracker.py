@@ -0,0 +1,107 @@
+from app.config import settings
+from app.services.shared_state import shared_state
+from typing import Any, Dict, NamedTuple, Optional
+import asyncio
+import logging
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+class DeviceSizes(NamedTuple):
+    """Contadores del dispositivo, leídos con un solo comando (CMD_GET_FREE_SIZES)"""
+    users: int
+    fingers: int
+    records: int
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Comparación débil de If-None-Match, como pide RFC 9110 para GET"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    weak = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == weak:
+            return True
+    return False
+
+def tail_marker(tail: Optional[bytes]) -> Optional[str]:
+    """Huella corta del final del log: distingue un log vaciado y rellenado hasta el mismo tamaño"""
+    return f"{zlib.crc32(tail):08x}" if tail else None
+
+class ChangeTracker:
+    """Último estado conocido de los contadores de cada dispositivo y cuándo cambiaron.
+
+    Un contador de registros menor que el anterior indica que el log se borró: la
+    generación sube para que la ETag cambie aunque el log vuelva a tener el mismo tamaño.
+    Si además se leyó el final del log (tail), un mismo contador con otro final también
+    sube la generación. Con varios workers el estado vive en el almacén compartido.
+    """
+    def __init__(self):
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, ip: str) -> Optional[Dict[str, Any]]:
+        if settings.MULTI_WORKER:
+            return shared_state.get_document("changes", ip)
+        return self._states.get(ip)
+
+    def _save(self, ip: str, state: Dict[str, Any]):
+        if settings.MULTI_WORKER:
+            shared_state.put_document("changes", ip, state)
+        else:
+            self._states[ip] = state
+
+    async def observe(self, ip: str, sizes: DeviceSizes, tail: Optional[str] = None) -> Dict[str, Any]:
+        """Registra una lectura de contadores (y, si se leyó, la huella del final del log)"""
+        if settings.MULTI_WORKER:
+            # El estado compartido es SQLite: fuera del loop
+            return await asyncio.to_thread(self._observe, ip, sizes, tail)
+        return self._observe(ip, sizes, tail)
+
+    def _observe(self, ip: str, sizes: DeviceSizes, tail: Optional[str] = None) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            previous = self._load(ip)
+            if previous is None:
+                state = {"generation": 0, **sizes._asdict(), "tail": tail, "checked_at": now,
+                         "records_changed_at": now, "users_changed_at": now}
+            else:
+                state = dict(previous, checked_at=now)
+                if sizes.records != previous["records"]:
+                    logger.debug(f"Asistencia de {ip} cambió: {previous['records']} -> {sizes.records} registros")
+                    state["records_changed_at"] = now
+                    if sizes.records < previous["records"]:
+                        state["generation"] += 1
+                    # Sin leerlo, el final de un log con otro tamaño es desconocido
+                    state["tail"] = tail
+                elif tail is not None:
+                    if previous.get("tail") not in (None, tail):
+                        logger.debug(f"El log de {ip} se reemplazó con el mismo número de registros")
+                        state["records_changed_at"] = now
+                        state["generation"] += 1
+                    state["tail"] = tail
+                if sizes.users != previous["users"] or sizes.fingers != previous["fingers"]:
+                    state["users_changed_at"] = now
+                state.update(sizes._asdict())
+            self._save(ip, state)
+        return state
+
+    def state(self, ip: str) -> Optional[Dict[str, Any]]:
+        """Bloqueante con MULTI_WORKER: se llama desde rutas síncronas (threadpool)"""
+        with self._lock:
+            return self._load(ip)
+
+def attendance_etag(state: Dict[str, Any]) -> str:
+    # Débil: contadores más la huella del final del log cuando el backend puede leerlo
+    tail = state.get("tail")
+    suffix = f".{tail}" if tail else ""
+    return f'W/"a{state["generation"]}.{state["records"]}{suffix}"'
+
+def device_etag(state: Dict[str, Any]) -> str:
+    return f'W/"d{state["generation"]}.{state["users"]}.{state["fingers"]}.{state["records"]}"'
+
+change_tracker = ChangeTracker()
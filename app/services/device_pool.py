@@ -0,0 +1,184 @@
+from app.config import settings
+from app.services import metrics
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class PooledSession:
+    def __init__(self, device):
+        self.device = device
+        self.password = device.password
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.last_checked = self.created_at
+        self.in_use = False
+        self.uses = 0
+
+class DevicePool:
+    """Sesiones persistentes por IP para no repetir el handshake en cada llamada"""
+    def __init__(self, factory: Callable, max_sessions: int = None,
+                 idle_timeout: int = None, health_check_interval: int = None):
+        self._factory = factory
+        self.max_sessions = max_sessions or settings.POOL_MAX_SESSIONS
+        self.idle_timeout = idle_timeout or settings.POOL_IDLE_TIMEOUT
+        self.health_check_interval = health_check_interval or settings.POOL_HEALTH_CHECK_INTERVAL
+        self._sessions: Dict[str, PooledSession] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._slots = asyncio.Condition()
+        self._opening = 0
+
+    @property
+    def multiplexed(self) -> bool:
+        """Si las sesiones reciben eventos en vivo sin dejar de atender comandos"""
+        return getattr(self._factory, "multiplexed", False)
+
+    def streaming_device(self, ip: str):
+        """Sesión del dispositivo registrada para eventos en vivo, sin tomarla en préstamo"""
+        entry = self._sessions.get(ip)
+        return entry.device if entry is not None and entry.device.streaming else None
+
+    async def _run(self, phase: str, ip: str, func, *args):
+        return await metrics.timed_call(phase, ip, func, *args)
+
+    @asynccontextmanager
+    async def session(self, ip: str, password: Optional[str] = None):
+        """Presta la sesión del dispositivo en exclusiva durante el bloque"""
+        lock = self._locks.setdefault(ip, asyncio.Lock())
+        async with lock:
+            entry = await self._checkout(ip, password)
+            try:
+                yield entry.device
+            except BaseException as e:
+                # Estado de la sesión desconocido: se reconecta en el próximo préstamo, salvo que
+                # sea la sesión compartida con la captura en vivo y el socket siga sano
+                if not await self._recover(ip, entry, e):
+                    await self._discard(ip, entry)
+                raise
+            else:
+                entry.last_used = time.monotonic()
+                entry.uses += 1
+            finally:
+                entry.in_use = False
+                async with self._slots:
+                    self._slots.notify_all()
+
+    async def _recover(self, ip: str, entry: PooledSession, error: BaseException) -> bool:
+        """Conserva una sesión con eventos en vivo si el comando se canceló o falló sin romper el socket.
+
+        Un plazo, una desconexión del cliente o un rechazo del dispositivo no afectan a la
+        conexión: se vuelve a habilitar el dispositivo y a reanudar los eventos para no
+        cortar la captura. Solo un socket caído obliga a reconectar.
+        """
+        device = entry.device
+        if not device.streaming or isinstance(error, OSError) or not device.connected:
+            return False
+        try:
+            await self._run("restore_events", ip, device.restore_events)
+        except Exception as e:
+            logger.warning(f"No se pudo reanudar la captura en {ip}: {str(e)}")
+            return False
+        return True
+
+    async def _checkout(self, ip: str, password: Optional[str]) -> PooledSession:
+        entry = self._sessions.get(ip)
+        if entry:
+            entry.in_use = True
+            if (password or settings.DEVICE_PASSWORD) != entry.password:
+                logger.info(f"Contraseña distinta para {ip}, reabriendo sesión")
+                await self._discard(ip, entry)
+                entry = None
+            elif time.monotonic() - entry.last_checked > self.health_check_interval:
+                if await self._run("health_check", ip, entry.device.is_alive):
+                    entry.last_checked = time.monotonic()
+                else:
+                    logger.warning(f"Sesión inactiva en {ip}, reconectando")
+                    await self._discard(ip, entry)
+                    entry = None
+        if entry is None:
+            entry = await self._open(ip, password)
+        entry.in_use = True
+        return entry
+
+    async def _open(self, ip: str, password: Optional[str]) -> PooledSession:
+        victims = []
+        async with self._slots:
+            while len(self._sessions) + self._opening >= self.max_sessions:
+                victim = self._lru_idle()
+                if victim:
+                    victims.append(self._sessions.pop(victim.device.ip))
+                    continue
+                await self._slots.wait()
+            self._opening += 1
+        for victim in victims:
+            logger.info(f"Límite de sesiones alcanzado, cerrando {victim.device.ip}")
+            await self._close(victim)
+        try:
+            device = self._factory(ip, password)
+            await self._run("connect", ip, device.connect)
+            entry = PooledSession(device)
+            self._sessions[ip] = entry
+            metrics.POOL_SESSIONS.set(len(self._sessions))
+            return entry
+        finally:
+            async with self._slots:
+                self._opening -= 1
+                self._slots.notify_all()
+
+    def _lru_idle(self) -> Optional[PooledSession]:
+        # Una sesión con captura en vivo no está inactiva aunque nadie la tenga prestada
+        idle = [
+            entry for entry in self._sessions.values()
+            if not entry.in_use and not entry.device.streaming
+        ]
+        return min(idle, key=lambda entry: entry.last_used) if idle else None
+
+    async def _discard(self, ip: str, entry: PooledSession):
+        if self._sessions.get(ip) is entry:
+            del self._sessions[ip]
+            metrics.POOL_SESSIONS.set(len(self._sessions))
+        await self._close(entry)
+        async with self._slots:
+            self._slots.notify_all()
+
+    async def _close(self, entry: PooledSession):
+        try:
+            await self._run("disconnect", entry.device.ip, entry.device.disconnect)
+        except Exception as e:
+            logger.warning(f"Error cerrando sesión {entry.device.ip}: {str(e)}")
+
+    async def evict_idle(self):
+        """Cierra las sesiones sin uso por más de idle_timeout"""
+        now = time.monotonic()
+        for ip, entry in list(self._sessions.items()):
+            if not entry.in_use and not entry.device.streaming and now - entry.last_used > self.idle_timeout:
+                logger.info(f"Cerrando sesión inactiva de {ip}")
+                await self._discard(ip, entry)
+
+    async def run_reaper(self):
+        while True:
+            await asyncio.sleep(max(1, min(self.idle_timeout, self.health_check_interval) / 2))
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Error liberando sesiones inactivas: {str(e)}")
+
+    async def close_all(self):
+        for ip, entry in list(self._sessions.items()):
+            await self._discard(ip, entry)
+
+    def stats(self) -> Dict[str, Dict]:
+        now = time.monotonic()
+        return {
+            ip: {
+                "in_use": entry.in_use,
+                "streaming": entry.device.streaming,
+                "uses": entry.uses,
+                "idle_seconds": round(now - entry.last_used, 1),
+                "age_seconds": round(now - entry.created_at, 1)
+            }
+            for ip, entry in self._sessions.items()
+        }
@@ -0,0 +1,139 @@
+from app.config import settings
+from typing import Any, Dict, List, Optional
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def normalize_ip(ip: str) -> str:
+    """IP en forma canónica; lanza ValueError si no es una dirección válida"""
+    return str(ipaddress.ip_address(str(ip).strip()))
+
+class DeviceRegistry:
+    """Dispositivos de la flota: KNOWN_DEVICES más los del archivo DEVICE_REGISTRY_FILE.
+
+    El archivo se vigila y se recarga al cambiar, y la API lo reescribe al agregar o quitar
+    dispositivos: la flota cambia sin reiniciar y todos los workers ven la misma. Sin archivo
+    los cambios de la API solo duran lo que el proceso.
+    """
+    def __init__(self, path: str, known: List[str]):
+        self.path = path
+        self._known = {ip: {"ip": ip, "source": "env"} for ip in known}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._mtime: Optional[int] = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def ips(self) -> List[str]:
+        return list(dict.fromkeys([*self._known, *self._entries]))
+
+    def __contains__(self, ip: str) -> bool:
+        return ip in self._known or ip in self._entries
+
+    def get(self, ip: str) -> Optional[Dict[str, Any]]:
+        if ip not in self:
+            return None
+        return {**self._entries.get(ip, {}), **self._known.get(ip, {})}
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [self.get(ip) for ip in self.ips()]
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        # Se acepta {"devices": [...]} o directamente la lista, de IPs o de objetos con "ip"
+        items = data.get("devices", []) if isinstance(data, dict) else data
+        entries = {}
+        for item in items:
+            entry = {"ip": item} if isinstance(item, str) else dict(item)
+            entry["ip"] = normalize_ip(entry["ip"])
+            entry.setdefault("source", "file")
+            entries[entry["ip"]] = entry
+        return entries
+
+    def _write(self, entries: Dict[str, Dict[str, Any]]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Reemplazo atómico: quien vigila el archivo nunca lo lee a medias
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({"devices": list(entries.values())}, f, indent=2, ensure_ascii=False)
+        os.replace(temporary, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def reload(self) -> bool:
+        """Relee el archivo si cambió desde la última lectura; True si cambió la flota"""
+        if not self.path:
+            return False
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime
+            try:
+                entries = self._read() if mtime is not None else {}
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                # Se conserva la flota anterior hasta que el archivo vuelva a cambiar
+                logger.error(f"Registro de dispositivos inválido en {self.path}: {str(e)}")
+                return False
+            if entries == self._entries:
+                return False
+            added = entries.keys() - self._entries.keys()
+            removed = self._entries.keys() - entries.keys()
+            self._entries = entries
+        logger.info(f"Registro de dispositivos recargado: +{len(added)} -{len(removed)} ({len(self.ips())} en total)")
+        return True
+
+    def add(self, ip: str, source: str = "api", **details: Any) -> Dict[str, Any]:
+        """Agrega o actualiza un dispositivo; lanza ValueError si la IP no es válida"""
+        ip = normalize_ip(ip)
+        self.reload()
+        with self._lock:
+            entries = dict(self._entries)
+            previous = entries.get(ip, {})
+            entry = {**previous, **{key: value for key, value in details.items() if value is not None},
+                     "ip": ip, "source": previous.get("source", source)}
+            entry.setdefault("added_at", time.time())
+            entries[ip] = entry
+            if self.path:
+                self._write(entries)
+            self._entries = entries
+        logger.info(f"Dispositivo {ip} agregado al registro ({entry['source']})")
+        return self.get(ip)
+
+    def remove(self, ip: str) -> bool:
+        """Quita un dispositivo; los definidos en KNOWN_DEVICES no se pueden quitar en caliente"""
+        ip = normalize_ip(ip)
+        if ip in self._known:
+            raise ValueError(f"{ip} está definido en KNOWN_DEVICES")
+        self.reload()
+        with self._lock:
+            if ip not in self._entries:
+                return False
+            entries = dict(self._entries)
+            del entries[ip]
+            if self.path:
+                self._write(entries)
+            self._entries = entries
+        logger.info(f"Dispositivo {ip} quitado del registro")
+        return True
+
+    async def watch(self):
+        """Recarga el archivo cada DEVICE_REGISTRY_WATCH_INTERVAL si fue modificado"""
+        while True:
+            await asyncio.sleep(settings.DEVICE_REGISTRY_WATCH_INTERVAL)
+            try:
+                await asyncio.to_thread(self.reload)
+            except Exception as e:
+                logger.error(f"Error recargando el registro de dispositivos: {str(e)}")
+
+registry = DeviceRegistry(settings.DEVICE_REGISTRY_FILE, settings.KNOWN_DEVICES)
@@ -0,0 +1,132 @@
+from app.config import settings, check_compatibility, DeviceInfo as CompatibilityInfo
+from app.services import metrics, zk_service
+from app.services.device_registry import registry
+from app.services.scheduler import PRIORITY_BACKGROUND
+from app.services.zk_async import AsyncZK
+from app.utils.network import tcp_probe
+from typing import Any, Dict, List, Optional
+from zk import ZK
+import asyncio
+import ipaddress
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+def expand_networks(networks: List[str], max_hosts: Optional[int] = None) -> List[str]:
+    """Hosts de las subredes (CIDR o IP suelta), sin duplicados; ValueError si superan max_hosts"""
+    max_hosts = max_hosts or settings.DISCOVERY_MAX_HOSTS
+    if not networks:
+        raise ValueError("Indique al menos una subred")
+    hosts: Dict[str, None] = {}
+    for network in networks:
+        parsed = ipaddress.ip_network(network.strip(), strict=False)
+        # Se comprueba antes de enumerar, para no materializar una /8 por error
+        if parsed.num_addresses - 2 > max_hosts - len(hosts):
+            raise ValueError(f"El barrido supera DISCOVERY_MAX_HOSTS ({max_hosts} hosts)")
+        hosts.update((str(host), None) for host in parsed.hosts())
+    if len(hosts) > max_hosts:
+        raise ValueError(f"El barrido supera DISCOVERY_MAX_HOSTS ({max_hosts} hosts)")
+    return list(hosts)
+
+def identify_blocking(ip: str, port: int, timeout: float) -> Dict[str, Any]:
+    """Identificación con la librería zk, la que usa ZK_BACKEND=zk"""
+    conn = ZK(ip, port=port, timeout=timeout, password=settings.DEVICE_PASSWORD, ommit_ping=True).connect()
+    try:
+        return {
+            "platform": conn.get_platform(),
+            "firmware_version": conn.get_firmware_version(),
+            "device_name": conn.get_device_name(),
+            "serial_number": conn.get_serialnumber()
+        }
+    finally:
+        conn.disconnect()
+
+async def identify(ip: str, port: int, timeout: float) -> Dict[str, Any]:
+    """Plataforma, firmware y nombre del terminal, y si es compatible según COMPATIBLE_DEVICES"""
+    if ip in registry and port == settings.DEVICE_PORT:
+        # Un dispositivo de la flota ya tiene sesión en el pool: no se abre otra conexión
+        info = await zk_service.get_device_info(ip, priority=PRIORITY_BACKGROUND)
+        details = {
+            "platform": info.platform,
+            "firmware_version": info.firmware_version,
+            "device_name": info.device_name,
+            "serial_number": info.serial_number
+        }
+    elif settings.ZK_BACKEND == "zk":
+        # Se identifica con el mismo cliente que después usará el servicio con el terminal
+        details = await metrics.run_blocking(identify_blocking, ip, port, timeout)
+    else:
+        client = AsyncZK(ip, port=port, timeout=timeout, password=int(settings.DEVICE_PASSWORD))
+        try:
+            await client.connect()
+            details = {
+                "platform": await client.get_option(b"~Platform"),
+                "firmware_version": await client.get_firmware_version(),
+                "device_name": await client.get_option(b"~DeviceName"),
+                "serial_number": await client.get_option(b"~SerialNumber")
+            }
+        finally:
+            await client.disconnect()
+    details["compatible"] = check_compatibility(
+        CompatibilityInfo(details["platform"], details["firmware_version"])
+    )
+    return details
+
+async def discover(networks: List[str], port: Optional[int] = None, concurrency: Optional[int] = None,
+                   timeout: Optional[float] = None, register: bool = False) -> Dict[str, Any]:
+    """Barre las subredes buscando terminales ZK en el puerto del dispositivo.
+
+    Cada host se sondea con un connect TCP de plazo corto, con hasta DISCOVERY_CONCURRENCY a la
+    vez, así que el barrido dura unos pocos plazos aunque la mayoría de hosts no responda. Los
+    que aceptan la conexión se identifican por protocolo ZK; con register los compatibles se
+    agregan al registro.
+    """
+    hosts = expand_networks(networks)
+    port = port or settings.DEVICE_PORT
+    timeout = timeout or settings.DISCOVERY_TIMEOUT
+    limit = asyncio.Semaphore(concurrency or settings.DISCOVERY_CONCURRENCY)
+    started = time.monotonic()
+
+    async def probe(ip: str) -> Optional[Dict[str, Any]]:
+        async with limit:
+            try:
+                latency = await tcp_probe(ip, port, timeout)
+            except (OSError, asyncio.TimeoutError):
+                return None
+            hit = {"ip": ip, "latency_ms": round(latency, 1), "registered": ip in registry}
+            try:
+                # La identificación usa un plazo de dispositivo: el handshake ZK es más lento que el connect
+                hit.update(await identify(ip, port, max(timeout, settings.PROBE_TIMEOUT)))
+            except Exception as e:
+                detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+                logger.debug(f"{ip}:{port} abierto pero no identificado: {detail}")
+                hit.update({"compatible": False, "error": detail})
+            return hit
+
+    results = await asyncio.gather(*(probe(ip) for ip in hosts))
+    found = [hit for hit in results if hit is not None]
+    added = []
+    if register:
+        for hit in found:
+            if hit["compatible"] and not hit["registered"]:
+                await asyncio.to_thread(
+                    registry.add, hit["ip"], source="discovery", name=hit.get("device_name"),
+                    platform=hit["platform"], firmware_version=hit["firmware_version"],
+                    serial_number=hit.get("serial_number")
+                )
+                hit["registered"] = True
+                added.append(hit["ip"])
+    elapsed = time.monotonic() - started
+    logger.info(f"Descubrimiento en {', '.join(networks)}: {len(hosts)} hosts, {len(found)} con el puerto "
+                f"{port} abierto, {len(added)} agregados ({elapsed:.1f}s)")
+    return {
+        "networks": networks,
+        "port": port,
+        "scanned": len(hosts),
+        "open": len(found),
+        "compatible": sum(1 for hit in found if hit["compatible"]),
+        "added": added,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "devices": found
+    }
@@ -0,0 +1,353 @@
+from app.config import settings
+from bisect import bisect_right
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".log"
+# Basta con el final del segmento para encontrar la última línea completa
+TAIL_BYTES = 64 * 1024
+# Cada cuántas líneas se anota la posición en el índice disperso de un segmento
+INDEX_INTERVAL = 128
+INDEX_READ_BYTES = 1024 * 1024
+
+class Segment:
+    """Archivo de eventos con offsets consecutivos desde base, uno por línea.
+
+    index[k] es la posición en bytes de la línea con offset base + k * INDEX_INTERVAL; cubre
+    las primeras lines líneas, que ocupan indexed bytes. Permite ir directo a un offset sin
+    decodificar todo lo anterior.
+    """
+    def __init__(self, base: int, path: str, size: int = 0):
+        self.base = base
+        self.path = path
+        self.size = size
+        self.index: List[int] = []
+        self.indexed = 0
+        self.lines = 0
+
+class EventLog:
+    """Registro de eventos en vivo de solo anexado, en segmentos con offsets crecientes.
+
+    Cada línea es un evento JSON con su offset. Los segmentos rotan por tamaño, los más
+    antiguos se borran por tamaño total o antigüedad, y fsync se hace por lotes en un hilo:
+    tras EVENT_LOG_FSYNC_BATCH eventos o EVENT_LOG_FSYNC_INTERVAL segundos. Con varios workers
+    solo escribe el líder; los demás abren el registro en modo lectura y lo releen con refresh().
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.segments: List[Segment] = []
+        self.next_offset = 0
+        self._file = None
+        self._unsynced = 0
+        self._sync_handle: Optional[asyncio.TimerHandle] = None
+        self._syncs: Set[asyncio.Task] = set()
+        self._opened = False
+        # Protege los índices: los extienden las lecturas en hilos y append en el loop
+        self._index_lock = threading.Lock()
+        self.readonly = settings.MULTI_WORKER
+
+    def _open(self):
+        if self._opened:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+        if not self.readonly:
+            if self.segments:
+                self._file = open(self.segments[-1].path, "ab")
+            else:
+                self._roll()
+        self._opened = True
+        logger.info(f"Registro de eventos abierto en {self.directory} (siguiente offset {self.next_offset})")
+
+    def _scan(self):
+        # Los segmentos ya conocidos conservan su índice entre relecturas
+        known = {segment.path: segment for segment in self.segments}
+        segments = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(SEGMENT_SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    size = os.path.getsize(path)
+                except FileNotFoundError:
+                    continue
+                segment = known.get(path) or Segment(int(name[:-len(SEGMENT_SUFFIX)]), path)
+                segment.size = size
+                segments.append(segment)
+        self.segments = segments
+        if segments:
+            self.next_offset = self._recover(segments[-1])
+
+    def _recover(self, segment: Segment) -> int:
+        """Siguiente offset según la última línea completa; el escritor descarta una escritura a medias"""
+        with open(segment.path, "rb" if self.readonly else "rb+") as file:
+            tail_start = max(0, segment.size - TAIL_BYTES)
+            file.seek(tail_start)
+            data = file.read()
+            end = data.rfind(b"\n") + 1
+            if end < len(data) and not self.readonly:
+                file.truncate(tail_start + end)
+                segment.size = tail_start + end
+        lines = data[:end].splitlines()
+        if not lines:
+            return segment.base
+        return json.loads(lines[-1])["offset"] + 1
+
+    def refresh(self):
+        """En modo lectura vuelve a mirar los segmentos para ver lo que escribió el líder"""
+        if not self.readonly:
+            self._open()
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+        self._opened = True
+
+    async def catch_up(self):
+        """En modo lectura, deja next_offset al día antes de repetir"""
+        if self.readonly:
+            await asyncio.to_thread(self.refresh)
+
+    def set_writer(self, writer: bool):
+        """Con varios workers solo el líder escribe; los demás siguen el registro en modo lectura"""
+        if self.readonly != (not writer):
+            self.close()
+            self.readonly = not writer
+
+    def _roll(self):
+        if self._file is not None:
+            self._file.flush()
+            self._in_background(self._close_file, self._file)
+        path = os.path.join(self.directory, f"{self.next_offset:020d}{SEGMENT_SUFFIX}")
+        self.segments.append(Segment(self.next_offset, path))
+        self._file = open(path, "ab")
+        self._unsynced = 0
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        # Nunca se borra el segmento activo
+        now = time.time()
+        total = sum(segment.size for segment in self.segments)
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            try:
+                expired = now - os.path.getmtime(oldest.path) > settings.EVENT_LOG_RETENTION_HOURS * 3600
+            except FileNotFoundError:
+                expired = True
+            if total <= settings.EVENT_LOG_RETENTION_BYTES and not expired:
+                break
+            self.segments.pop(0)
+            total -= oldest.size
+            try:
+                os.remove(oldest.path)
+            except FileNotFoundError:
+                pass
+            logger.info(f"Segmento de eventos {oldest.base} eliminado por retención")
+
+    @property
+    def earliest_offset(self) -> int:
+        self._open()
+        return self.segments[0].base if self.segments else self.next_offset
+
+    def append(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Asigna offset al evento y lo escribe; queda visible para las repeticiones al instante"""
+        self._open()
+        record = {"offset": self.next_offset, **event}
+        line = json.dumps(record, default=str).encode() + b"\n"
+        if self.segments[-1].size and self.segments[-1].size + len(line) > settings.EVENT_LOG_SEGMENT_BYTES:
+            self._roll()
+        segment = self.segments[-1]
+        self._file.write(line)
+        self._file.flush()
+        with self._index_lock:
+            if segment.indexed == segment.size:
+                if segment.lines % INDEX_INTERVAL == 0:
+                    segment.index.append(segment.size)
+                segment.lines += 1
+                segment.indexed += len(line)
+            segment.size += len(line)
+        self.next_offset += 1
+        self._unsynced += 1
+        self._schedule_sync()
+        return record
+
+    def _schedule_sync(self):
+        if self._unsynced >= settings.EVENT_LOG_FSYNC_BATCH:
+            self._sync_soon()
+        elif self._sync_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.sync()
+                return
+            self._sync_handle = loop.call_later(settings.EVENT_LOG_FSYNC_INTERVAL, self._sync_soon)
+
+    def _sync_soon(self):
+        """fsync del segmento activo fuera del loop; la retención se aplica al terminar"""
+        if self._sync_handle is not None:
+            self._sync_handle.cancel()
+            self._sync_handle = None
+        if self._file is None or not self._unsynced:
+            return
+        self._unsynced = 0
+        self._in_background(self._fsync, self._file.fileno())
+
+    def _in_background(self, function, *args):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            function(*args)
+            self._enforce_retention()
+            return
+        task = asyncio.create_task(asyncio.to_thread(function, *args))
+        self._syncs.add(task)
+        task.add_done_callback(self._synced)
+
+    def _synced(self, task: asyncio.Task):
+        self._syncs.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error sincronizando el registro de eventos: {str(task.exception())}")
+        if self._opened and not self.readonly:
+            self._enforce_retention()
+
+    @staticmethod
+    def _fsync(fd: int):
+        try:
+            os.fsync(fd)
+        except OSError:
+            # El archivo se cerró mientras tanto: close() ya lo sincronizó
+            pass
+
+    @staticmethod
+    def _close_file(file):
+        os.fsync(file.fileno())
+        file.close()
+
+    def sync(self):
+        """fsync inmediato en el hilo actual (cierre o uso fuera del loop)"""
+        if self._sync_handle is not None:
+            self._sync_handle.cancel()
+            self._sync_handle = None
+        if self._file is None or not self._unsynced:
+            return
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._enforce_retention()
+
+    def _extend_index(self, segment: Segment):
+        """Indexa las líneas completas escritas desde la última vez (por otro proceso o antes de abrir)"""
+        while True:
+            with self._index_lock:
+                indexed, lines = segment.indexed, segment.lines
+            try:
+                with open(segment.path, "rb") as file:
+                    file.seek(indexed)
+                    data = file.read(INDEX_READ_BYTES)
+            except FileNotFoundError:
+                return
+            end = data.rfind(b"\n") + 1
+            if not end:
+                return
+            positions = []
+            position = 0
+            while position < end:
+                if lines % INDEX_INTERVAL == 0:
+                    positions.append(indexed + position)
+                position = data.index(b"\n", position) + 1
+                lines += 1
+            with self._index_lock:
+                if segment.indexed != indexed:
+                    # append() ya avanzó el índice mientras se leía
+                    continue
+                segment.index.extend(positions)
+                segment.indexed = indexed + end
+                segment.lines = lines
+            if end < len(data) or len(data) < INDEX_READ_BYTES:
+                return
+
+    def _seek(self, segment: Segment, offset: int) -> Optional[Tuple[int, int]]:
+        """(posición, offset) de la entrada del índice más cercana antes de offset"""
+        line = offset - segment.base
+        if line >= segment.lines:
+            self._extend_index(segment)
+        with self._index_lock:
+            if not segment.index:
+                return None
+            entry = min(line // INDEX_INTERVAL, len(segment.index) - 1)
+            return segment.index[entry], segment.base + entry * INDEX_INTERVAL
+
+    def read(self, start: int, device_ip: Optional[str] = None, stop: Optional[int] = None,
+             limit: int = 1000) -> Tuple[List[Dict[str, Any]], int]:
+        """Eventos con offset en [start, stop), hasta limit revisados; devuelve también el offset siguiente"""
+        stop = self.next_offset if stop is None else min(stop, self.next_offset)
+        segments = list(self.segments)
+        if not segments:
+            return [], start
+        start = max(start, segments[0].base)
+        events = []
+        position = start
+        scanned = 0
+        index = max(0, bisect_right([segment.base for segment in segments], start) - 1)
+        for segment in segments[index:]:
+            if position >= stop or scanned >= limit:
+                break
+            # Los offsets de un segmento son consecutivos: se salta directo a la entrada del índice
+            # más cercana y solo se recorren sin decodificar las líneas que faltan hasta position
+            entry = self._seek(segment, max(position, segment.base))
+            if entry is None:
+                continue
+            byte_position, offset = entry
+            try:
+                with open(segment.path, "rb") as file:
+                    file.seek(byte_position)
+                    for line in file:
+                        if not line.endswith(b"\n"):
+                            break
+                        if offset < position:
+                            offset += 1
+                            continue
+                        if offset >= stop or scanned >= limit:
+                            return events, offset
+                        event = json.loads(line)
+                        offset += 1
+                        scanned += 1
+                        position = offset
+                        if device_ip is None or event.get("device_ip") == device_ip:
+                            events.append(event)
+            except FileNotFoundError:
+                # Borrado por retención mientras se leía: se sigue con el siguiente
+                continue
+        return events, position
+
+    async def replay(self, start: int, device_ip: Optional[str] = None,
+                     stop: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Repite los eventos desde start por lotes, leyendo los segmentos fuera del loop"""
+        self._open()
+        position = start
+        while True:
+            end = self.next_offset if stop is None else stop
+            if position >= end:
+                return
+            events, next_position = await asyncio.to_thread(
+                self.read, position, device_ip, end, settings.EVENT_LOG_REPLAY_BATCH
+            )
+            if next_position <= position:
+                return
+            position = next_position
+            for event in events:
+                yield event
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+        self._opened = False
+        self.segments = []
+
+event_log = EventLog(settings.EVENT_LOG_DIR)
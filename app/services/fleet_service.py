@@ -0,0 +1,68 @@
+from app.config import settings
+from app.services.attendance_batch import AttendanceBatch, dumps
+from app.services.device_registry import registry
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import ipaddress
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+def subnet_of(ip: str, prefix: int = None) -> str:
+    """Subred a la que pertenece la IP, usada para limitar la carga por segmento de red"""
+    prefix = prefix or settings.BULK_SUBNET_PREFIX
+    try:
+        return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+    except ValueError:
+        return ip
+
+def resolve_devices(devices: Optional[List[str]]) -> List[str]:
+    """Lista de dispositivos sin duplicados; por defecto toda la flota del registro"""
+    selected = devices if devices else registry.ips()
+    return list(dict.fromkeys(ip.strip() for ip in selected if ip and ip.strip()))
+
+async def fan_out(devices: List[str], operation: Callable[[str], Awaitable[Any]],
+                  concurrency: Optional[int] = None,
+                  subnet_concurrency: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Ejecuta la operación en todos los dispositivos y entrega cada resultado al terminar"""
+    global_limit = asyncio.Semaphore(concurrency or settings.BULK_MAX_CONCURRENCY)
+    subnet_limit = subnet_concurrency or settings.BULK_SUBNET_CONCURRENCY
+    subnets: Dict[str, asyncio.Semaphore] = {}
+
+    async def run(ip: str) -> Dict[str, Any]:
+        subnet = subnets.setdefault(subnet_of(ip), asyncio.Semaphore(subnet_limit))
+        # Primero la subred, para no ocupar cupo global mientras se espera turno en ella
+        async with subnet, global_limit:
+            start = time.monotonic()
+            try:
+                data = await operation(ip)
+                result = {"device_ip": ip, "status": "ok", "data": data}
+            except Exception as e:
+                logger.error(f"Error en operación masiva con {ip}: {str(e)}")
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                result = {"device_ip": ip, "status": "error", "error": detail}
+            result["elapsed_ms"] = round((time.monotonic() - start) * 1000, 1)
+            return result
+
+    tasks = [asyncio.create_task(run(ip)) for ip in devices]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            yield await completed
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def ndjson_results(results: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    async for result in results:
+        data = result.get("data")
+        if isinstance(data, AttendanceBatch):
+            # El lote se serializa por su cuenta y se inserta en la línea ya codificada
+            head = dumps({key: value for key, value in result.items() if key != "data"})
+            yield head[:-1] + b',"data":' + data.to_json() + b"}\n"
+            continue
+        yield (json.dumps(jsonable_encoder(result)) + "\n").encode()
@@ -0,0 +1,141 @@
+from app.config import settings
+from app.services.shared_state import leader
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+from typing import Optional
+import asyncio
+import httpx
+import logging
+import os
+import re
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+# Marca las peticiones ya reenviadas (no se reenvían de nuevo) y las respuestas que piden al líder
+FORWARDED_HEADER = b"x-forwarded-by-worker"
+LEADER_REQUIRED_HEADER = "X-Leader-Required"
+
+# Se responden desde el estado compartido; solo se reenvían si el worker no puede contestarlas
+LOCAL_ROUTES = [
+    ("GET", re.compile(r"^/devices/registry$")),
+    ("POST", re.compile(r"^/devices/registry$")),
+    ("DELETE", re.compile(r"^/devices/registry/[^/]+$")),
+    ("GET", re.compile(r"^/devices/templates/sync/[^/]+$")),
+    ("GET", re.compile(r"^/devices/[^/]+/(users|info|attendance/rotations)$")),
+    ("DELETE", re.compile(r"^/devices/[^/]+/cache$"))
+]
+
+# Cabeceras de un solo salto: las pone cada conexión
+HOP_HEADERS = {b"connection", b"keep-alive", b"transfer-encoding", b"content-length", b"host"}
+
+class LeaderRequired(HTTPException):
+    """La operación habla con el dispositivo y este worker no es el líder"""
+    def __init__(self, ip: str):
+        super().__init__(
+            status_code=503,
+            detail=f"Solo el worker líder opera {ip}; reintente en unos segundos",
+            headers={"Retry-After": str(int(settings.LEADER_RENEW_INTERVAL)), LEADER_REQUIRED_HEADER: "1"}
+        )
+
+class _EmbeddedServer(uvicorn.Server):
+    """Servidor uvicorn dentro del proceso: las señales las sigue atendiendo el servidor principal"""
+    def install_signal_handlers(self):
+        pass
+
+class LeaderProxy:
+    """Con varios workers solo el líder tiene sesiones y colas por dispositivo.
+
+    El líder atiende la misma aplicación en el socket Unix LEADER_SOCKET_PATH y los demás
+    workers le reenvían por ahí las peticiones a /devices que requieren un dispositivo, de
+    modo que cada terminal sigue teniendo una única cola aunque la petición llegue a otro
+    proceso. Las respuestas se retransmiten a medida que llegan, sin acumularlas.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.enabled = leader.enabled
+        self.client: Optional[httpx.AsyncClient] = None
+        self.server: Optional[_EmbeddedServer] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def applies(self, scope) -> bool:
+        """Petición a /devices en un worker que no es líder y que no viene reenviada"""
+        return (
+            self.enabled and not leader.is_leader and scope["path"].startswith("/devices")
+            and not any(name == FORWARDED_HEADER for name, _ in scope["headers"])
+        )
+
+    @staticmethod
+    def is_local(scope) -> bool:
+        return any(method == scope["method"] and pattern.match(scope["path"]) for method, pattern in LOCAL_ROUTES)
+
+    @staticmethod
+    def requires_leader(headers) -> bool:
+        """La respuesta local es un LeaderRequired: hay que repetir la petición en el líder"""
+        return any(name.lower() == LEADER_REQUIRED_HEADER.lower().encode() for name, _ in headers)
+
+    def start(self):
+        """El nuevo líder empieza a aceptar las peticiones reenviadas"""
+        from app.main import app
+        # Sin log_config: la configuración de logging del servidor principal queda como está
+        config = uvicorn.Config(app, uds=self.path, lifespan="off", log_config=None,
+                                timeout_graceful_shutdown=int(settings.LEADER_LEASE_TTL))
+        self.server = _EmbeddedServer(config)
+        self.task = asyncio.create_task(self._serve(self.server))
+
+    async def _serve(self, server: _EmbeddedServer):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        logger.info(f"Líder atendiendo peticiones reenviadas en {self.path}")
+        try:
+            await server.serve()
+        except SystemExit:
+            # uvicorn termina el proceso si no puede abrir el socket; aquí solo se pierde el reenvío
+            logger.error(f"No se pudo abrir {self.path}: los demás workers no podrán reenviar al líder")
+
+    async def stop(self):
+        """Deja de aceptar reenvíos; las peticiones en curso terminan dentro del plazo de gracia"""
+        server, task = self.server, self.task
+        self.server = self.task = None
+        if task is not None:
+            server.should_exit = True
+            await asyncio.gather(task, return_exceptions=True)
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def forward(self, scope, body: bytes, send):
+        """Reenvía la petición al líder y retransmite su respuesta"""
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                transport=httpx.AsyncHTTPTransport(uds=self.path),
+                timeout=httpx.Timeout(None, connect=settings.DEVICE_TIMEOUT)
+            )
+        headers = [(name, value) for name, value in scope["headers"] if name not in HOP_HEADERS]
+        headers.append((FORWARDED_HEADER, leader.worker_id.encode()))
+        url = httpx.URL(f"http://leader{scope['path']}", query=scope.get("query_string", b""))
+        request = self.client.build_request(scope["method"], url, headers=headers, content=body)
+        try:
+            response = await self.client.send(request, stream=True)
+        except httpx.TransportError as e:
+            logger.warning(f"No se pudo reenviar {scope['method']} {scope['path']} al líder: {str(e)}")
+            unavailable = JSONResponse(
+                {"detail": "El worker líder no está disponible; reintente en unos segundos"}, status_code=503,
+                headers={"Retry-After": str(int(settings.LEADER_RENEW_INTERVAL))}
+            )
+            return await unavailable(scope, None, send)
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [(name, value) for name, value in response.headers.raw
+                            if name.lower() not in HOP_HEADERS - {b"content-length"}]
+            })
+            async for chunk in response.aiter_raw():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            await response.aclose()
+
+leader_proxy = LeaderProxy(settings.LEADER_SOCKET_PATH)
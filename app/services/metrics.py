@@ -0,0 +1,191 @@
+from app.utils.concurrent import executor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in items]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # Conteo por bucket (no acumulado), suma y total
+            state = self._values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = self.header()
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labels, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {state[-1]}")
+        return lines
+
+registry: List[Metric] = []
+
+PHASE_SECONDS = Histogram("zk_device_phase_seconds", "Duración de cada fase de una operación con el dispositivo",
+                          ["device", "phase"])
+COMMAND_SECONDS = Histogram("zk_command_seconds", "Latencia por comando de alto nivel", ["device", "command"])
+EXECUTOR_WAIT_SECONDS = Histogram("zk_executor_wait_seconds", "Espera en la cola del executor antes de ejecutar")
+DEVICE_QUEUE_SECONDS = Histogram("zk_device_queue_seconds", "Espera en la cola serializada del dispositivo",
+                                 ["device"])
+CONNECT_RETRIES = Counter("zk_connect_retries_total", "Reintentos de conexión", ["device"])
+SHED_REQUESTS = Counter("zk_shed_requests_total", "Operaciones rechazadas por control de admisión",
+                        ["device", "reason"])
+DEADLINES_EXCEEDED = Counter("zk_deadlines_exceeded_total", "Operaciones abortadas por plazo agotado",
+                             ["device", "command"])
+COALESCED_READS = Counter("zk_coalesced_reads_total", "Lecturas atendidas por una consulta ya en curso",
+                          ["device", "command"])
+ERRORS = Counter("zk_errors_total", "Errores en operaciones con dispositivos", ["device", "command"])
+ATTENDANCE_RECORDS = Counter("zk_attendance_records_total", "Registros de asistencia descargados", ["device"])
+ATTENDANCE_RATE = Gauge("zk_attendance_records_per_second", "Registros por segundo de la última descarga",
+                        ["device"])
+ATTENDANCE_DOWNLOADS_SKIPPED = Counter("zk_attendance_downloads_skipped_total",
+                                       "Descargas de asistencia evitadas porque los contadores no cambiaron", ["device"])
+ROTATIONS = Counter("zk_attendance_rotations_total", "Rotaciones del log de asistencia por resultado",
+                    ["device", "result"])
+LIVE_EVENTS = Counter("zk_live_events_total", "Eventos recibidos por captura en vivo", ["device"])
+EXECUTOR_QUEUE_DEPTH = Gauge("zk_executor_queue_depth", "Tareas esperando un hilo del executor")
+EXECUTOR_BUSY_THREADS = Gauge("zk_executor_busy_threads", "Hilos del executor ocupados")
+WS_CLIENTS = Gauge("ws_active_clients", "Clientes conectados a /ws")
+CAPTURE_SUBSCRIBERS = Gauge("capture_subscribers", "Suscriptores de captura en vivo por dispositivo", ["device"])
+POOL_SESSIONS = Gauge("zk_pool_sessions", "Sesiones abiertas en el pool")
+WEBHOOK_EVENTS = Counter("webhook_events_total", "Eventos enviados a webhooks por resultado",
+                         ["endpoint", "result"])
+WEBHOOK_LAG_SECONDS = Histogram("webhook_delivery_lag_seconds", "Tiempo desde que el evento entra al outbox hasta su entrega",
+                                ["endpoint"])
+WEBHOOK_BATCH_SECONDS = Histogram("webhook_batch_seconds", "Duración de cada envío de un lote", ["endpoint"])
+WEBHOOK_OUTBOX_DEPTH = Gauge("webhook_outbox_due", "Eventos listos para enviar en el outbox", ["endpoint"])
+WEBHOOK_IN_FLIGHT = Gauge("webhook_in_flight", "Lotes en envío por endpoint", ["endpoint"])
+
+def render() -> str:
+    EXECUTOR_QUEUE_DEPTH.set(executor._work_queue.qsize())
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# Desglose de tiempos de la petición actual (cabecera Server-Timing)
+request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+def record_timing(name: str, seconds: float, timings: Optional[Dict[str, float]] = None):
+    timings = timings if timings is not None else request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+@contextmanager
+def bind_timings(timings: Optional[Dict[str, float]]):
+    """Asocia los tiempos de una petición a código que corre en otra tarea (p. ej. la cola del dispositivo)"""
+    token = request_timings.set(timings)
+    try:
+        yield
+    finally:
+        request_timings.reset(token)
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+async def run_blocking(func: Callable, *args):
+    """Ejecuta una llamada bloqueante en el executor midiendo la espera en cola"""
+    loop = asyncio.get_running_loop()
+    timings = request_timings.get()
+    submitted = time.perf_counter()
+
+    def call():
+        wait = time.perf_counter() - submitted
+        EXECUTOR_WAIT_SECONDS.observe(wait)
+        record_timing("executor_wait", wait, timings)
+        EXECUTOR_BUSY_THREADS.inc()
+        try:
+            return func(*args)
+        finally:
+            EXECUTOR_BUSY_THREADS.dec()
+
+    return await loop.run_in_executor(executor, call)
+
+async def timed_call(phase: str, ip: str, func: Callable, *args):
+    """Mide la duración de una fase; las funciones síncronas corren en el executor"""
+    start = time.perf_counter()
+    try:
+        if asyncio.iscoroutinefunction(func):
+            return await func(*args)
+        return await run_blocking(func, *args)
+    finally:
+        duration = time.perf_counter() - start
+        PHASE_SECONDS.observe(duration, device=ip, phase=phase)
+        record_timing(phase, duration)
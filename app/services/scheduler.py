@@ -0,0 +1,194 @@
+from app.config import settings
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+import asyncio
+import itertools
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# Menor valor = mayor prioridad
+PRIORITY_INTERACTIVE = 0
+PRIORITY_CAPTURE = 5
+PRIORITY_BACKGROUND = 10
+
+# Plazo absoluto (time.monotonic) de la petición en curso; None = sin plazo
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+def set_deadline(seconds: float):
+    request_deadline.set(time.monotonic() + seconds)
+
+class DeadlineExceeded(Exception):
+    pass
+
+class Overloaded(Exception):
+    """La cola de E/S superó su profundidad máxima; global indica saturación de todo el servicio"""
+    def __init__(self, message: str, retry_after: int, global_limit: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.global_limit = global_limit
+
+class DeviceScheduler:
+    """Una cola serializada por IP (los terminales no admiten sesiones concurrentes) y paralelismo entre IPs"""
+    def __init__(self, idle_timeout: int = None):
+        self.idle_timeout = idle_timeout or settings.SCHEDULER_IDLE_TIMEOUT
+        self._queues: Dict[str, asyncio.PriorityQueue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._running: Dict[str, int] = {}
+        self._durations: Dict[str, float] = {}
+        # Operaciones esperando o en curso; las canceladas dejan de contar en cuanto se cancelan
+        self._pending: Dict[str, int] = {}
+        self._counter = itertools.count()
+
+    def _retry_after(self, ip: str, depth: int) -> int:
+        # Tiempo estimado para vaciar la cola según la duración media de las operaciones
+        estimate = depth * self._durations.get(ip, 1.0)
+        return max(1, min(60, math.ceil(estimate)))
+
+    def _admit(self, ip: str):
+        """Control de admisión: rechaza en lugar de acumular latencia"""
+        depth = self._pending.get(ip, 0)
+        if depth >= settings.DEVICE_QUEUE_MAX_DEPTH:
+            raise Overloaded(f"Cola del dispositivo {ip} llena ({depth})", self._retry_after(ip, depth))
+        total = sum(self._pending.values())
+        if total >= settings.QUEUE_MAX_DEPTH:
+            raise Overloaded(f"Servicio saturado ({total} operaciones en cola)",
+                             self._retry_after(ip, depth + 1), global_limit=True)
+
+    async def submit(self, ip: str, job: Callable[[], Awaitable[Any]], priority: int = PRIORITY_INTERACTIVE,
+                     deadline: Optional[float] = None) -> Any:
+        """Encola la operación en la cola del dispositivo y espera su resultado"""
+        if deadline is not None and deadline <= time.monotonic():
+            raise DeadlineExceeded("Plazo agotado antes de encolar la operación")
+        self._admit(ip)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[ip] = self._pending.get(ip, 0) + 1
+        future.add_done_callback(lambda _: self._release(ip))
+        # El contador mantiene el orden de llegada entre operaciones de igual prioridad
+        self._queue_for(ip).put_nowait((priority, next(self._counter), job, future, deadline))
+        return await future
+
+    def _release(self, ip: str):
+        pending = self._pending.get(ip, 0) - 1
+        if pending > 0:
+            self._pending[ip] = pending
+        else:
+            self._pending.pop(ip, None)
+
+    def _queue_for(self, ip: str) -> asyncio.PriorityQueue:
+        queue = self._queues.get(ip)
+        if queue is None:
+            queue = self._queues[ip] = asyncio.PriorityQueue()
+            self._workers[ip] = asyncio.create_task(self._worker(ip, queue))
+        return queue
+
+    async def _worker(self, ip: str, queue: asyncio.PriorityQueue):
+        while True:
+            try:
+                priority, _, job, future, deadline = await asyncio.wait_for(queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    del self._queues[ip]
+                    del self._workers[ip]
+                    return
+                continue
+            if future.done():
+                # El solicitante canceló antes de que empezara la operación
+                continue
+            if deadline is not None and deadline <= time.monotonic():
+                future.set_exception(DeadlineExceeded("Plazo agotado esperando en la cola del dispositivo"))
+                continue
+            self._running[ip] = priority
+            started = time.monotonic()
+            # Al vencer el plazo se cancela la operación y la sesión se descarta
+            task = asyncio.ensure_future(
+                job() if deadline is None else asyncio.wait_for(job(), deadline - started)
+            )
+            # Si el solicitante abandona la espera, se aborta también la operación en curso
+            future.add_done_callback(lambda done, task=task: task.cancel() if done.cancelled() else None)
+            try:
+                result = await task
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            except asyncio.TimeoutError as e:
+                if deadline is not None and time.monotonic() >= deadline:
+                    e = DeadlineExceeded("Plazo agotado durante la operación")
+                if not future.done():
+                    future.set_exception(e)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._running.pop(ip, None)
+                duration = time.monotonic() - started
+                self._durations[ip] = 0.8 * self._durations.get(ip, duration) + 0.2 * duration
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            ip: {"queued": queue.qsize(), "pending": self._pending.get(ip, 0), "running": ip in self._running}
+            for ip, queue in self._queues.items()
+        }
+
+    async def shutdown(self):
+        for task in list(self._workers.values()):
+            task.cancel()
+        self._queues.clear()
+        self._workers.clear()
+        self._pending.clear()
+
+class SharedCall:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """Comparte una lectura en curso entre solicitantes concurrentes con la misma clave.
+
+    La llamada compartida corre sin plazo propio; cada solicitante espera con el suyo y
+    la llamada se cancela cuando ya no queda nadie esperándola.
+    """
+    def __init__(self):
+        self._calls: Dict[Hashable, SharedCall] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            async def shared():
+                request_deadline.set(None)
+                return await factory()
+
+            call = self._calls[key] = SharedCall(asyncio.create_task(shared()))
+            call.task.add_done_callback(lambda _: self._finished(key, call))
+        call.waiters += 1
+        try:
+            deadline = request_deadline.get()
+            if deadline is None:
+                return await asyncio.shield(call.task)
+            try:
+                return await asyncio.wait_for(asyncio.shield(call.task), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                if call.task.done():
+                    raise
+                raise DeadlineExceeded("Plazo agotado esperando la lectura del dispositivo")
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                call.task.cancel()
+
+    def _finished(self, key: Hashable, call: SharedCall):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled():
+            # Marca la excepción como recuperada aunque nadie haya quedado esperando
+            call.task.exception()
+
+scheduler = DeviceScheduler()
+single_flight = SingleFlight()
@@ -0,0 +1,206 @@
+from app.config import settings
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS device_status (
+    ip TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cache (
+    device TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    value BLOB NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (device, resource)
+);
+CREATE TABLE IF NOT EXISTS documents (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE TABLE IF NOT EXISTS analytics_invalidations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    day INTEGER NOT NULL
+);
+"""
+
+class SharedState:
+    """Estado compartido entre los workers de uvicorn en un SQLite local.
+
+    Guarda el arriendo del líder, el estado de salud de los dispositivos, la caché de
+    usuarios e info y documentos pequeños (p. ej. trabajos de sincronización).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                return conn.execute(sql, params).fetchall()
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Toma o renueva el arriendo si está libre, vencido o ya es nuestro"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                    "WHERE leases.owner = excluded.owner OR leases.expires < ?",
+                    (name, owner, now + ttl, now)
+                )
+                row = conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def release_lease(self, name: str, owner: str):
+        self._execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def set_device_status(self, ip: str, status: Dict[str, Any]):
+        self._execute(
+            "INSERT INTO device_status (ip, data) VALUES (?, ?) ON CONFLICT(ip) DO UPDATE SET data = excluded.data",
+            (ip, json.dumps(status, default=lambda value: getattr(value, "__dict__", str(value))))
+        )
+
+    def delete_device_status(self, ip: str):
+        self._execute("DELETE FROM device_status WHERE ip = ?", (ip,))
+
+    def device_statuses(self) -> Dict[str, Dict[str, Any]]:
+        return {ip: json.loads(data) for ip, data in self._execute("SELECT ip, data FROM device_status")}
+
+    def cache_get(self, device: str, resource: str) -> Tuple[bool, Optional[bytes]]:
+        rows = self._execute(
+            "SELECT value FROM cache WHERE device = ? AND resource = ? AND expires >= ?",
+            (device, resource, time.time())
+        )
+        if not rows:
+            return False, None
+        return True, rows[0][0]
+
+    def cache_set(self, device: str, resource: str, value: bytes, ttl: float):
+        """value ya codificado (JSON): el archivo no debe poder ejecutar código al leerse"""
+        self._execute(
+            "INSERT INTO cache (device, resource, value, expires) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(device, resource) DO UPDATE SET value = excluded.value, expires = excluded.expires",
+            (device, resource, value, time.time() + ttl)
+        )
+
+    def cache_delete(self, device: Optional[str] = None, resource: Optional[str] = None):
+        if device is None:
+            self._execute("DELETE FROM cache")
+        elif resource is None:
+            self._execute("DELETE FROM cache WHERE device = ?", (device,))
+        else:
+            self._execute("DELETE FROM cache WHERE device = ? AND resource = ?", (device, resource))
+
+    def cache_count(self) -> int:
+        return self._execute("SELECT COUNT(*) FROM cache WHERE expires >= ?", (time.time(),))[0][0]
+
+    def put_document(self, kind: str, key: str, data: Dict[str, Any]):
+        self._execute(
+            "INSERT INTO documents (kind, key, data, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(kind, key) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+            (kind, key, json.dumps(data, default=str), time.time())
+        )
+
+    def get_document(self, kind: str, key: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute("SELECT data FROM documents WHERE kind = ? AND key = ?", (kind, key))
+        return json.loads(rows[0][0]) if rows else None
+
+    def list_documents(self, kind: str, updated_after: float = 0.0) -> Dict[str, Dict[str, Any]]:
+        rows = self._execute("SELECT key, data FROM documents WHERE kind = ? AND updated > ?", (kind, updated_after))
+        return {key: json.loads(data) for key, data in rows}
+
+    def expire_documents(self, kind: str, updated_before: float):
+        """Borra los documentos de ese tipo que no se actualizan desde updated_before"""
+        self._execute("DELETE FROM documents WHERE kind = ? AND updated < ?", (kind, updated_before))
+
+    def prune_documents(self, kind: str, keep: int):
+        """Conserva solo los keep documentos de ese tipo actualizados más recientemente"""
+        self._execute(
+            "DELETE FROM documents WHERE kind = ? AND key NOT IN "
+            "(SELECT key FROM documents WHERE kind = ? ORDER BY updated DESC LIMIT ?)",
+            (kind, kind, keep)
+        )
+
+    def add_analytics_invalidation(self, day: int):
+        self._execute("INSERT INTO analytics_invalidations (day) VALUES (?)", (day,))
+
+    def analytics_invalidations(self, after_id: int) -> Tuple[int, Optional[int]]:
+        """Último id y el día más antiguo invalidado después de after_id"""
+        row = self._execute(
+            "SELECT MAX(id), MIN(day) FROM analytics_invalidations WHERE id > ?", (after_id,)
+        )[0]
+        return (row[0] or after_id), row[1]
+
+class LeaderElection:
+    """Elección de líder por arriendo: solo el líder sondea, sincroniza y captura dispositivos.
+
+    Sin MULTI_WORKER el proceso es siempre líder. Con varios workers cada uno intenta
+    renovar el arriendo cada LEADER_RENEW_INTERVAL; si el líder muere, otro lo toma al
+    vencer LEADER_LEASE_TTL.
+    """
+    LEASE = "leader"
+
+    def __init__(self, state: SharedState):
+        self.state = state
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.enabled = settings.MULTI_WORKER
+        self.is_leader = not self.enabled
+
+    async def run(self, on_elected, on_demoted):
+        """Mantiene el arriendo y llama a on_elected / on_demoted en cada cambio"""
+        try:
+            while True:
+                try:
+                    leader = await asyncio.to_thread(
+                        self.state.acquire_lease, self.LEASE, self.worker_id, settings.LEADER_LEASE_TTL
+                    )
+                except Exception as e:
+                    # Sin poder renovar no se puede asegurar ser el único: se cede el rol
+                    logger.error(f"Error renovando el arriendo de líder: {str(e)}")
+                    leader = False
+                if leader != self.is_leader:
+                    self.is_leader = leader
+                    logger.info(f"Worker {self.worker_id} {'es ahora líder' if leader else 'deja de ser líder'}")
+                    await (on_elected() if leader else on_demoted())
+                await asyncio.sleep(settings.LEADER_RENEW_INTERVAL)
+        finally:
+            if self.is_leader:
+                await asyncio.to_thread(self.state.release_lease, self.LEASE, self.worker_id)
+
+shared_state = SharedState(settings.SHARED_STATE_PATH)
+leader = LeaderElection(shared_state)
@@ -0,0 +1,332 @@
+from app.config import settings
+from app.services import fleet_service, metrics, zk_service
+from app.services.scheduler import request_deadline, PRIORITY_BACKGROUND
+from app.services.shared_state import shared_state
+from app.services.ws_service import manager
+from app.services.zk_async import ZKTemplate, ZKUser, stored_user
+from collections import OrderedDict
+from datetime import datetime
+from fastapi import HTTPException
+from struct import pack
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+MAX_UID = 65535
+
+# Inscripción de un dispositivo indexada por user_id: el uid es local a cada equipo
+Enrollment = Dict[str, Tuple[ZKUser, List[ZKTemplate]]]
+
+class SyncPlan(NamedTuple):
+    upserts: List[Tuple[ZKUser, List[ZKTemplate]]]
+    stale_templates: List[Tuple[int, int]]
+    deletes: List[int]
+    unchanged: int
+
+def index_enrollment(users: List[ZKUser], templates: List[ZKTemplate]) -> Enrollment:
+    by_uid: Dict[int, List[ZKTemplate]] = {}
+    for template in templates:
+        by_uid.setdefault(template.uid, []).append(template)
+    return {
+        user.user_id: (user, sorted(by_uid.get(user.uid, []), key=lambda template: template.fid))
+        for user in users
+    }
+
+def fingerprint(user: ZKUser, templates: List[ZKTemplate]) -> str:
+    """Resumen del contenido de un usuario, sin el uid ni la marca valid (la carga no la escribe)"""
+    digest = hashlib.sha1()
+    for value in (user.user_id, user.name, user.privilege, user.password, user.group_id, user.card):
+        digest.update(str(value).encode() + b"\x00")
+    for template in templates:
+        digest.update(pack("<bI", template.fid, len(template.template)) + template.template)
+    return digest.hexdigest()
+
+def plan_sync(source: Enrollment, target: Enrollment, delete_missing: bool = False,
+              packet_size: int = 72) -> SyncPlan:
+    """Diferencia mínima para que target quede igual a source.
+
+    El origen se compara como quedaría escrito en el formato de usuario del destino
+    (packet_size): en uno de 28 bytes el nombre se trunca y el grupo es numérico, y sin
+    normalizar esos usuarios se volverían a enviar en cada ejecución.
+    """
+    used = {user.uid for user, _ in target.values()}
+    next_uid = 1
+    upserts = []
+    stale_templates = []
+    unchanged = 0
+    for user_id, (user, templates) in source.items():
+        current = target.get(user_id)
+        if current is not None and fingerprint(*current) == fingerprint(stored_user(user, packet_size), templates):
+            unchanged += 1
+            continue
+        if current is not None:
+            uid = current[0].uid
+            fids = {template.fid for template in templates}
+            stale_templates.extend((uid, template.fid) for template in current[1] if template.fid not in fids)
+        else:
+            while next_uid in used:
+                next_uid += 1
+            if next_uid > MAX_UID:
+                raise ValueError("No quedan uid libres en el dispositivo")
+            uid = next_uid
+            used.add(uid)
+        upserts.append((user._replace(uid=uid), [template._replace(uid=uid) for template in templates]))
+    deletes = []
+    if delete_missing:
+        deletes = [user.uid for user_id, (user, _) in target.items() if user_id not in source]
+    return SyncPlan(upserts, stale_templates, deletes, unchanged)
+
+class DeviceProgress:
+    def __init__(self):
+        self.status = "pending"
+        self.unchanged = 0
+        self.to_push = 0
+        self.pushed = 0
+        self.to_delete = 0
+        self.deleted = 0
+        self.error: Optional[str] = None
+        # Usuarios omitidos por no caber en el formato del dispositivo, con el motivo
+        self.rejected: Dict[str, str] = {}
+        self.elapsed_ms = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.__dict__, "rejected": dict(self.rejected)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DeviceProgress":
+        progress = cls()
+        progress.__dict__.update({key: value for key, value in data.items() if key in progress.__dict__})
+        return progress
+
+class SyncJob:
+    """Réplica de la inscripción de un dispositivo origen hacia varios destinos"""
+    def __init__(self, source: str, devices: List[str], delete_missing: bool, batch_size: int, concurrency: int):
+        self.job_id = uuid.uuid4().hex
+        self.source = source
+        self.delete_missing = delete_missing
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.devices = {ip: DeviceProgress() for ip in devices if ip != source}
+        self.snapshot: Optional[Enrollment] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.finished_at: Optional[datetime] = None
+        self.runs = 0
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    @property
+    def status(self) -> str:
+        # Al guardar el estado final la tarea aún no terminó: cuenta finished_at
+        if self.running and self.finished_at is None:
+            return "running"
+        if self.error:
+            return "failed"
+        if all(progress.status == "done" for progress in self.devices.values()):
+            return "completed"
+        return "partial"
+
+    def to_dict(self) -> Dict[str, Any]:
+        devices = self.devices.values()
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "source": self.source,
+            "source_users": len(self.snapshot) if self.snapshot is not None else None,
+            "delete_missing": self.delete_missing,
+            "batch_size": self.batch_size,
+            "concurrency": self.concurrency,
+            "runs": self.runs,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "totals": {
+                "devices": len(self.devices),
+                "done": sum(progress.status == "done" for progress in devices),
+                "failed": sum(progress.status == "error" for progress in devices),
+                "to_push": sum(progress.to_push for progress in devices),
+                "pushed": sum(progress.pushed for progress in devices),
+                "deleted": sum(progress.deleted for progress in devices),
+                "rejected": sum(len(progress.rejected) for progress in devices)
+            },
+            "devices": {ip: progress.to_dict() for ip, progress in self.devices.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SyncJob":
+        """Trabajo guardado; la foto del origen no se guarda y se vuelve a leer al reanudar"""
+        job = cls(data["source"], [], data["delete_missing"], data["batch_size"], data["concurrency"])
+        job.job_id = data["job_id"]
+        job.devices = {ip: DeviceProgress.from_dict(progress) for ip, progress in data["devices"].items()}
+        job.error = data["error"]
+        job.created_at = datetime.fromisoformat(data["created_at"])
+        job.finished_at = datetime.fromisoformat(data["finished_at"]) if data["finished_at"] else None
+        job.runs = data["runs"]
+        return job
+
+class TemplateSyncEngine:
+    """Sincroniza usuarios y huellas por diferencias, en lotes y en paralelo entre dispositivos.
+
+    Cada ejecución vuelve a leer el destino y recalcula la diferencia, así que reanudar un
+    trabajo fallido solo envía lo que todavía falta. El progreso se guarda en el estado
+    compartido: sobrevive a un reinicio y se puede reanudar desde cualquier worker.
+    """
+    KIND = "template_sync"
+
+    def __init__(self):
+        self.jobs: "OrderedDict[str, SyncJob]" = OrderedDict()
+
+    def start(self, source: str, devices: List[str], delete_missing: bool = False,
+              batch_size: Optional[int] = None, concurrency: Optional[int] = None) -> SyncJob:
+        job = SyncJob(source, devices, delete_missing, batch_size or settings.TEMPLATE_SYNC_BATCH_SIZE,
+                      concurrency or settings.TEMPLATE_SYNC_CONCURRENCY)
+        self.jobs[job.job_id] = job
+        self._expire()
+        self._launch(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[SyncJob]:
+        return self.jobs.get(job_id)
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Estado del trabajo; también los de otro proceso o de antes de un reinicio"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return await asyncio.to_thread(shared_state.get_document, self.KIND, job_id)
+
+    async def _share(self, job: SyncJob):
+        await asyncio.to_thread(shared_state.put_document, self.KIND, job.job_id, job.to_dict())
+
+    async def resume(self, job_id: str) -> Optional[SyncJob]:
+        """Reintenta los dispositivos que no terminaron, con la misma foto del origen.
+
+        Un trabajo que ya no está en memoria se restaura de lo guardado y vuelve a leer el
+        origen; devuelve None si no existe o si figura en curso en otro proceso.
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            stored = await asyncio.to_thread(shared_state.get_document, self.KIND, job_id)
+            if stored is None or stored["status"] == "running":
+                return None
+            job = self.jobs[job_id] = SyncJob.from_dict(stored)
+            self._expire()
+        if not job.running:
+            self._launch(job)
+        return job
+
+    async def recover(self):
+        """Marca como interrumpidos los trabajos guardados en curso que no corren en este proceso.
+
+        Lo llama el nuevo líder: el proceso que los ejecutaba terminó o dejó de ser líder.
+        """
+        stored = await asyncio.to_thread(shared_state.list_documents, self.KIND)
+        for job_id, data in stored.items():
+            if data["status"] != "running" or job_id in self.jobs:
+                continue
+            job = SyncJob.from_dict(data)
+            for progress in job.devices.values():
+                if progress.status not in ("done", "error"):
+                    progress.status = "error"
+                    progress.error = "Interrumpida al cambiar de proceso"
+            job.finished_at = job.finished_at or datetime.now()
+            await self._share(job)
+            logger.warning(f"Sincronización {job_id} interrumpida; se puede reanudar")
+
+    def _expire(self):
+        # Conserva los últimos trabajos; nunca descarta uno en curso
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= settings.TEMPLATE_SYNC_MAX_JOBS:
+                break
+            if not self.jobs[job_id].running:
+                del self.jobs[job_id]
+
+    def _launch(self, job: SyncJob):
+        job.error = None
+        job.finished_at = None
+        job.runs += 1
+        job.task = asyncio.create_task(self._run(job))
+
+    async def _run(self, job: SyncJob):
+        # La tarea hereda el contexto de la petición que la creó: sin su plazo ni sus tiempos
+        request_deadline.set(None)
+        metrics.request_timings.set(None)
+        try:
+            await self._share(job)
+            await asyncio.to_thread(shared_state.prune_documents, self.KIND, settings.TEMPLATE_SYNC_MAX_JOBS)
+            if job.snapshot is None:
+                users, templates, _ = await zk_service.read_enrollment(job.source, priority=PRIORITY_BACKGROUND)
+                job.snapshot = index_enrollment(users, templates)
+                logger.info(f"Sincronización {job.job_id}: {len(job.snapshot)} usuarios en {job.source}")
+            pending = [ip for ip, progress in job.devices.items() if progress.status != "done"]
+
+            async def operation(ip: str):
+                return await self._sync_device(job, ip)
+
+            async for result in fleet_service.fan_out(pending, operation, job.concurrency):
+                progress = job.devices[result["device_ip"]]
+                progress.elapsed_ms = result["elapsed_ms"]
+                if result["status"] == "error":
+                    progress.status = "error"
+                    progress.error = result["error"]
+                await self._publish(job, result["device_ip"])
+        except Exception as e:
+            job.error = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.error(f"Sincronización {job.job_id} fallida: {job.error}")
+        finally:
+            job.finished_at = datetime.now()
+            logger.info(f"Sincronización {job.job_id} terminada: {job.status}")
+            await self._share(job)
+            await manager.broadcast({"type": "template_sync", **job.to_dict()}, None, "template_sync")
+
+    async def _sync_device(self, job: SyncJob, ip: str) -> Dict[str, Any]:
+        progress = job.devices[ip]
+        progress.status = "reading"
+        progress.error = None
+        progress.pushed = progress.deleted = 0
+        progress.rejected = {}
+        users, templates, packet_size = await zk_service.read_enrollment(ip, priority=PRIORITY_BACKGROUND)
+        plan = plan_sync(job.snapshot, index_enrollment(users, templates), job.delete_missing, packet_size)
+        progress.unchanged = plan.unchanged
+        progress.to_push = len(plan.upserts)
+        progress.to_delete = len(plan.deletes)
+        if plan.deletes or plan.stale_templates:
+            progress.status = "deleting"
+            await zk_service.delete_enrollment(ip, plan.deletes, plan.stale_templates, priority=PRIORITY_BACKGROUND)
+            progress.deleted = len(plan.deletes)
+        progress.status = "pushing"
+        for start in range(0, len(plan.upserts), job.batch_size):
+            batch = plan.upserts[start:start + job.batch_size]
+            started = time.perf_counter()
+            rejected = await zk_service.save_enrollment(ip, batch, priority=PRIORITY_BACKGROUND)
+            progress.pushed += len(batch) - len(rejected)
+            progress.rejected.update(rejected)
+            logger.debug(f"Lote de {len(batch)} usuarios enviado a {ip} en {time.perf_counter() - started:.2f}s")
+            await self._publish(job, ip)
+        progress.status = "done"
+        return progress.to_dict()
+
+    async def _publish(self, job: SyncJob, ip: str):
+        await self._share(job)
+        await manager.broadcast({
+            "type": "template_sync",
+            "job_id": job.job_id,
+            "device_ip": ip,
+            **job.devices[ip].to_dict()
+        }, ip, "template_sync")
+
+    async def shutdown(self):
+        tasks = [job.task for job in self.jobs.values() if job.running]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+template_sync = TemplateSyncEngine()
@@ -0,0 +1,280 @@
+from app.config import settings
+from app.services import metrics
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    endpoint TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_endpoint_due ON outbox (endpoint, next_attempt, id);
+CREATE TABLE IF NOT EXISTS positions (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+class OutboxRow(NamedTuple):
+    id: int
+    payload: str
+    attempts: int
+    created: float
+
+def backoff_delay(attempts: int) -> float:
+    """Backoff exponencial con jitter entre reintentos de un lote"""
+    delay = min(settings.WEBHOOK_MAX_BACKOFF, settings.WEBHOOK_RETRY_DELAY * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class Outbox:
+    """Eventos pendientes de entrega en SQLite, para que sobrevivan a un reinicio.
+
+    Reclamar un lote adelanta su next_attempt (un arriendo): si el proceso muere en medio
+    de la entrega, el lote vuelve a estar disponible cuando el arriendo vence.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+            logger.info(f"Outbox de webhooks abierto en {self.path}")
+        return self._conn
+
+    def add(self, endpoints: List[str], payloads: List[str], positions: Optional[Dict[str, int]] = None):
+        """Encola cada evento para cada endpoint y avanza las posiciones en la misma transacción"""
+        now = time.time()
+        rows = [(endpoint, payload, now, now) for endpoint in endpoints for payload in payloads]
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO outbox (endpoint, payload, next_attempt, created) VALUES (?, ?, ?, ?)", rows
+                )
+                if positions:
+                    conn.executemany(
+                        "INSERT INTO positions (key, value) VALUES (?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                        list(positions.items())
+                    )
+
+    def position(self, key: str) -> Optional[int]:
+        with self._lock:
+            row = self._connection().execute("SELECT value FROM positions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def pending(self, endpoint: str, now: float) -> Tuple[int, Optional[float], Optional[float]]:
+        """Eventos listos, creación del más antiguo listo y próximo reintento de los que esperan"""
+        with self._lock:
+            conn = self._connection()
+            due, oldest = conn.execute(
+                "SELECT COUNT(*), MIN(created) FROM outbox WHERE endpoint = ? AND next_attempt <= ?",
+                (endpoint, now)
+            ).fetchone()
+            next_attempt = conn.execute(
+                "SELECT MIN(next_attempt) FROM outbox WHERE endpoint = ? AND next_attempt > ?",
+                (endpoint, now)
+            ).fetchone()[0]
+        return due, oldest, next_attempt
+
+    def claim(self, endpoint: str, now: float, limit: int, lease: float) -> List[OutboxRow]:
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                rows = conn.execute(
+                    "SELECT id, payload, attempts, created FROM outbox "
+                    "WHERE endpoint = ? AND next_attempt <= ? ORDER BY id LIMIT ?",
+                    (endpoint, now, limit)
+                ).fetchall()
+                conn.executemany("UPDATE outbox SET next_attempt = ? WHERE id = ?",
+                                 [(now + lease, row[0]) for row in rows])
+        return [OutboxRow(*row) for row in rows]
+
+    def delete(self, ids: List[int]):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany("DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id in ids])
+
+    def reschedule(self, ids: List[int], attempts: int, next_attempt: float):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany("UPDATE outbox SET attempts = ?, next_attempt = ? WHERE id = ?",
+                                 [(attempts, next_attempt, row_id) for row_id in ids])
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class EndpointDispatcher:
+    """Entrega por lotes a un endpoint: por tamaño o al vencer la ventana de latencia,
+    con un máximo de entregas simultáneas sobre conexiones keep-alive"""
+    def __init__(self, outbox: Outbox, url: str):
+        self.outbox = outbox
+        self.url = url
+        self.wakeup = asyncio.Event()
+        self.slots = asyncio.Semaphore(settings.WEBHOOK_CONCURRENCY)
+        self.deliveries: set = set()
+        self.client = httpx.AsyncClient(
+            timeout=settings.WEBHOOK_TIMEOUT,
+            limits=httpx.Limits(max_connections=settings.WEBHOOK_CONCURRENCY,
+                                max_keepalive_connections=settings.WEBHOOK_CONCURRENCY)
+        )
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                # Se limpia antes de consultar para no perder un aviso que llegue entre medio
+                self.wakeup.clear()
+                now = time.time()
+                due, oldest, next_attempt = await asyncio.to_thread(self.outbox.pending, self.url, now)
+                metrics.WEBHOOK_OUTBOX_DEPTH.set(due, endpoint=self.url)
+                if due >= settings.WEBHOOK_BATCH_SIZE or (due and now - oldest >= settings.WEBHOOK_BATCH_WINDOW):
+                    await self._dispatch()
+                    continue
+                if due:
+                    timeout = settings.WEBHOOK_BATCH_WINDOW - (now - oldest)
+                elif next_attempt is not None:
+                    timeout = next_attempt - now
+                else:
+                    timeout = None
+                if settings.MULTI_WORKER:
+                    # Otros workers también encolan y su aviso no llega a este proceso
+                    timeout = settings.WEBHOOK_BATCH_WINDOW if timeout is None else min(timeout, settings.WEBHOOK_BATCH_WINDOW)
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en el despachador de {self.url}: {str(e)}")
+                await asyncio.sleep(settings.WEBHOOK_RETRY_DELAY)
+
+    async def _dispatch(self):
+        await self.slots.acquire()
+        try:
+            rows = await asyncio.to_thread(self.outbox.claim, self.url, time.time(), settings.WEBHOOK_BATCH_SIZE,
+                                           settings.WEBHOOK_TIMEOUT * 2)
+        except BaseException:
+            self.slots.release()
+            raise
+        if not rows:
+            self.slots.release()
+            return
+        task = asyncio.create_task(self._deliver(rows))
+        self.deliveries.add(task)
+        task.add_done_callback(self.deliveries.discard)
+
+    async def _deliver(self, rows: List[OutboxRow]):
+        ids = [row.id for row in rows]
+        body = b'{"events":[' + ",".join(row.payload for row in rows).encode() + b"]}"
+        headers = {"Content-Type": "application/json"}
+        if settings.WEBHOOK_SECRET:
+            signature = hmac.new(settings.WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+            headers["X-Fastbio-Signature"] = f"sha256={signature}"
+        metrics.WEBHOOK_IN_FLIGHT.inc(endpoint=self.url)
+        started = time.perf_counter()
+        try:
+            response = await self.client.post(self.url, content=body, headers=headers)
+            response.raise_for_status()
+        except Exception as e:
+            attempts = max(row.attempts for row in rows) + 1
+            metrics.WEBHOOK_EVENTS.inc(len(rows), endpoint=self.url, result="failed")
+            if settings.WEBHOOK_MAX_ATTEMPTS and attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+                logger.error(f"Lote de {len(rows)} eventos descartado para {self.url} tras {attempts} intentos: {str(e)}")
+                metrics.WEBHOOK_EVENTS.inc(len(rows), endpoint=self.url, result="dropped")
+                await asyncio.to_thread(self.outbox.delete, ids)
+            else:
+                delay = backoff_delay(attempts)
+                logger.warning(f"Entrega a {self.url} fallida (intento {attempts}), reintento en {delay:.1f}s: {str(e)}")
+                await asyncio.to_thread(self.outbox.reschedule, ids, attempts, time.time() + delay)
+        else:
+            await asyncio.to_thread(self.outbox.delete, ids)
+            now = time.time()
+            metrics.WEBHOOK_EVENTS.inc(len(rows), endpoint=self.url, result="delivered")
+            for row in rows:
+                metrics.WEBHOOK_LAG_SECONDS.observe(now - row.created, endpoint=self.url)
+        finally:
+            metrics.WEBHOOK_BATCH_SECONDS.observe(time.perf_counter() - started, endpoint=self.url)
+            metrics.WEBHOOK_IN_FLIGHT.dec(endpoint=self.url)
+            self.slots.release()
+            self.wakeup.set()
+
+    async def close(self):
+        tasks = [task for task in (self.task, *self.deliveries) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.client.aclose()
+
+class WebhookPipeline:
+    """Envía a los endpoints configurados los eventos en vivo y los sincronizados"""
+    def __init__(self, urls: List[str], outbox_path: str):
+        self.urls = urls
+        self.outbox = Outbox(outbox_path)
+        self.dispatchers: Dict[str, EndpointDispatcher] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.urls)
+
+    def start(self):
+        for url in self.urls:
+            if url not in self.dispatchers:
+                dispatcher = self.dispatchers[url] = EndpointDispatcher(self.outbox, url)
+                dispatcher.start()
+        if self.urls:
+            logger.info(f"Webhooks activos hacia {len(self.urls)} endpoints")
+
+    async def publish(self, events: List[Dict[str, Any]], positions: Optional[Dict[str, int]] = None):
+        """Guarda los eventos en el outbox; la entrega ocurre en segundo plano"""
+        if not self.enabled or not events:
+            return
+        payloads = [json.dumps(event, default=str) for event in events]
+        await asyncio.to_thread(self.outbox.add, self.urls, payloads, positions)
+        for dispatcher in self.dispatchers.values():
+            dispatcher.wakeup.set()
+
+    async def position(self, key: str) -> Optional[int]:
+        return await asyncio.to_thread(self.outbox.position, key)
+
+    async def shutdown(self):
+        await asyncio.gather(*(dispatcher.close() for dispatcher in self.dispatchers.values()))
+        self.dispatchers.clear()
+        self.outbox.close()
+
+webhooks = WebhookPipeline(settings.WEBHOOK_URLS, settings.WEBHOOK_OUTBOX_PATH)
@@ -1,38 +1,260 @@
 from fastapi import WebSocket
-from typing import List
+from app.config import settings
+from app.services.capture_hub import hub as capture_hub
+from app.services.device_registry import normalize_ip, registry
+from app.services.event_log import event_log
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
 import asyncio
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+# (device_ip, event_type); None actúa como comodín
+Topic = Tuple[Optional[str], Optional[str]]
+
+class ClientConnection:
+    """Cliente con cola propia de salida, para que uno lento no frene a los demás"""
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.manager = manager
+        self.topics: Set[Topic] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_CLIENT_QUEUE_SIZE)
+        self.dropped = 0
+        # Mensajes en vivo retenidos mientras se repite el registro: (offset, device_ip, mensaje),
+        # acotados como la cola; el offset más bajo que no cupo se vuelve a leer del registro
+        self.held: Optional[Deque[Tuple[Optional[int], Optional[str], str]]] = None
+        self.gap: Optional[int] = None
+        self._replay_lock = asyncio.Lock()
+        self.replays: Set[asyncio.Task] = set()
+        self.sender = asyncio.create_task(self._send_loop())
+
+    def wants(self, device_ip: Optional[str], event_type: Optional[str]) -> bool:
+        if not self.topics:
+            return True
+        return any(
+            (ip is None or ip == device_ip) and (kind is None or kind == event_type)
+            for ip, kind in self.topics
+        )
+
+    def offer(self, message: str, offset: Optional[int] = None, device_ip: Optional[str] = None) -> bool:
+        """Encola sin bloquear; False si el cliente debe desconectarse por lento"""
+        if self.held is not None:
+            if len(self.held) >= settings.WS_CLIENT_QUEUE_SIZE:
+                evicted, _, _ = self.held[0]
+                if evicted is None:
+                    # Sin offset no se puede recuperar del registro: se aplica la política de la cola
+                    if settings.WS_SLOW_CLIENT_POLICY == "disconnect":
+                        return False
+                    self.dropped += 1
+                else:
+                    self.gap = evicted if self.gap is None else min(self.gap, evicted)
+                self.held.popleft()
+            self.held.append((offset, device_ip, message))
+            return True
+        if self.queue.full():
+            if settings.WS_SLOW_CLIENT_POLICY == "disconnect":
+                return False
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+        return True
+
+    async def resume(self, device_ip: Optional[str], offset: int):
+        """Repite el registro de eventos desde offset y luego entrega lo retenido en vivo.
+
+        Lo retenido está acotado como la cola: si no cabe, el hueco se rellena desde el
+        registro por offset, como hace follow() con la cola del suscriptor.
+        """
+        async with self._replay_lock:
+            self.held = deque()
+            self.gap = None
+            end = offset
+            refilled = 0
+
+            def replayed(event_offset: Optional[int], event_ip: Optional[str]) -> bool:
+                # Lo anterior a end del mismo dispositivo ya salió en la repetición, y lo
+                # anterior a refilled en el relleno
+                return event_offset is not None and (
+                    (event_offset < end and device_ip in (None, event_ip)) or event_offset < refilled
+                )
+
+            try:
+                await event_log.catch_up()
+                earliest = event_log.earliest_offset
+                end = event_log.next_offset
+                if offset < earliest:
+                    await self.queue.put(json.dumps({
+                        "type": "warning",
+                        "message": "Los eventos anteriores ya no están en el registro",
+                        "earliest_offset": earliest,
+                        "device_ip": device_ip
+                    }))
+                # La repetición y lo retenido esperan a que el cliente consuma en lugar de descartar
+                async for event in event_log.replay(offset, device_ip, end):
+                    await self.queue.put(json.dumps({"type": "attendance", **event}, default=str))
+                while self.held or self.gap is not None:
+                    if self.gap is not None:
+                        gap, self.gap = self.gap, None
+                        stop = min((held_offset for held_offset, _, _ in self.held if held_offset is not None),
+                                   default=None)
+                        if stop is None:
+                            await event_log.catch_up()
+                            stop = event_log.next_offset
+                        async for event in event_log.replay(gap, None, stop):
+                            event_ip = event.get("device_ip")
+                            if not replayed(event["offset"], event_ip) and self.wants(event_ip, "attendance"):
+                                await self.queue.put(json.dumps({"type": "attendance", **event}, default=str))
+                        refilled = max(refilled, stop)
+                        continue
+                    held_offset, held_ip, message = self.held.popleft()
+                    if not replayed(held_offset, held_ip):
+                        await self.queue.put(message)
+            finally:
+                # Si la repetición se interrumpe, lo retenido se entrega sin esperar
+                held, self.held = self.held, None
+                for held_offset, held_ip, message in held:
+                    if not replayed(held_offset, held_ip) and not self.offer(message):
+                        asyncio.create_task(self.manager.disconnect(self.websocket))
+                        break
+
+    async def _send_loop(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await self.websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error enviando a {id(self.websocket)}: {str(e)}")
+            asyncio.create_task(self.manager.disconnect(self.websocket))
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
         self._lock = asyncio.Lock()
+        self._device_feeds: Dict[str, Tuple[Any, asyncio.Task]] = {}
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         async with self._lock:
-            self.active_connections.append(websocket)
+            self.active_connections[websocket] = ClientConnection(websocket, self)
             logger.info(f"Nueva conexión: {id(websocket)}")
 
     async def disconnect(self, websocket: WebSocket):
         async with self._lock:
-            if websocket in self.active_connections:
-                self.active_connections.remove(websocket)
+            client = self.active_connections.pop(websocket, None)
+            if client:
+                client.sender.cancel()
+                for task in client.replays:
+                    task.cancel()
+                self._release_feeds()
                 logger.info(f"Conexión cerrada: {id(websocket)}")
 
-    async def broadcast(self, data: dict):
-        dead_connections = []
+    async def subscribe(self, websocket: WebSocket, device_ip: Optional[str] = None,
+                        event_type: Optional[str] = None, offset: Optional[int] = None):
         async with self._lock:
-            for connection in self.active_connections:
+            client = self.active_connections.get(websocket)
+            if client and device_ip is not None:
+                # Una suscripción a un dispositivo abre su captura en vivo: solo los de la flota
                 try:
-                    await connection.send_json(data)
-                except Exception as e:
-                    logger.error(f"Error en broadcast: {str(e)}")
-                    dead_connections.append(connection)
-            
-            for conn in dead_connections:
-                await self.disconnect(conn)
-
-manager = ConnectionManager()
\ No newline at end of file
+                    device_ip = normalize_ip(device_ip)
+                    known = device_ip in registry
+                except ValueError:
+                    known = False
+                if not known:
+                    client.offer(json.dumps({
+                        "type": "error",
+                        "message": "El dispositivo no está en el registro",
+                        "device_ip": device_ip
+                    }))
+                    return
+            if client:
+                client.topics.add((device_ip, event_type))
+                if device_ip and event_type in (None, "attendance"):
+                    self._ensure_feed(device_ip)
+                if offset is not None and event_type in (None, "attendance"):
+                    task = asyncio.create_task(client.resume(device_ip, offset))
+                    client.replays.add(task)
+                    task.add_done_callback(client.replays.discard)
+
+    async def unsubscribe(self, websocket: WebSocket, device_ip: Optional[str] = None,
+                          event_type: Optional[str] = None):
+        if device_ip is not None:
+            try:
+                device_ip = normalize_ip(device_ip)
+            except ValueError:
+                return
+        async with self._lock:
+            client = self.active_connections.get(websocket)
+            if client:
+                client.topics.discard((device_ip, event_type))
+                self._release_feeds()
+
+    async def handle_message(self, websocket: WebSocket, text: str):
+        """Procesa {"action": "subscribe"|"unsubscribe", "device_ip": ..., "event_type": ..., "offset": ...}"""
+        try:
+            message = json.loads(text)
+            action = message.get("action")
+            offset = message.get("offset")
+            offset = int(offset) if offset is not None else None
+        except (ValueError, TypeError, AttributeError):
+            return
+        if action == "subscribe":
+            await self.subscribe(websocket, message.get("device_ip"), message.get("event_type"), offset)
+        elif action == "unsubscribe":
+            await self.unsubscribe(websocket, message.get("device_ip"), message.get("event_type"))
+
+    def _ensure_feed(self, ip: str):
+        # Las suscripciones a un dispositivo concreto reciben su captura en vivo desde el hub
+        if ip in self._device_feeds:
+            return
+        subscription = capture_hub.subscribe(ip)
+        task = asyncio.create_task(self._forward(subscription))
+        self._device_feeds[ip] = (subscription, task)
+
+    def _release_feeds(self):
+        wanted = {
+            ip
+            for client in self.active_connections.values()
+            for ip, kind in client.topics
+            if ip and kind in (None, "attendance")
+        }
+        for ip in list(self._device_feeds):
+            if ip not in wanted:
+                subscription, task = self._device_feeds.pop(ip)
+                task.cancel()
+                capture_hub.unsubscribe(subscription)
+
+    async def _forward(self, subscription):
+        while True:
+            event = await subscription.get()
+            event_type = "error" if "error" in event else "attendance"
+            await self.broadcast({"type": event_type, **event}, subscription.ip, event_type)
+
+    async def broadcast(self, data: dict, device_ip: Optional[str] = None, event_type: Optional[str] = None):
+        # Se serializa una sola vez y se encola en cada cliente sin esperar envíos
+        message = json.dumps(data, default=str)
+        slow_clients: List[WebSocket] = []
+        for websocket, client in list(self.active_connections.items()):
+            if client.wants(device_ip, event_type) and not client.offer(message, data.get("offset"), device_ip):
+                slow_clients.append(websocket)
+
+        for websocket in slow_clients:
+            logger.warning(f"Cliente lento desconectado: {id(websocket)}")
+            await self.disconnect(websocket)
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": len(self.active_connections),
+            "queued": sum(client.queue.qsize() for client in self.active_connections.values()),
+            "dropped": sum(client.dropped for client in self.active_connections.values()),
+            "device_feeds": list(self._device_feeds)
+        }
+
+manager = ConnectionManager()
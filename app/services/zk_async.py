@@ -0,0 +1,607 @@
+from app.services.attendance_batch import AttendanceBatch, EPOCH_ORDINAL, SECONDS_PER_DAY
+from datetime import date, datetime
+from functools import lru_cache
+from struct import error as StructError, iter_unpack, pack, unpack
+from typing import AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Comandos del protocolo ZK usados por el servicio (mismos valores que zk.const)
+CMD_DB_RRQ = 7
+CMD_USERTEMP_RRQ = 9
+CMD_OPTIONS_RRQ = 11
+CMD_ATTLOG_RRQ = 13
+CMD_CLEAR_ATTLOG = 15
+CMD_DELETE_USER = 18
+CMD_DELETE_USERTEMP = 19
+CMD_GET_FREE_SIZES = 50
+CMD_STARTVERIFY = 60
+CMD_CANCELCAPTURE = 62
+CMD_SAVE_USERTEMPS = 110
+CMD_GET_TIME = 201
+CMD_REG_EVENT = 500
+CMD_CONNECT = 1000
+CMD_EXIT = 1001
+CMD_ENABLEDEVICE = 1002
+CMD_DISABLEDEVICE = 1003
+CMD_REFRESHDATA = 1013
+CMD_TESTVOICE = 1017
+CMD_GET_VERSION = 1100
+CMD_AUTH = 1102
+CMD_PREPARE_DATA = 1500
+CMD_DATA = 1501
+CMD_FREE_DATA = 1502
+CMD_READ_WITH_BUFFER = 1503
+CMD_READ_BUFFER = 1504
+CMD_ACK_OK = 2000
+CMD_ACK_UNAUTH = 2005
+
+FCT_FINGERTMP = 2
+FCT_USER = 5
+EF_ATTLOG = 1
+USER_ADMIN = 14
+
+USHRT_MAX = 65535
+MACHINE_PREPARE_DATA_1 = 20560
+MACHINE_PREPARE_DATA_2 = 32130
+MAX_CHUNK = 0xFFC0
+# Cubre el registro más largo (40 bytes): basta para reconocer si el final del log cambió
+ATTENDANCE_TAIL_BYTES = 40
+UPLOAD_CHUNK = 1024
+
+class ZKProtocolError(Exception):
+    pass
+
+class ZKUser(NamedTuple):
+    uid: int
+    user_id: str
+    name: str
+    privilege: int
+    password: str
+    group_id: str
+    card: int
+
+def user_format_error(user: ZKUser, packet_size: int) -> Optional[str]:
+    """Por qué el usuario no se puede escribir en el formato de usuario del dispositivo, o None"""
+    if packet_size == 28:
+        # El formato corto guarda user_id como entero de 32 bits y el grupo en un byte
+        if not user.user_id.isdigit() or int(user.user_id) > 0xFFFFFFFF:
+            return f"user_id {user.user_id!r} no es numérico y el dispositivo usa el formato de 28 bytes"
+        if user.group_id and (not str(user.group_id).isdigit() or int(user.group_id) > 255):
+            return f"group_id {user.group_id!r} no es un número de 0 a 255 en el formato de 28 bytes"
+    elif len(user.user_id.encode()) > 24:
+        return f"user_id {user.user_id!r} supera los 24 bytes del formato del dispositivo"
+    return None
+
+def _text(raw: bytes) -> str:
+    return raw.split(b"\x00")[0].decode(errors="ignore")
+
+def pack_user(user: ZKUser, packet_size: int) -> bytes:
+    """Registro de usuario en el formato de carga (repack29 / repack73 de la librería zk);
+    user_format_error dice antes si el usuario cabe en él"""
+    if packet_size == 28:
+        return pack("<BHB5s8sIxBhI", 2, user.uid, user.privilege, user.password.encode()[:5],
+                    user.name.encode()[:8], user.card, int(user.group_id or 0), 0, int(user.user_id))
+    return pack("<BHB8s24sIB7sx24s", 2, user.uid, user.privilege, user.password.encode()[:8],
+                user.name.encode()[:24], user.card, 1, str(user.group_id).encode()[:7],
+                str(user.user_id).encode()[:24])
+
+def unpack_user(raw: bytes, packet_size: int) -> ZKUser:
+    """Registro de usuario tal como lo devuelve el dispositivo, igual que get_users de la librería zk"""
+    if packet_size == 28:
+        uid, privilege, password, name, card, group_id, _, user_id = unpack("<HB5s8sIxBhI", raw)
+        group_id, user_id = str(group_id), str(user_id)
+    else:
+        uid, privilege, password, name, card, group_id, user_id = unpack("<HB8s24sIx7sx24s", raw)
+        group_id, user_id = _text(group_id).strip(), _text(user_id)
+    name = _text(name).strip() or f"NN-{user_id}"
+    return ZKUser(uid, user_id, name, privilege, _text(password), group_id, card)
+
+def stored_user(user: ZKUser, packet_size: int) -> ZKUser:
+    """El usuario como lo leerá el dispositivo después de escribirlo: truncado a su formato y,
+    en el de 28 bytes, con user_id y grupo numéricos. Si no cabe en el formato queda igual"""
+    if user_format_error(user, packet_size):
+        return user
+    try:
+        # El registro de carga es el de lectura con un byte de marca delante
+        return unpack_user(pack_user(user, packet_size)[1:], packet_size)
+    except StructError:
+        return user
+
+class ZKTemplate(NamedTuple):
+    uid: int
+    fid: int
+    valid: int
+    template: bytes
+
+class Packet(NamedTuple):
+    command: int
+    session_id: int
+    reply_id: int
+    data: bytes
+
+def checksum(payload: bytes) -> int:
+    """Suma de control de zkemsdk.c"""
+    if len(payload) % 2:
+        payload += b"\x00"
+    total = 0
+    for (word,) in iter_unpack("<H", payload):
+        total += word
+        if total > USHRT_MAX:
+            total -= USHRT_MAX
+    total = ~total
+    while total < 0:
+        total += USHRT_MAX
+    return total
+
+def make_commkey(key: int, session_id: int, ticks: int = 50) -> bytes:
+    """Codifica la contraseña de comunicación con el id de sesión (commpro.c - MakeKey)"""
+    key = int(key)
+    k = 0
+    for i in range(32):
+        k = (k << 1 | 1) if key & (1 << i) else k << 1
+    k += int(session_id)
+    k = unpack("BBBB", pack("I", k & 0xFFFFFFFF))
+    k = pack("BBBB", k[0] ^ ord("Z"), k[1] ^ ord("K"), k[2] ^ ord("S"), k[3] ^ ord("O"))
+    k = unpack("HH", k)
+    k = unpack("BBBB", pack("HH", k[1], k[0]))
+    b = 0xFF & ticks
+    return pack("BBBB", k[0] ^ b, k[1] ^ b, b, k[3] ^ b)
+
+def decode_time(raw: bytes) -> datetime:
+    t = unpack("<I", raw)[0]
+    second = t % 60
+    t //= 60
+    minute = t % 60
+    t //= 60
+    hour = t % 24
+    t //= 24
+    day = t % 31 + 1
+    t //= 31
+    month = t % 12 + 1
+    t //= 12
+    return datetime(t + 2000, month, day, hour, minute, second)
+
+@lru_cache(maxsize=4096)
+def _day_epoch(days: int) -> int:
+    """Segundos desde 1970 de la medianoche de un día codificado como ((año*12)+mes)*31+día"""
+    day = date(days // 372 + 2000, days // 31 % 12 + 1, days % 31 + 1)
+    return (day.toordinal() - EPOCH_ORDINAL) * SECONDS_PER_DAY
+
+def decode_epoch(t: int) -> int:
+    """Como decode_time pero en segundos desde 1970, sin crear un datetime por registro"""
+    return _day_epoch(t // SECONDS_PER_DAY) + t % SECONDS_PER_DAY
+
+def decode_timehex(raw: bytes) -> datetime:
+    year, month, day, hour, minute, second = unpack("6B", raw)
+    return datetime(year + 2000, month, day, hour, minute, second)
+
+class AsyncZK:
+    """Cliente asyncio del protocolo ZK sobre TCP, sin hilos.
+
+    Una tarea lectora separa los paquetes: los eventos en vivo van a su propia cola
+    (y se confirman al instante) y el resto son respuestas al comando en curso.
+    """
+    def __init__(self, ip: str, port: int = 4370, timeout: float = 5, password: int = 0):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.password = password
+        self.session_id = 0
+        self.reply_id = USHRT_MAX - 1
+        self.is_enabled = True
+        # Registrada para eventos en vivo: los eventos llegan a _events entre respuestas
+        self.streaming = False
+        self.records = 0
+        self.users = 0
+        self.fingers = 0
+        self.user_packet_size = 72
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._responses: asyncio.Queue = asyncio.Queue()
+        self._events: asyncio.Queue = asyncio.Queue()
+
+    @property
+    def connected(self) -> bool:
+        return self._reader_task is not None and not self._reader_task.done()
+
+    async def connect(self) -> "AsyncZK":
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.ip, self.port), self.timeout
+        )
+        self._reader_task = asyncio.create_task(self._read_loop())
+        self.session_id = 0
+        self.reply_id = USHRT_MAX - 1
+        response = await self.command(CMD_CONNECT, check=False)
+        self.session_id = response.session_id
+        if response.command == CMD_ACK_UNAUTH:
+            response = await self.command(CMD_AUTH, make_commkey(self.password, self.session_id), check=False)
+        if response.command != CMD_ACK_OK:
+            await self.close()
+            if response.command == CMD_ACK_UNAUTH:
+                raise ZKProtocolError("Unauthenticated")
+            raise ZKProtocolError(f"Respuesta inválida al conectar: {response.command}")
+        return self
+
+    async def disconnect(self):
+        try:
+            if self.connected:
+                await self.command(CMD_EXIT)
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+            self._writer = None
+
+    async def _read_loop(self):
+        try:
+            while True:
+                top = await self._reader.readexactly(8)
+                magic_1, magic_2, length = unpack("<HHI", top)
+                if (magic_1, magic_2) != (MACHINE_PREPARE_DATA_1, MACHINE_PREPARE_DATA_2):
+                    raise ZKProtocolError("Cabecera TCP inválida")
+                body = await self._reader.readexactly(length)
+                command, _, session_id, reply_id = unpack("<4H", body[:8])
+                packet = Packet(command, session_id, reply_id, body[8:])
+                if command == CMD_REG_EVENT:
+                    self._send(CMD_ACK_OK, b"", USHRT_MAX - 1)
+                    self._events.put_nowait(packet)
+                else:
+                    self._responses.put_nowait(packet)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Despierta a quien espere una respuesta o un evento
+            logger.debug(f"Lector de {self.ip} terminado: {str(e)}")
+            error = e if isinstance(e, ZKProtocolError) else ZKProtocolError(f"Conexión perdida: {str(e)}")
+            self._responses.put_nowait(error)
+            self._events.put_nowait(error)
+
+    def _send(self, command: int, data: bytes, reply_id: int):
+        body = pack("<4H", command, 0, self.session_id, reply_id) + data
+        body = pack("<4H", command, checksum(body), self.session_id, reply_id) + data
+        self._writer.write(pack("<HHI", MACHINE_PREPARE_DATA_1, MACHINE_PREPARE_DATA_2, len(body)) + body)
+
+    async def _next(self, timeout: Optional[float] = None, reply_id: Optional[int] = None) -> Packet:
+        """Siguiente respuesta; con reply_id se descartan las que responden a otro comando"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        while True:
+            try:
+                item = await asyncio.wait_for(self._responses.get(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                raise ZKProtocolError(f"Sin respuesta de {self.ip}")
+            if isinstance(item, Exception):
+                raise item
+            if reply_id is None or item.reply_id == reply_id:
+                return item
+            logger.debug(f"Respuesta descartada de {self.ip}: reply_id {item.reply_id}, se esperaba {reply_id}")
+
+    async def command(self, command: int, data: bytes = b"", check: bool = True) -> Packet:
+        """Envía un comando y espera su respuesta"""
+        if self._writer is None:
+            raise ZKProtocolError("Sin conexión")
+        # Descarta respuestas tardías de comandos anteriores que vencieron
+        while not self._responses.empty():
+            item = self._responses.get_nowait()
+            if isinstance(item, Exception):
+                raise item
+        self.reply_id = (self.reply_id + 1) % USHRT_MAX
+        self._send(command, data, self.reply_id)
+        await self._writer.drain()
+        # Una respuesta tardía que llegue después del vaciado tampoco se toma por la de este comando
+        response = await self._next(reply_id=self.reply_id)
+        if check and response.command not in (CMD_ACK_OK, CMD_PREPARE_DATA, CMD_DATA):
+            raise ZKProtocolError(f"Comando {command} rechazado ({response.command})")
+        return response
+
+    async def disable_device(self):
+        await self.command(CMD_DISABLEDEVICE)
+        self.is_enabled = False
+
+    async def enable_device(self):
+        await self.command(CMD_ENABLEDEVICE)
+        self.is_enabled = True
+
+    async def read_sizes(self):
+        data = (await self.command(CMD_GET_FREE_SIZES)).data
+        if len(data) >= 80:
+            fields = unpack("20i", data[:80])
+            self.users = fields[4]
+            self.fingers = fields[6]
+            self.records = fields[8]
+
+    async def get_option(self, name: bytes) -> str:
+        data = (await self.command(CMD_OPTIONS_RRQ, name + b"\x00")).data
+        return _text(data.split(b"=", 1)[-1])
+
+    async def get_firmware_version(self) -> str:
+        return _text((await self.command(CMD_GET_VERSION)).data)
+
+    async def get_time(self) -> datetime:
+        return decode_time((await self.command(CMD_GET_TIME)).data[:4])
+
+    async def test_voice(self, index: int = 0):
+        await self.command(CMD_TESTVOICE, pack("I", index))
+
+    async def _read_data(self, response: Packet) -> bytes:
+        """Cuerpo de una respuesta CMD_DATA, o PREPARE_DATA seguido de paquetes DATA y ACK_OK"""
+        if response.command == CMD_DATA:
+            return response.data
+        if response.command != CMD_PREPARE_DATA:
+            raise ZKProtocolError(f"Respuesta inesperada {response.command}")
+        size = unpack("I", response.data[:4])[0]
+        chunks = []
+        received = 0
+        while received < size:
+            packet = await self._next()
+            if packet.command != CMD_DATA:
+                raise ZKProtocolError(f"Bloque incompleto ({received}/{size} bytes)")
+            chunks.append(packet.data)
+            received += len(packet.data)
+        packet = await self._next()
+        if packet.command != CMD_ACK_OK:
+            raise ZKProtocolError(f"Fin de bloque inesperado {packet.command}")
+        return b"".join(chunks)
+
+    async def prepare_buffer(self, command: int, fct: int = 0, ext: int = 0) -> Tuple[int, Optional[bytes]]:
+        """Pide el buffer (1503): su tamaño y, si el dispositivo lo envió directamente, su contenido.
+
+        Sin contenido, el dispositivo lo deja preparado y se lee por tramos con read_buffer.
+        """
+        response = await self.command(CMD_READ_WITH_BUFFER, pack("<bhii", 1, command, fct, ext))
+        if response.command == CMD_DATA:
+            return len(response.data), response.data
+        return unpack("I", response.data[1:5])[0], None
+
+    async def read_buffer(self, start: int, stop: int) -> bytes:
+        """Bytes [start, stop) del buffer preparado, en bloques de MAX_CHUNK; después lo libera"""
+        chunks = []
+        for offset in range(start, stop, MAX_CHUNK):
+            chunk = await self.command(CMD_READ_BUFFER, pack("<ii", offset, min(MAX_CHUNK, stop - offset)))
+            chunks.append(await self._read_data(chunk))
+        await self.command(CMD_FREE_DATA)
+        return b"".join(chunks)
+
+    async def read_with_buffer(self, command: int, fct: int = 0, ext: int = 0) -> bytes:
+        """Lectura por buffer (1503): respuesta directa o por bloques de MAX_CHUNK"""
+        size, data = await self.prepare_buffer(command, fct, ext)
+        if data is not None:
+            return data
+        return await self.read_buffer(0, size)
+
+    async def get_users(self) -> List[ZKUser]:
+        await self.read_sizes()
+        if self.users == 0:
+            return []
+        data = await self.read_with_buffer(CMD_USERTEMP_RRQ, FCT_USER)
+        if len(data) <= 4:
+            return []
+        total_size = unpack("I", data[:4])[0]
+        packet_size = 28 if total_size / self.users == 28 else 72
+        self.user_packet_size = packet_size
+        view = memoryview(data)[4:]
+        return [
+            unpack_user(bytes(view[offset:offset + packet_size]), packet_size)
+            for offset in range(0, len(view) - packet_size + 1, packet_size)
+        ]
+
+    async def _attendance_buffer(self, start: int = 0) -> Tuple[memoryview, int, Dict[int, str]]:
+        """Buffer de asistencia desde el registro start, tamaño de registro y user_id por uid para
+        los formatos cortos.
+
+        Si el dispositivo deja el buffer preparado solo se transfieren los bytes desde start.
+        """
+        await self.read_sizes()
+        if self.records == 0:
+            return memoryview(b""), 40, {}
+        size, data = await self.prepare_buffer(CMD_ATTLOG_RRQ)
+        if size < 4:
+            if data is None:
+                await self.command(CMD_FREE_DATA)
+            return memoryview(b""), 40, {}
+        record_size = (unpack("I", data[:4])[0] if data is not None else size - 4) // self.records
+        if record_size not in (8, 16):
+            record_size = 40
+        offset = 4 + start * record_size
+        view = memoryview(data)[offset:] if data is not None else memoryview(await self.read_buffer(offset, size))
+        users: Dict[int, str] = {}
+        if record_size in (8, 16):
+            # Los formatos cortos solo traen uid o user_id numérico: se resuelven con los usuarios.
+            # Se leen después de liberar el buffer de asistencia, que get_users reemplazaría
+            for user in await self.get_users():
+                users[user.uid] = user.user_id
+        return view, record_size, users
+
+    async def read_attendance_tail(self) -> Optional[bytes]:
+        """Últimos bytes del log (al menos el último registro) sin transferir el resto"""
+        await self.read_sizes()
+        if self.records == 0:
+            return None
+        size, data = await self.prepare_buffer(CMD_ATTLOG_RRQ)
+        if size <= 4:
+            return None
+        start = max(4, size - ATTENDANCE_TAIL_BYTES)
+        if data is not None:
+            return data[start:size]
+        return await self.read_buffer(start, size)
+
+    @staticmethod
+    def _decode_attendance(view: memoryview, record_size: int, users: Dict[int, str],
+                           start: int, stop: int) -> AttendanceBatch:
+        """Decodifica los registros [start, stop) directamente a columnas"""
+        batch = AttendanceBatch()
+        append = batch.append_epoch
+        chunk = view[start * record_size:stop * record_size]
+        if record_size == 8:
+            for uid, status, timestamp, punch in iter_unpack("<HBIB", chunk):
+                append(users.get(uid, str(uid)), decode_epoch(timestamp), status, punch)
+        elif record_size == 16:
+            for user_id, timestamp, status, punch, _, _ in iter_unpack("<IIBB2sI", chunk):
+                append(str(user_id), decode_epoch(timestamp), status, punch)
+        else:
+            for _, user_id, status, timestamp, punch, _ in iter_unpack("<H24sBIB8s", chunk):
+                append(_text(user_id), decode_epoch(timestamp), status, punch)
+        return batch
+
+    async def download_attendance(self) -> "AttendanceDownload":
+        """Descarga el log sin decodificarlo: se decodifica por lotes después, ya sin usar la sesión"""
+        return AttendanceDownload(*await self._attendance_buffer())
+
+    async def iter_attendance(self, start: int = 0, batch: int = 500) -> AsyncIterator[AttendanceBatch]:
+        """Registros a partir del índice start, en lotes decodificados al vuelo desde el buffer recibido"""
+        for records in (await self.download_attendance()).batches(start, batch):
+            yield records
+            # Cede el loop durante decodificaciones largas
+            await asyncio.sleep(0)
+
+    async def read_attendance(self, start: int = 0) -> AttendanceBatch:
+        """Registros a partir del índice start; del buffer preparado solo se lee ese tramo"""
+        view, record_size, users = await self._attendance_buffer(start)
+        return self._decode_attendance(view, record_size, users, 0, len(view) // record_size)
+
+    async def get_templates(self) -> List[ZKTemplate]:
+        await self.read_sizes()
+        if self.fingers == 0:
+            return []
+        data = await self.read_with_buffer(CMD_DB_RRQ, FCT_FINGERTMP)
+        if len(data) < 4:
+            return []
+        total_size = unpack("i", data[:4])[0]
+        view = memoryview(data)[4:4 + total_size]
+        templates = []
+        offset = 0
+        while offset + 6 <= len(view):
+            size, uid, fid, valid = unpack("<HHbb", view[offset:offset + 6])
+            if size < 6:
+                break
+            templates.append(ZKTemplate(uid, fid, valid, bytes(view[offset + 6:offset + size])))
+            offset += size
+        return templates
+
+    async def save_user_templates(self, batch: List[Tuple[ZKUser, List[ZKTemplate]]]):
+        """Escribe varios usuarios con sus plantillas en una sola transferencia (HR_save_usertemplates)"""
+        upack = []
+        table = []
+        fpack = []
+        offset = 0
+        for user, templates in batch:
+            upack.append(pack_user(user, self.user_packet_size))
+            for template in templates:
+                table.append(pack("<bHbI", 2, user.uid, 0x10 + template.fid, offset))
+                fpack.append(pack("H", len(template.template)) + template.template)
+                offset += len(template.template) + 2
+        upack, table, fpack = b"".join(upack), b"".join(table), b"".join(fpack)
+        buffer = pack("III", len(upack), len(table), len(fpack)) + upack + table + fpack
+        await self.command(CMD_FREE_DATA)
+        await self.command(CMD_PREPARE_DATA, pack("I", len(buffer)))
+        for start in range(0, len(buffer), UPLOAD_CHUNK):
+            await self.command(CMD_DATA, buffer[start:start + UPLOAD_CHUNK])
+        await self.command(CMD_SAVE_USERTEMPS, pack("<IHH", 12, 0, 8))
+        await self.command(CMD_REFRESHDATA)
+
+    async def delete_user(self, uid: int):
+        await self.command(CMD_DELETE_USER, pack("h", uid))
+
+    async def delete_template(self, uid: int, fid: int):
+        await self.command(CMD_DELETE_USERTEMP, pack("hb", uid, fid))
+
+    async def clear_attendance(self):
+        await self.command(CMD_CLEAR_ATTLOG)
+
+    async def refresh_data(self):
+        await self.command(CMD_REFRESHDATA)
+
+    async def reg_event(self, flags: int):
+        await self.command(CMD_REG_EVENT, pack("I", flags))
+
+    async def start_events(self):
+        """Registra la sesión para recibir marcaciones en vivo; los comandos se siguen intercalando"""
+        # Eventos que quedaron de un registro anterior ya no tienen quién los espere
+        while not self._events.empty():
+            item = self._events.get_nowait()
+            if isinstance(item, Exception):
+                raise item
+        await self.command(CMD_CANCELCAPTURE, check=False)
+        await self.command(CMD_STARTVERIFY)
+        await self.reg_event(EF_ATTLOG)
+        self.streaming = True
+
+    async def pause_events(self):
+        if self.streaming:
+            await self.reg_event(0)
+
+    async def resume_events(self):
+        if self.streaming:
+            await self.reg_event(EF_ATTLOG)
+
+    async def stop_events(self):
+        self.streaming = False
+        if self.connected:
+            await self.reg_event(0)
+
+    async def next_events(self, timeout: float) -> List[Dict]:
+        """Marcaciones recibidas en la sesión; lista vacía si no llega ninguna en timeout"""
+        if not self.connected and self._events.empty():
+            raise ZKProtocolError(f"Sesión con {self.ip} cerrada")
+        try:
+            item = await asyncio.wait_for(self._events.get(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        if isinstance(item, Exception):
+            raise item
+        return self._parse_events(item.data)
+
+    @staticmethod
+    def _parse_events(data: bytes) -> List[Dict]:
+        events = []
+        while len(data) >= 12:
+            if len(data) == 12:
+                user_id, status, punch, timehex = unpack("<IBB6s", data)
+                data = data[12:]
+            elif len(data) == 32:
+                user_id, status, punch, timehex = unpack("<24sBB6s", data[:32])
+                data = data[32:]
+            elif len(data) == 36:
+                user_id, status, punch, timehex, _ = unpack("<24sBB6s4s", data[:36])
+                data = data[36:]
+            elif len(data) >= 52:
+                user_id, status, punch, timehex, _ = unpack("<24sBB6s20s", data[:52])
+                data = data[52:]
+            else:
+                break
+            user_id = str(user_id) if isinstance(user_id, int) else _text(user_id)
+            events.append({
+                "user_id": user_id,
+                "timestamp": decode_timehex(timehex),
+                "status": status,
+                "punch": punch
+            })
+        return events
+
+class AttendanceDownload:
+    """Buffer de asistencia recibido del dispositivo, decodificado por lotes a medida que se consume"""
+    def __init__(self, view: memoryview, record_size: int, users: Dict[int, str]):
+        self.view = view
+        self.record_size = record_size
+        self.users = users
+
+    def __len__(self) -> int:
+        return len(self.view) // self.record_size
+
+    def batches(self, start: int = 0, size: int = 500) -> Iterator[AttendanceBatch]:
+        total = len(self)
+        for index in range(start, total, size):
+            yield AsyncZK._decode_attendance(self.view, self.record_size, self.users, index, min(index + size, total))
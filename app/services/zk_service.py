@@ -1,15 +1,32 @@
 # app/services/zk_service.py
 from zk import ZK, const
 from zk.exception import ZKError
+from zk.finger import Finger
+from zk.user import User as ZKLibUser
 import asyncio
 from app.config import settings
-from app.utils.concurrent import executor
+from app.services.device_pool import DevicePool
+from app.services.zk_async import AsyncZK, AttendanceDownload, ZKProtocolError, ZKTemplate, ZKUser, USER_ADMIN, user_format_error
+from app.services.attendance_analytics import analytics
+from app.services.attendance_batch import AttendanceBatch, format_epoch, from_epoch
+from app.services.attendance_store import store
+from app.services.scheduler import (
+    scheduler, single_flight, request_deadline, DeadlineExceeded, Overloaded, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+)
+from app.services.cache import device_cache, MISSING
+from app.services.change_tracker import DeviceSizes, attendance_etag, change_tracker, tail_marker
+from app.services.leader_proxy import LeaderRequired
+from app.services.shared_state import leader
+from app.services.webhooks import webhooks
+from app.services import metrics
 from fastapi import HTTPException
-from app.models.schemas import AttendanceRecord, User, DeviceInfo
+from app.models.schemas import User, DeviceInfo
 from datetime import datetime
 import logging
-from typing import List, Callable, Dict, Any, Optional
+from typing import List, Callable, Dict, Any, Optional, Iterator, AsyncIterator, Tuple
+import json
 import socket
+import threading
 import time
 
 logger = logging.getLogger(__name__)
@@ -17,6 +34,28 @@ logger = logging.getLogger(__name__)
 # Manejo de conexiones activas para limpieza
 active_connections = []
 
+class RotationError(Exception):
+    """La rotación no pudo verificar el archivo; el log del dispositivo queda intacto"""
+
+class AttendanceRecords:
+    """Registros descargados por la librería zk, pasados a lotes columnares a medida que se consumen"""
+    def __init__(self, records: list):
+        self.records = records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def batches(self, start: int = 0, size: Optional[int] = None) -> Iterator[AttendanceBatch]:
+        size = size or settings.STREAM_BATCH_SIZE
+        records = self.records
+        for index in range(start, len(records), size):
+            batch = AttendanceBatch()
+            for record in records[index:index + size]:
+                batch.append(record.user_id, record.timestamp, record.status, record.punch)
+            # Cada registro se libera al copiarlo al lote
+            records[index:index + size] = [None] * len(records[index:index + size])
+            yield batch
+
 class DeviceConnection:
     def __init__(self, ip: str, password: Optional[str] = None):
         """Inicializa la conexión con el dispositivo"""
@@ -38,6 +77,8 @@ class DeviceConnection:
         """Establece conexión con el dispositivo con reintentos"""
         for attempt in range(retries):
             try:
+                if self not in active_connections:
+                    active_connections.append(self)
                 if not self.conn:
                     logger.info(f"Conectando a dispositivo {self.ip} (intento {attempt+1}/{retries})")
                     self.conn = self.zk.connect()
@@ -47,6 +88,7 @@ class DeviceConnection:
             except (ZKError, socket.error, socket.timeout) as e:
                 if attempt < retries - 1:
                     wait_time = 2 ** attempt
+                    metrics.CONNECT_RETRIES.inc(device=self.ip)
                     logger.warning(f"Error de conexión, reintentando en {wait_time} segundos...")
                     time.sleep(wait_time)
                 else:
@@ -102,28 +144,28 @@ class DeviceConnection:
         except Exception as e:
             logger.error(f"Error obteniendo usuarios en {self.ip}: {str(e)}")
             raise
-        finally:
-            self.disconnect()
 
-    def get_attendance(self) -> List[AttendanceRecord]:
-        """Obtiene registros de asistencia"""
+    def download_attendance(self) -> "AttendanceRecords":
+        """Descarga la asistencia; la conversión a lotes columnares se hace al consumirla"""
+        self.connect()
+        started = time.perf_counter()
+        attendance = self.conn.get_attendance()
+        count = len(attendance)
+        metrics.ATTENDANCE_RECORDS.inc(count, device=self.ip)
+        metrics.ATTENDANCE_RATE.set(count / max(time.perf_counter() - started, 1e-6), device=self.ip)
+        return AttendanceRecords(attendance)
+
+    def get_attendance(self, start: int = 0) -> AttendanceBatch:
+        """Obtiene registros de asistencia a partir del índice start"""
+        # La librería zk no lee tramos del buffer: se descarga el log completo y se descarta el resto
         try:
-            self.connect()
-            attendance = self.conn.get_attendance()
-            return [
-                AttendanceRecord(
-                    user_id=record.user_id,
-                    timestamp=record.timestamp,
-                    status=record.status,
-                    punch=record.punch
-                )
-                for record in attendance
-            ]
+            attendance = AttendanceBatch()
+            for batch in self.download_attendance().batches(start):
+                attendance.extend(batch)
+            return attendance
         except Exception as e:
             logger.error(f"Error obteniendo asistencia en {self.ip}: {str(e)}")
             raise
-        finally:
-            self.disconnect()
 
     def get_device_info(self) -> DeviceInfo:
         """Obtiene información detallada del dispositivo"""
@@ -140,8 +182,6 @@ class DeviceConnection:
         except Exception as e:
             logger.error(f"Error obteniendo info de {self.ip}: {str(e)}")
             raise
-        finally:
-            self.disconnect()
 
     def test_voice(self, index: int = 0) -> None:
         """Reproduce un mensaje de voz (0: 'Thank You')"""
@@ -151,20 +191,25 @@ class DeviceConnection:
         except Exception as e:
             logger.error(f"Error en prueba de voz: {str(e)}")
             raise
-        finally:
-            self.disconnect()
 
-    def live_capture(self, callback: Callable[[Dict[str, Any]], None], timeout: int = 30) -> None:
-        """Captura eventos en tiempo real con manejo de timeout"""
+    def live_capture(self, callback: Callable[[Dict[str, Any]], None], timeout: int = 30,
+                     stop: Optional[threading.Event] = None) -> None:
+        """Captura eventos en tiempo real hasta el timeout o hasta que se active stop"""
         try:
             self.connect()
             start_time = datetime.now()
             logger.info(f"Iniciando captura en vivo en {self.ip} (timeout: {timeout}s)")
             
-            for attendance in self.conn.live_capture():
+            for attendance in self.conn.live_capture(new_timeout=settings.LIVE_CAPTURE_POLL_INTERVAL):
+                if stop is not None and stop.is_set():
+                    logger.info(f"Captura detenida en {self.ip}")
+                    self.conn.end_live_capture = True
+                    continue
                 if (datetime.now() - start_time).total_seconds() > timeout:
                     logger.info(f"Timeout alcanzado en {self.ip}")
-                    break
+                    # Deja que el generador termine y restaure la sesión para reutilizarla
+                    self.conn.end_live_capture = True
+                    continue
                     
                 if attendance:
                     event_data = {
@@ -174,6 +219,7 @@ class DeviceConnection:
                         "punch": attendance.punch,
                         "device_ip": self.ip
                     }
+                    metrics.LIVE_EVENTS.inc(device=self.ip)
                     try:
                         callback(event_data)
                     except Exception as e:
@@ -181,86 +227,757 @@ class DeviceConnection:
         except Exception as e:
             logger.error(f"Error en captura en vivo en {self.ip}: {str(e)}")
             raise RuntimeError(f"Error en captura en vivo: {str(e)}")
-        finally:
-            self.disconnect()
 
-    def save_user_templates(self, user_templates: List[tuple]) -> None:
-        """Guarda múltiples plantillas a alta velocidad"""
+    def get_enrollment(self) -> Tuple[List[ZKUser], List[ZKTemplate], int]:
+        """Usuarios y plantillas tal como están en el dispositivo, para comparar entre equipos,
+        y el tamaño de su registro de usuario (28 o 72 bytes)"""
+        self.connect()
+        users = [
+            ZKUser(user.uid, user.user_id, user.name, user.privilege, user.password, user.group_id, user.card)
+            for user in self.conn.get_users()
+        ]
+        templates = [
+            ZKTemplate(finger.uid, finger.fid, finger.valid, finger.template)
+            for finger in self.conn.get_templates()
+        ]
+        return users, templates, self.conn.user_packet_size
+
+    def save_user_templates(self, user_templates: List[Tuple[ZKUser, List[ZKTemplate]]]) -> None:
+        """Guarda múltiples usuarios con sus plantillas a alta velocidad"""
+        self.connect()
+        batch = [
+            (
+                ZKLibUser(user.uid, user.name, user.privilege, user.password, user.group_id, user.user_id, user.card),
+                [Finger(user.uid, template.fid, template.valid, template.template) for template in templates]
+            )
+            for user, templates in user_templates
+        ]
+        if hasattr(self.conn, "HR_save_usertemplates"):
+            # Versiones recientes de la librería envían todo el lote en una sola transferencia
+            self.conn.HR_save_usertemplates(batch)
+            return
+        for user, fingers in batch:
+            self.conn.save_user_template(user, fingers)
+
+    def delete_enrollment(self, uids: List[int], templates: List[Tuple[int, int]]) -> None:
+        """Borra usuarios completos y plantillas sueltas (uid, fid)"""
+        self.connect()
+        for uid, fid in templates:
+            self.conn.delete_user_template(uid=uid, temp_id=fid)
+        for uid in uids:
+            self.conn.delete_user(uid=uid)
+        self.conn.refresh_data()
+
+    def clear_attendance(self) -> None:
+        """Vacía el log de asistencia del dispositivo"""
+        self.connect()
+        self.conn.clear_attendance()
+
+    def get_sizes(self) -> DeviceSizes:
+        """Usuarios, huellas y registros almacenados en el dispositivo, con un solo comando"""
+        self.connect()
+        self.conn.read_sizes()
+        return DeviceSizes(self.conn.users, self.conn.fingers, self.conn.records)
+
+    def is_alive(self) -> bool:
+        """Verifica con un comando ligero que la sesión siga abierta"""
+        if not self.conn:
+            return False
         try:
-            self.connect()
-            self.conn.save_user_template(user_templates)
-        finally:
-            self.disconnect()
+            self.conn.read_sizes()
+            return True
+        except Exception as e:
+            logger.debug(f"Sesión caída en {self.ip}: {str(e)}")
+            return False
+
+class ThreadedDeviceConnection:
+    """Backend de respaldo: la librería zk bloqueante, con cada llamada en un hilo del executor"""
+    # live_capture de la librería bloquea el socket: la captura ocupa la sesión entera
+    multiplexed = False
+    streaming = False
+
+    def __init__(self, ip: str, password: Optional[str] = None):
+        self.device = DeviceConnection(ip, password)
+        self.ip = ip
+        self.password = self.device.password
+
+    @property
+    def conn(self):
+        return self.device.conn
+
+    async def connect(self) -> None:
+        await metrics.run_blocking(self.device.connect)
+
+    async def disconnect(self) -> None:
+        await metrics.run_blocking(self.device.disconnect)
+
+    async def disable_device(self) -> None:
+        await metrics.run_blocking(self.device.disable_device)
+
+    async def enable_device(self) -> None:
+        await metrics.run_blocking(self.device.enable_device)
+
+    async def is_alive(self) -> bool:
+        return await metrics.run_blocking(self.device.is_alive)
+
+    async def get_users(self) -> List[User]:
+        return await metrics.run_blocking(self.device.get_users)
+
+    async def download_attendance(self) -> AttendanceRecords:
+        return await metrics.run_blocking(self.device.download_attendance)
+
+    async def get_attendance(self, start: int = 0) -> AttendanceBatch:
+        return await metrics.run_blocking(self.device.get_attendance, start)
+
+    async def get_attendance_tail(self) -> Optional[bytes]:
+        # La librería zk no lee tramos del buffer: la ETag de asistencia queda solo con contadores
+        return None
+
+    async def get_sizes(self) -> DeviceSizes:
+        return await metrics.run_blocking(self.device.get_sizes)
+
+    async def get_device_info(self) -> DeviceInfo:
+        return await metrics.run_blocking(self.device.get_device_info)
+
+    async def test_voice(self, index: int = 0) -> None:
+        await metrics.run_blocking(self.device.test_voice, index)
+
+    async def get_enrollment(self) -> Tuple[List[ZKUser], List[ZKTemplate], int]:
+        return await metrics.run_blocking(self.device.get_enrollment)
+
+    async def save_user_templates(self, user_templates: List[Tuple[ZKUser, List[ZKTemplate]]]) -> None:
+        await metrics.run_blocking(self.device.save_user_templates, user_templates)
+
+    async def delete_enrollment(self, uids: List[int], templates: List[Tuple[int, int]]) -> None:
+        await metrics.run_blocking(self.device.delete_enrollment, uids, templates)
+
+    async def clear_attendance(self) -> None:
+        await metrics.run_blocking(self.device.clear_attendance)
+
+    async def live_capture(self, callback: Callable, timeout: int = 30,
+                           stop: Optional[threading.Event] = None) -> None:
+        loop = asyncio.get_running_loop()
+
+        def safe_callback(event):
+            asyncio.run_coroutine_threadsafe(callback(event), loop)
+
+        await metrics.run_blocking(self.device.live_capture, safe_callback, timeout, stop)
+
+class AsyncDeviceConnection:
+    """Backend nativo asyncio: sin hilos, una tarea lectora por sesión"""
+    # La sesión recibe eventos en vivo y atiende comandos a la vez
+    multiplexed = True
+
+    def __init__(self, ip: str, password: Optional[str] = None):
+        self.ip = ip
+        self.password = password or settings.DEVICE_PASSWORD
+        self.conn: Optional[AsyncZK] = None
+
+    async def connect(self, retries: int = 3) -> None:
+        """Establece conexión con el dispositivo con reintentos"""
+        for attempt in range(retries):
+            if self.conn:
+                return
+            client = AsyncZK(self.ip, port=settings.DEVICE_PORT, timeout=settings.DEVICE_TIMEOUT,
+                             password=int(self.password))
+            try:
+                logger.info(f"Conectando a dispositivo {self.ip} (intento {attempt+1}/{retries})")
+                self.conn = await client.connect()
+                logger.info(f"Conexión exitosa a {self.ip}")
+            except (ZKProtocolError, OSError, asyncio.TimeoutError) as e:
+                await client.close()
+                if attempt < retries - 1:
+                    wait_time = 2 ** attempt
+                    metrics.CONNECT_RETRIES.inc(device=self.ip)
+                    logger.warning(f"Error de conexión, reintentando en {wait_time} segundos...")
+                    await asyncio.sleep(wait_time)
+                else:
+                    logger.error(f"Error de conexión en {self.ip}: {str(e)}")
+                    raise ConnectionError(f"Error de conexión: {str(e)}")
+
+    async def disconnect(self) -> None:
+        """Cierra la conexión y limpia recursos"""
+        if self.conn:
+            try:
+                logger.debug(f"Desconectando de {self.ip}")
+                await self.conn.disconnect()
+            except Exception as e:
+                logger.warning(f"Error desconectando {self.ip}: {str(e)}")
+            finally:
+                self.conn = None
+
+    async def disable_device(self) -> None:
+        if self.conn:
+            logger.debug(f"Deshabilitando dispositivo {self.ip}")
+            await self.conn.disable_device()
+
+    async def enable_device(self) -> None:
+        if self.conn:
+            logger.debug(f"Habilitando dispositivo {self.ip}")
+            await self.conn.enable_device()
+
+    async def is_alive(self) -> bool:
+        if not self.conn or not self.conn.connected:
+            return False
+        try:
+            await self.conn.read_sizes()
+            return True
+        except Exception as e:
+            logger.debug(f"Sesión caída en {self.ip}: {str(e)}")
+            return False
+
+    async def get_users(self) -> List[User]:
+        await self.connect()
+        return [
+            User(
+                uid=user.uid,
+                user_id=user.user_id,
+                name=user.name,
+                privilege="Admin" if user.privilege == USER_ADMIN else "User",
+                password=user.password,
+                group_id=user.group_id
+            )
+            for user in await self.conn.get_users()
+        ]
+
+    async def download_attendance(self) -> AttendanceDownload:
+        await self.connect()
+        started = time.perf_counter()
+        download = await self.conn.download_attendance()
+        self._record_rate(len(download), started)
+        return download
+
+    async def get_attendance(self, start: int = 0) -> AttendanceBatch:
+        await self.connect()
+        started = time.perf_counter()
+        attendance = await self.conn.read_attendance(start)
+        self._record_rate(len(attendance), started)
+        return attendance
+
+    async def get_attendance_tail(self) -> Optional[bytes]:
+        await self.connect()
+        return await self.conn.read_attendance_tail()
+
+    def _record_rate(self, count: int, started: float):
+        metrics.ATTENDANCE_RECORDS.inc(count, device=self.ip)
+        metrics.ATTENDANCE_RATE.set(count / max(time.perf_counter() - started, 1e-6), device=self.ip)
+
+    async def get_sizes(self) -> DeviceSizes:
+        await self.connect()
+        await self.conn.read_sizes()
+        return DeviceSizes(self.conn.users, self.conn.fingers, self.conn.records)
+
+    async def get_device_info(self) -> DeviceInfo:
+        await self.connect()
+        return DeviceInfo(
+            firmware_version=await self.conn.get_firmware_version(),
+            device_name=await self.conn.get_option(b"~DeviceName"),
+            serial_number=await self.conn.get_option(b"~SerialNumber"),
+            mac_address=await self.conn.get_option(b"MAC"),
+            platform=await self.conn.get_option(b"~Platform"),
+            device_time=str(await self.conn.get_time())
+        )
+
+    async def test_voice(self, index: int = 0) -> None:
+        await self.connect()
+        await self.conn.test_voice(index)
+
+    async def get_enrollment(self) -> Tuple[List[ZKUser], List[ZKTemplate], int]:
+        await self.connect()
+        users = await self.conn.get_users()
+        return users, await self.conn.get_templates(), self.conn.user_packet_size
+
+    async def save_user_templates(self, user_templates: List[Tuple[ZKUser, List[ZKTemplate]]]) -> None:
+        """Guarda múltiples usuarios con sus plantillas en una sola transferencia"""
+        await self.connect()
+        await self.conn.save_user_templates(user_templates)
+
+    async def delete_enrollment(self, uids: List[int], templates: List[Tuple[int, int]]) -> None:
+        """Borra usuarios completos y plantillas sueltas (uid, fid)"""
+        await self.connect()
+        for uid, fid in templates:
+            await self.conn.delete_template(uid, fid)
+        for uid in uids:
+            await self.conn.delete_user(uid)
+        await self.conn.refresh_data()
+
+    async def clear_attendance(self) -> None:
+        await self.connect()
+        await self.conn.clear_attendance()
+
+    @property
+    def streaming(self) -> bool:
+        return self.conn is not None and self.conn.streaming
+
+    async def start_events(self) -> None:
+        await self.connect()
+        if not self.conn.streaming:
+            logger.info(f"Registrando eventos en vivo en {self.ip}")
+            await self.conn.start_events()
+
+    async def stop_events(self) -> None:
+        if self.conn:
+            logger.info(f"Desregistrando eventos en vivo en {self.ip}")
+            await self.conn.stop_events()
+
+    @property
+    def connected(self) -> bool:
+        return self.conn is not None and self.conn.connected
+
+    async def restore_events(self) -> None:
+        """Tras un comando interrumpido deja la sesión como la espera la captura"""
+        await self.conn.enable_device()
+        await self.conn.resume_events()
+
+    async def pause_events(self) -> None:
+        await self.conn.pause_events()
+
+    async def resume_events(self) -> None:
+        await self.conn.resume_events()
+
+    async def next_events(self, timeout: float) -> List[Dict[str, Any]]:
+        if not self.conn:
+            raise ZKProtocolError(f"Sesión con {self.ip} cerrada")
+        return await self.conn.next_events(timeout)
+
+BACKENDS = {
+    "asyncio": AsyncDeviceConnection,
+    "zk": ThreadedDeviceConnection
+}
+
+# Sesiones persistentes compartidas por todas las operaciones
+pool = DevicePool(BACKENDS[settings.ZK_BACKEND])
+# Sincronización y rotación del log de asistencia no se solapan en un mismo dispositivo
+attendance_locks: Dict[str, asyncio.Lock] = {}
+
+async def with_device(ip: str, operation: Callable, password: Optional[str] = None,
+                      priority: int = PRIORITY_INTERACTIVE, name: str = "operation"):
+    """Contexto seguro para operaciones con el dispositivo, en su cola y con una sesión del pool"""
+    if not leader.is_leader:
+        # Solo el líder abre sesiones: así cada dispositivo tiene una única cola entre todos los workers
+        raise LeaderRequired(ip)
+    timings = metrics.request_timings.get()
+    submitted = time.perf_counter()
+
+    async def job():
+        queued = time.perf_counter() - submitted
+        metrics.DEVICE_QUEUE_SECONDS.observe(queued, device=ip)
+        # La cola del dispositivo corre en otra tarea: se le asocian los tiempos de esta petición
+        with metrics.bind_timings(timings):
+            metrics.record_timing("device_queue", queued)
+            async with pool.session(ip, password) as device:
+                # Con captura en vivo la sesión es compartida: los eventos se pausan durante el comando
+                paused = device.streaming
+                if paused:
+                    await metrics.timed_call("pause_events", ip, device.pause_events)
+                # Deshabilitar durante la operación y volver a habilitar siempre
+                await metrics.timed_call("disable", ip, device.disable_device)
+                try:
+                    started = time.perf_counter()
+                    result = await metrics.timed_call("operation", ip, operation, device)
+                    metrics.COMMAND_SECONDS.observe(time.perf_counter() - started, device=ip, command=name)
+                    return result
+                finally:
+                    if device.conn:
+                        await metrics.timed_call("enable", ip, device.enable_device)
+                    if paused and device.streaming:
+                        await metrics.timed_call("resume_events", ip, device.resume_events)
 
-async def with_device(ip: str, operation: Callable, password: Optional[str] = None):
-    """Contexto seguro para operaciones con el dispositivo"""
-    device = DeviceConnection(ip, password)
-    loop = asyncio.get_event_loop()
     try:
-        # Conectar y deshabilitar
-        await loop.run_in_executor(executor, device.connect)
-        await loop.run_in_executor(executor, device.disable_device)
-        
-        # Ejecutar operación
-        result = await loop.run_in_executor(executor, operation, device)
-        return result
-    except ZKError as e:
+        return await scheduler.submit(ip, job, priority, request_deadline.get())
+    except Overloaded as e:
+        metrics.SHED_REQUESTS.inc(device=ip, reason="global" if e.global_limit else "device")
+        logger.warning(f"Operación rechazada en {ip}: {str(e)}")
+        raise HTTPException(status_code=503 if e.global_limit else 429, detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        metrics.DEADLINES_EXCEEDED.inc(device=ip, command=name)
+        logger.warning(f"Plazo agotado en {ip} ({name}): {str(e)}")
+        raise HTTPException(status_code=504, detail=str(e))
+    except (ZKError, ZKProtocolError) as e:
+        metrics.ERRORS.inc(device=ip, command=name)
         logger.exception(f"Error específico ZK en dispositivo {ip}")
         raise HTTPException(status_code=503, detail=f"Error ZK: {str(e)}")
     except Exception as e:
+        metrics.ERRORS.inc(device=ip, command=name)
         logger.exception(f"Error en operación con dispositivo {ip}")
         raise HTTPException(status_code=503, detail=f"Error en dispositivo: {str(e)}")
-    finally:
-        # Habilitar y desconectar
-        if device.conn:
-            await loop.run_in_executor(executor, device.enable_device)
-            await loop.run_in_executor(executor, device.disconnect)
 
-async def get_attendance(ip: str, password: Optional[str] = None) -> List[AttendanceRecord]:
+async def coalesced(ip: str, name: str, password: Optional[str], fetch: Callable[[], Any]):
+    """Lecturas idénticas y simultáneas comparten una sola consulta al dispositivo y su resultado"""
+    key = (ip, name, password)
+    if single_flight.in_flight(key):
+        metrics.COALESCED_READS.inc(device=ip, command=name)
+    try:
+        return await single_flight.run(key, fetch)
+    except DeadlineExceeded as e:
+        metrics.DEADLINES_EXCEEDED.inc(device=ip, command=name)
+        raise HTTPException(status_code=504, detail=str(e))
+
+async def observe_attendance(ip: str, device) -> Dict[str, Any]:
+    """Contadores y huella del último registro del log, sin descargar el resto"""
+    sizes = await device.get_sizes()
+    return await change_tracker.observe(ip, sizes, tail_marker(await device.get_attendance_tail()))
+
+async def check_changes(ip: str, password: Optional[str] = None,
+                        priority: int = PRIORITY_INTERACTIVE, tail: bool = False) -> Dict[str, Any]:
+    """Lee solo los contadores del dispositivo y devuelve su estado de cambios.
+
+    Con tail también lee el final del log, para que la ETag de asistencia cambie aunque
+    el log se haya vaciado y rellenado hasta el mismo número de registros.
+    """
+    async def operation(device):
+        if tail:
+            return await observe_attendance(ip, device)
+        return await change_tracker.observe(ip, await device.get_sizes())
+    name = "sizes_tail" if tail else "sizes"
+    return await coalesced(ip, name, password,
+                           lambda: with_device(ip, operation, password, priority, name=name))
+
+async def get_attendance_versioned(ip: str, password: Optional[str] = None) -> Tuple[Dict[str, Any], AttendanceBatch]:
+    """Asistencia del dispositivo y su estado de cambios; si ni los contadores ni el final del
+    log cambiaron desde la última descarga se reutiliza sin volver a transferir el log"""
+    async def operation(device):
+        state = await observe_attendance(ip, device)
+        etag = attendance_etag(state)
+        cached = await device_cache.get((ip, "attendance"))
+        if cached is not MISSING and cached[0] == etag:
+            metrics.ATTENDANCE_DOWNLOADS_SKIPPED.inc(device=ip)
+            return state, cached[1]
+        attendance = await device.get_attendance()
+        await device_cache.set((ip, "attendance"), (etag, attendance), settings.ATTENDANCE_CACHE_TTL)
+        return state, attendance
+    return await coalesced(ip, "attendance", password,
+                           lambda: with_device(ip, operation, password, name="attendance"))
+
+async def get_attendance(ip: str, password: Optional[str] = None) -> AttendanceBatch:
     """Obtiene registros de asistencia de forma asíncrona"""
-    def operation(device):
-        return device.get_attendance()
-    return await with_device(ip, operation, password)
-
-async def get_users(ip: str, password: Optional[str] = None) -> List[User]:
-    """Obtiene usuarios de forma asíncrona"""
-    def operation(device):
-        return device.get_users()
-    return await with_device(ip, operation, password)
-
-async def get_device_info(ip: str, password: Optional[str] = None) -> DeviceInfo:
-    """Obtiene información del dispositivo de forma asíncrona"""
-    def operation(device):
-        return device.get_device_info()
-    return await with_device(ip, operation, password)
+    _, attendance = await get_attendance_versioned(ip, password)
+    return attendance
+
+def _error_line(error: Exception) -> bytes:
+    detail = error.detail if isinstance(error, HTTPException) else str(error)
+    return (json.dumps({"error": detail}) + "\n").encode()
+
+async def stream_attendance(ip: str, password: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Emite la asistencia del dispositivo como NDJSON en bloques.
+
+    El dispositivo solo se ocupa para descargar el log: se vuelve a habilitar y se libera su
+    cola antes de emitir nada, así que un cliente lento no retiene la terminal. Los lotes se
+    decodifican del buffer recibido a medida que el cliente los consume.
+    """
+    async def operation(device):
+        return await device.download_attendance()
+
+    try:
+        download = await with_device(ip, operation, password, name="attendance_stream")
+    except Exception as e:
+        logger.error(f"Error transmitiendo asistencia de {ip}: {str(e)}")
+        yield _error_line(e)
+        return
+    for batch in download.batches(0, settings.STREAM_BATCH_SIZE):
+        yield batch.to_ndjson()
+
+async def stream_stored_attendance(ip: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                                   user_id: Optional[str] = None, limit: Optional[int] = None,
+                                   cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Emite como NDJSON la asistencia del almacén local, página a página"""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        page_size = settings.STREAM_BATCH_SIZE if remaining is None else min(remaining, settings.STREAM_BATCH_SIZE)
+        try:
+            records, cursor = await asyncio.to_thread(store.query, ip, since, until, user_id, page_size, cursor)
+        except Exception as e:
+            yield _error_line(e)
+            return
+        if records:
+            yield AttendanceBatch.from_records(records).to_ndjson()
+        if remaining is not None:
+            remaining -= len(records)
+        if not cursor:
+            return
+
+async def archive_records(ip: str, records: AttendanceBatch, count: int) -> int:
+    """Guarda en el almacén local los registros descargados y avisa de los nuevos"""
+    last_row_id = await asyncio.to_thread(store.last_row_id, ip) if webhooks.enabled else 0
+    inserted = await asyncio.to_thread(store.add_records, ip, records, count)
+    if inserted:
+        # Marcaciones atrasadas cambian días que el análisis ya daba por cerrados
+        await asyncio.to_thread(analytics.invalidate_from, from_epoch(min(records.timestamps)))
+        if webhooks.enabled:
+            new_records = await asyncio.to_thread(store.records_after, ip, last_row_id)
+            await webhooks.publish([
+                {"type": "attendance.synced", "device_ip": ip, **record} for record in new_records
+            ])
+    return inserted
+
+async def unsynced_records(ip: str, records: AttendanceBatch, offset: int,
+                           synced: int) -> Optional[AttendanceBatch]:
+    """Registros del lote (leído desde el índice offset) posteriores a la marca de agua synced.
+
+    El registro en synced-1 tiene que estar archivado; si no lo está, el log se vació fuera
+    del servicio y volvió a llenarse, y se devuelve None para que se archive completo.
+    """
+    anchor = records[synced - 1 - offset:synced - offset]
+    archived, _ = await asyncio.to_thread(store.verify_archived, ip, anchor)
+    if not archived:
+        logger.warning(f"El log de {ip} no coincide con lo sincronizado; se archiva completo")
+        return None
+    return records[synced - offset:]
+
+async def sync_attendance(ip: str, password: Optional[str] = None,
+                          priority: int = PRIORITY_BACKGROUND) -> int:
+    """Descarga solo los registros posteriores a la marca de agua y los guarda en el almacén local"""
+    async def sync():
+        async with attendance_locks.setdefault(ip, asyncio.Lock()):
+            state = await asyncio.to_thread(store.get_sync_state, ip)
+            synced = state["record_count"]
+
+            async def operation(device):
+                count = (await change_tracker.observe(ip, await device.get_sizes()))["records"]
+                if count == synced:
+                    return count, AttendanceBatch()
+                # Se lee también el último registro ya archivado para comprobar que el log es el mismo
+                offset = synced - 1 if 0 < synced < count else 0
+                records = await device.get_attendance(offset)
+                if offset:
+                    records = await unsynced_records(ip, records, offset, synced)
+                    if records is None:
+                        records = await device.get_attendance()
+                return count, records
+
+            count, records = await with_device(ip, operation, password, priority, name="attendance_sync")
+            if count == synced:
+                return 0
+            inserted = await archive_records(ip, records, count)
+        logger.info(f"Sincronizados {inserted} registros nuevos de {ip} ({count} en el dispositivo)")
+        return inserted
+
+    # Una sincronización ya en curso cubre a las que lleguen mientras tanto
+    return await coalesced(ip, "attendance_sync", password, sync)
+
+async def rotate_attendance(ip: str, password: Optional[str] = None,
+                            priority: int = PRIORITY_BACKGROUND) -> Dict[str, Any]:
+    """Archiva el log completo del dispositivo, lo verifica contra el archivo y solo entonces lo vacía.
+
+    Todo ocurre en una sola sesión con el dispositivo deshabilitado, así que no entran
+    marcaciones nuevas entre la descarga y el borrado. Si algo no cuadra, el log queda intacto.
+    Solo se archiva lo posterior a la marca de agua: lo ya sincronizado no vuelve a
+    invalidar el análisis ni a publicarse.
+    """
+    async def operation(device):
+        sizes = await device.get_sizes()
+        records = await device.get_attendance()
+        if len(records) != sizes.records:
+            raise RotationError(f"El dispositivo informa {sizes.records} registros y se descargaron {len(records)}")
+        if not records:
+            return {"device_ip": ip, "status": "empty", "records": 0}
+        synced = (await asyncio.to_thread(store.get_sync_state, ip))["record_count"]
+        pending = await unsynced_records(ip, records, 0, synced) if 0 < synced <= len(records) else None
+        if pending is None:
+            pending = records
+        inserted = await archive_records(ip, pending, sizes.records) if len(pending) else 0
+        await asyncio.to_thread(store.checkpoint)
+        digest = records.digest()
+        archived, archived_digest = await asyncio.to_thread(store.verify_archived, ip, records)
+        distinct = len(set(records.tuples()))
+        if archived != distinct or archived_digest != digest:
+            raise RotationError(f"Verificación fallida: {archived} de {distinct} registros archivados")
+        if (await device.get_sizes()).records != sizes.records:
+            raise RotationError("El log del dispositivo cambió durante la rotación")
+        await device.clear_attendance()
+        timestamps = [format_epoch(min(records.timestamps)), format_epoch(max(records.timestamps))]
+        await asyncio.to_thread(store.add_rotation, ip, sizes.records, digest, *timestamps)
+        await change_tracker.observe(ip, await device.get_sizes())
+        return {
+            "device_ip": ip,
+            "status": "rotated",
+            "records": sizes.records,
+            "inserted": inserted,
+            "digest": digest,
+            "first_timestamp": timestamps[0],
+            "last_timestamp": timestamps[1]
+        }
+
+    async def rotate():
+        try:
+            async with attendance_locks.setdefault(ip, asyncio.Lock()):
+                result = await with_device(ip, operation, password, priority, name="attendance_rotate")
+        except HTTPException:
+            metrics.ROTATIONS.inc(device=ip, result="failed")
+            raise
+        finally:
+            await device_cache.invalidate((ip, "attendance"))
+        metrics.ROTATIONS.inc(device=ip, result=result["status"])
+        if result["status"] == "rotated":
+            logger.info(f"Log de {ip} archivado y vaciado: {result['records']} registros ({result['digest'][:12]})")
+        return result
+
+    return await coalesced(ip, "attendance_rotate", password, rotate)
+
+async def rotation_due(ip: str) -> bool:
+    """Según ATTENDANCE_ROTATION_THRESHOLD (registros en el dispositivo) o ATTENDANCE_ROTATION_INTERVAL_HOURS"""
+    state = await check_changes(ip, priority=PRIORITY_BACKGROUND)
+    if not state["records"]:
+        return False
+    if settings.ATTENDANCE_ROTATION_THRESHOLD and state["records"] >= settings.ATTENDANCE_ROTATION_THRESHOLD:
+        return True
+    if settings.ATTENDANCE_ROTATION_INTERVAL_HOURS:
+        history = await asyncio.to_thread(store.rotations, ip, 1)
+        # Un log que nunca se rotó ya cumple el plazo
+        return not history or time.time() - history[0]["rotated_at"] >= settings.ATTENDANCE_ROTATION_INTERVAL_HOURS * 3600
+    return False
+
+async def query_attendance(ip: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                           user_id: Optional[str] = None, limit: Optional[int] = None,
+                           cursor: Optional[str] = None):
+    """Consulta la asistencia sincronizada sin contactar al dispositivo"""
+    return await asyncio.to_thread(
+        store.query, ip, since, until, user_id, limit or settings.ATTENDANCE_PAGE_SIZE, cursor
+    )
+
+async def get_users(ip: str, password: Optional[str] = None, use_cache: bool = True) -> List[User]:
+    """Obtiene usuarios de forma asíncrona, desde la caché si está vigente"""
+    if use_cache:
+        cached = await device_cache.get((ip, "users"))
+        if cached is not MISSING:
+            return cached
+    async def operation(device):
+        return await device.get_users()
+    users = await coalesced(ip, "users", password, lambda: with_device(ip, operation, password, name="users"))
+    await device_cache.set((ip, "users"), users)
+    return users
+
+async def get_device_info(ip: str, password: Optional[str] = None,
+                          priority: int = PRIORITY_INTERACTIVE, use_cache: bool = True) -> DeviceInfo:
+    """Obtiene información del dispositivo de forma asíncrona, desde la caché si está vigente"""
+    if use_cache:
+        cached = await device_cache.get((ip, "info"))
+        if cached is not MISSING:
+            return cached
+    async def operation(device):
+        return await device.get_device_info()
+    info = await coalesced(ip, "info", password,
+                           lambda: with_device(ip, operation, password, priority, name="info"))
+    await device_cache.set((ip, "info"), info, settings.CACHE_INFO_TTL)
+    return info
 
 async def test_voice(ip: str, password: Optional[str] = None):
     """Prueba de voz asíncrona"""
-    def operation(device):
-        device.test_voice()
-    return await with_device(ip, operation, password)
-
-async def realtime_events(ip: str, callback: Callable, password: Optional[str] = None, timeout: int = 30):
-    """Maneja eventos en tiempo real usando live_capture()"""
-    loop = asyncio.get_event_loop()
-    
-    # Definir callback seguro
-    def safe_callback(event):
-        asyncio.run_coroutine_threadsafe(callback(event), loop)
-    
-    def operation(device):
-        device.live_capture(safe_callback, timeout)
-    
-    return await with_device(ip, operation, password)
-
-async def upload_templates(ip: str, user_templates: List[tuple], password: Optional[str] = None):
-    """Sube plantillas de huellas a alta velocidad"""
-    def operation(device):
-        device.save_user_templates(user_templates)
-    return await with_device(ip, operation, password)
+    async def operation(device):
+        await device.test_voice()
+    return await with_device(ip, operation, password, name="test_voice")
+
+async def realtime_events(ip: str, callback: Callable, password: Optional[str] = None, timeout: int = 30,
+                          stop: Optional[threading.Event] = None, priority: int = PRIORITY_INTERACTIVE):
+    """Maneja eventos en tiempo real hasta el timeout o hasta que se active stop.
+
+    Con el backend asyncio la sesión del pool queda registrada para eventos y se lee fuera
+    de la cola del dispositivo: las demás operaciones usan la misma conexión y solo pausan
+    los eventos mientras dura su comando. Al volver la sesión sigue registrada, para que el
+    siguiente segmento continúe sin huecos; stop_realtime la libera.
+    """
+    if not pool.multiplexed:
+        async def operation(device):
+            await device.live_capture(callback, timeout, stop)
+        return await with_device(ip, operation, password, priority, name="live_capture")
+
+    async def attach(device):
+        await device.start_events()
+        return device
+
+    device = pool.streaming_device(ip)
+    if device is None:
+        device = await with_device(ip, attach, password, priority, name="live_attach")
+    deadline = time.monotonic() + timeout
+    while not (stop is not None and stop.is_set()) and time.monotonic() < deadline:
+        if not device.streaming:
+            # Otra captura que terminaba desregistró la sesión: se vuelve a registrar
+            device = await with_device(ip, attach, password, priority, name="live_attach")
+        try:
+            events = await device.next_events(settings.LIVE_CAPTURE_POLL_INTERVAL)
+        except ZKProtocolError as e:
+            # Sesión cerrada o perdida: la próxima captura se registra en una sesión nueva
+            metrics.ERRORS.inc(device=ip, command="live_capture")
+            raise HTTPException(status_code=503, detail=f"Error ZK: {str(e)}")
+        for event in events:
+            event["device_ip"] = ip
+            metrics.LIVE_EVENTS.inc(device=ip)
+            try:
+                await callback(event)
+            except Exception as e:
+                logger.error(f"Error en callback: {str(e)}")
+
+async def stop_realtime(ip: str, password: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE):
+    """Desregistra los eventos en vivo de la sesión compartida del dispositivo, si los tiene"""
+    if pool.streaming_device(ip) is None:
+        return
+    async def operation(device):
+        if device.streaming:
+            await device.stop_events()
+    await with_device(ip, operation, password, priority, name="live_detach")
+
+async def read_enrollment(ip: str, password: Optional[str] = None,
+                          priority: int = PRIORITY_INTERACTIVE) -> Tuple[List[ZKUser], List[ZKTemplate], int]:
+    """Usuarios y plantillas en crudo del dispositivo (uid, privilegio numérico, tarjeta y huellas)
+    y el tamaño de su registro de usuario"""
+    async def operation(device):
+        return await device.get_enrollment()
+    return await coalesced(ip, "enrollment", password,
+                           lambda: with_device(ip, operation, password, priority, name="enrollment"))
+
+async def save_enrollment(ip: str, user_templates: List[Tuple[ZKUser, List[ZKTemplate]]],
+                          password: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE) -> Dict[str, str]:
+    """Escribe un lote de usuarios con sus plantillas en una sola operación.
+
+    Los usuarios que no caben en el formato del dispositivo se omiten antes de enviar el
+    lote, para que no lo hagan fallar entero; se devuelven con el motivo por user_id.
+    """
+    async def operation(device):
+        rejected = {}
+        for user, _ in user_templates:
+            error = user_format_error(user, device.conn.user_packet_size)
+            if error:
+                rejected[user.user_id] = error
+        writable = [(user, templates) for user, templates in user_templates if user.user_id not in rejected]
+        if writable:
+            await device.save_user_templates(writable)
+        return rejected
+    try:
+        return await with_device(ip, operation, password, priority, name="upload_templates")
+    finally:
+        # Aunque falle a mitad, el dispositivo pudo quedar modificado
+        await device_cache.invalidate_device(ip)
+
+async def delete_enrollment(ip: str, uids: List[int], templates: List[Tuple[int, int]],
+                            password: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE):
+    """Borra usuarios y plantillas sueltas del dispositivo"""
+    async def operation(device):
+        await device.delete_enrollment(uids, templates)
+    try:
+        return await with_device(ip, operation, password, priority, name="delete_enrollment")
+    finally:
+        await device_cache.invalidate_device(ip)
+
+async def upload_templates(ip: str, templates: List[Tuple[str, int, bytes]], password: Optional[str] = None):
+    """Sube plantillas (user_id, dedo, datos) para usuarios ya registrados en el dispositivo"""
+    users, _, _ = await read_enrollment(ip, password)
+    by_user_id = {user.user_id: user for user in users}
+    missing = sorted({user_id for user_id, _, _ in templates if user_id not in by_user_id})
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Usuarios no registrados en {ip}: {', '.join(missing)}")
+    grouped: Dict[str, List[ZKTemplate]] = {}
+    for user_id, fid, data in templates:
+        grouped.setdefault(user_id, []).append(ZKTemplate(by_user_id[user_id].uid, fid, 1, data))
+    batch = [(by_user_id[user_id], fingers) for user_id, fingers in grouped.items()]
+    await save_enrollment(ip, batch, password)
+    return len(templates)
 
 async def cleanup_devices():
     """Cierra todas las conexiones activas"""
+    await scheduler.shutdown()
+    await pool.close_all()
+    store.close()
     for device in active_connections[:]:
         try:
             device.disconnect()
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CancelOnDisconnectMiddleware:
+    """Cancela el manejo de una petición HTTP cuando el cliente se desconecta.
+
+    El cuerpo se lee por adelantado para poder escuchar http.disconnect sin quitarle
+    mensajes a la aplicación; las operaciones que aún esperan en la cola del
+    dispositivo se descartan al cancelarse quien las pidió.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        messages = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            messages.append(message)
+            if not message.get("more_body", False):
+                break
+
+        disconnected = asyncio.Event()
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def watch():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        handler = asyncio.create_task(self.app(scope, replay, send))
+        watcher = asyncio.create_task(watch())
+        try:
+            await asyncio.wait({handler, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not handler.done():
+                logger.info(f"Cliente desconectado, cancelando {scope['method']} {scope['path']}")
+                handler.cancel()
+            try:
+                await handler
+            except asyncio.CancelledError:
+                if not disconnected.is_set():
+                    raise
+        finally:
+            watcher.cancel()
+            if not handler.done():
+                handler.cancel()
+
+class LeaderForwardMiddleware:
+    """Con varios workers, lleva al líder las peticiones que un worker no puede atender.
+
+    Las rutas locales del proxy se atienden primero en este worker (estado compartido) y solo
+    se reenvían si su respuesta indica que requieren al líder; el resto se reenvía directamente.
+    """
+    def __init__(self, app, proxy):
+        self.app = app
+        self.proxy = proxy
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.proxy.applies(scope):
+            return await self.app(scope, receive, send)
+
+        messages = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            messages.append(message)
+            if not message.get("more_body", False):
+                break
+        body = b"".join(message.get("body", b"") for message in messages)
+
+        if self.proxy.is_local(scope):
+            forward = False
+
+            async def replay():
+                if messages:
+                    return messages.pop(0)
+                return await receive()
+
+            async def capture(message):
+                nonlocal forward
+                if message["type"] == "http.response.start":
+                    forward = self.proxy.requires_leader(message["headers"])
+                if not forward:
+                    await send(message)
+
+            await self.app(scope, replay, capture)
+            if not forward:
+                return
+        await self.proxy.forward(scope, body, send)
@@ -1,3 +1,4 @@
+from app.config import settings
 import concurrent.futures
 
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=10)
\ No newline at end of file
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=settings.MAX_WORKERS)
@@ -0,0 +1,14 @@
+import asyncio
+import time
+
+async def tcp_probe(ip: str, port: int, timeout: float) -> float:
+    """Abre y cierra una conexión TCP; devuelve la latencia en ms o lanza la excepción"""
+    start = time.monotonic()
+    _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    latency = (time.monotonic() - start) * 1000
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+    return latency
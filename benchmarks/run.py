@@ -0,0 +1,254 @@
+"""Benchmark del microservicio contra una flota simulada.
+
+Uso:
+    python -m benchmarks.run --devices 5 --records 20000 --requests 50 --concurrency 10
+
+Levanta el simulador y la API en procesos separados, mide throughput y latencias p50/p99
+de cada escenario e imprime una tabla (y opcionalmente un JSON con --json para comparar
+contra una línea base).
+"""
+from typing import Any, Awaitable, Callable, Dict, List
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import websockets
+
+API_KEY = "benchmark-key"
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(name: str, latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    return {
+        "scenario": name,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0
+    }
+
+async def run_load(name: str, requests: int, concurrency: int,
+                   call: Callable[[int], Awaitable[httpx.Response]]) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await call(index)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    return summarize(name, latencies, errors, time.perf_counter() - start)
+
+async def wait_for_api(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("La API no respondió a tiempo")
+
+async def health_cycle(client: httpx.AsyncClient, devices: List[str], timeout: float = 120) -> Dict[str, Any]:
+    """Tiempo hasta que el monitor reporta toda la flota en línea"""
+    start = time.perf_counter()
+    latencies = []
+    while time.perf_counter() - start < timeout:
+        request_start = time.perf_counter()
+        body = (await client.get("/health")).json()
+        latencies.append(time.perf_counter() - request_start)
+        details = body.get("devices", {}).get("details", {})
+        if all(details.get(ip, {}).get("status") == "online" for ip in devices):
+            break
+        await asyncio.sleep(0.1)
+    result = summarize("health", latencies, 0, time.perf_counter() - start)
+    result["cycle_s"] = round(time.perf_counter() - start, 2)
+    return result
+
+async def realtime_fanout(base_url: str, devices: List[str], subscribers: int, duration: float) -> Dict[str, Any]:
+    """Varios suscriptores por dispositivo; mide eventos entregados por segundo"""
+    received = [0] * subscribers
+    first_event: List[float] = []
+    ws_url = base_url.replace("http://", "ws://")
+
+    async def subscriber(index: int):
+        ip = devices[index % len(devices)]
+        start = time.perf_counter()
+        async with websockets.connect(f"{ws_url}/devices/{ip}/realtime",
+                                      extra_headers={"X-API-Key": API_KEY}) as socket:
+            deadline = start + duration
+            while time.perf_counter() < deadline:
+                try:
+                    message = json.loads(await asyncio.wait_for(socket.recv(), deadline - time.perf_counter()))
+                except asyncio.TimeoutError:
+                    break
+                if "error" in message:
+                    continue
+                if not received[index]:
+                    first_event.append(time.perf_counter() - start)
+                received[index] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(subscriber(index) for index in range(subscribers)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    return {
+        "scenario": "realtime",
+        "subscribers": subscribers,
+        "events": sum(received),
+        "events_per_s": round(sum(received) / elapsed, 2),
+        "p50_first_event_ms": round(percentile(first_event, 0.50) * 1000, 1),
+        "p99_first_event_ms": round(percentile(first_event, 0.99) * 1000, 1)
+    }
+
+def start_process(args: List[str], log_path: str, env: Dict[str, str] = None) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen([sys.executable, *args], env=env, stdout=log, stderr=subprocess.STDOUT, text=True)
+
+async def wait_for_log(path: str, marker: str, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with open(path) as log:
+            if marker in log.read():
+                return
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"No apareció '{marker}' en {path}")
+
+async def main_async(args) -> List[Dict[str, Any]]:
+    base = ipaddress.ip_address(args.host)
+    devices = [str(base + index) for index in range(args.devices)]
+    workdir = tempfile.mkdtemp(prefix="fastbio-bench-")
+    simulator_log = os.path.join(workdir, "simulator.log")
+    simulator = start_process([
+        "-m", "benchmarks.zk_simulator", "--devices", str(args.devices), "--host", args.host,
+        "--port", str(args.device_port), "--users", str(args.users), "--records", str(args.records),
+        "--latency", str(args.latency), "--loss", str(args.loss), "--event-interval", str(args.event_interval)
+    ], simulator_log)
+    await wait_for_log(simulator_log, "READY")
+
+    env = dict(
+        os.environ,
+        API_KEY=API_KEY,
+        KNOWN_DEVICES=",".join(devices),
+        DEVICE_PORT=str(args.device_port),
+        DEVICE_CHECK_INTERVAL="5",
+        ATTENDANCE_SYNC_INTERVAL="0",
+        # Todo el estado en el directorio de trabajo: la corrida no toca ni hereda el de data/
+        ATTENDANCE_DB_PATH=os.path.join(workdir, "attendance.db"),
+        SHARED_STATE_PATH=os.path.join(workdir, "shared.db"),
+        EVENT_LOG_DIR=os.path.join(workdir, "events"),
+        WEBHOOK_OUTBOX_PATH=os.path.join(workdir, "webhooks.db"),
+        LEADER_SOCKET_PATH=os.path.join(workdir, "leader.sock"),
+        DEVICE_REGISTRY_FILE=os.path.join(workdir, "devices.json"),
+        ZK_BACKEND=args.backend
+    )
+    api = start_process(["-m", "uvicorn", "app.main:app", "--port", str(args.api_port), "--log-level", "warning"],
+                        os.path.join(workdir, "api.log"), env)
+    base_url = f"http://127.0.0.1:{args.api_port}"
+    results = []
+    try:
+        async with httpx.AsyncClient(base_url=base_url, headers={"X-API-Key": API_KEY}, timeout=120,
+                                     limits=httpx.Limits(max_connections=args.concurrency * 2)) as client:
+            await wait_for_api(client)
+            results.append(await health_cycle(client, devices))
+
+            def device(index: int) -> str:
+                return devices[index % len(devices)]
+
+            no_cache = {"Cache-Control": "no-cache"}
+            scenarios = [
+                ("info", lambda i: client.get(f"/devices/{device(i)}/info", headers=no_cache)),
+                ("info_cached", lambda i: client.get(f"/devices/{device(i)}/info")),
+                ("users", lambda i: client.get(f"/devices/{device(i)}/users", headers=no_cache)),
+                ("attendance", lambda i: client.get(f"/devices/{device(i)}/attendance")),
+                ("attendance_ndjson", lambda i: client.get(f"/devices/{device(i)}/attendance",
+                                                           params={"format": "ndjson"})),
+            ]
+            for name, call in scenarios:
+                if args.only and name not in args.only:
+                    continue
+                results.append(await run_load(name, args.requests, args.concurrency, call))
+
+            if not args.only or "bulk" in args.only:
+                results.append(await run_load(
+                    "bulk_attendance", max(1, args.requests // len(devices)), 1,
+                    lambda i: client.post("/devices/bulk/attendance", json={"devices": devices})
+                ))
+
+        if not args.only or "realtime" in args.only:
+            results.append(await realtime_fanout(base_url, devices, args.subscribers, args.realtime_duration))
+    finally:
+        api.terminate()
+        simulator.terminate()
+        api.wait()
+        simulator.wait()
+        print(f"Logs en {workdir}")
+    return results
+
+def print_table(results: List[Dict[str, Any]]):
+    columns = ["scenario", "requests", "errors", "throughput_rps", "p50_ms", "p99_ms"]
+    print(" | ".join(f"{column:>18}" for column in columns))
+    for result in results:
+        if result["scenario"] == "realtime":
+            continue
+        print(" | ".join(f"{str(result.get(column, '')):>18}" for column in columns))
+    for result in results:
+        if result["scenario"] == "realtime":
+            print(f"realtime: {result['subscribers']} suscriptores, {result['events']} eventos, "
+                  f"{result['events_per_s']} eventos/s, primer evento p50 {result['p50_first_event_ms']} ms "
+                  f"p99 {result['p99_first_event_ms']} ms")
+        if "cycle_s" in result:
+            print(f"ciclo de salud: {result['cycle_s']} s hasta ver toda la flota en línea")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del microservicio contra dispositivos simulados")
+    parser.add_argument("--devices", type=int, default=5)
+    parser.add_argument("--host", default="127.0.0.2")
+    parser.add_argument("--device-port", type=int, default=4370)
+    parser.add_argument("--api-port", type=int, default=8765)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.002)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--event-interval", type=float, default=0.5)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--subscribers", type=int, default=20)
+    parser.add_argument("--realtime-duration", type=float, default=10)
+    parser.add_argument("--backend", default="asyncio", choices=["asyncio", "zk"])
+    parser.add_argument("--only", nargs="*", help="Escenarios a ejecutar")
+    parser.add_argument("--json", help="Guarda los resultados en este archivo")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+if __name__ == "__main__":
+    main()
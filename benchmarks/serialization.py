@@ -0,0 +1,89 @@
+"""Microbenchmark de la serialización de asistencia, sin dispositivos ni red.
+
+Uso:
+    python -m benchmarks.serialization --records 100000 --repeat 5
+
+Compara el camino anterior (dict por registro -> AttendanceRecord -> jsonable_encoder -> json)
+con el lote columnar (decodificación directa del buffer ZK -> AttendanceBatch -> JSON) sobre
+el mismo buffer de 40 bytes por registro que envía el dispositivo.
+"""
+from app.models.schemas import AttendanceRecord
+from app.services.attendance_batch import AttendanceBatch, orjson
+from app.services.zk_async import AsyncZK, decode_time, _text
+from datetime import datetime, timedelta
+from fastapi.encoders import jsonable_encoder
+from struct import iter_unpack, pack
+from typing import Any, Callable, Dict, List
+import argparse
+import json
+import statistics
+import time
+
+def encode_time(t: datetime) -> int:
+    return ((t.year % 100) * 12 * 31 + (t.month - 1) * 31 + t.day - 1) * 86400 + \
+        (t.hour * 60 + t.minute) * 60 + t.second
+
+def make_buffer(records: int, users: int) -> bytes:
+    """Registros de asistencia de 40 bytes como los entrega CMD_ATTLOG_RRQ"""
+    start = datetime(2024, 1, 1, 7, 0)
+    return b"".join(
+        pack("<H24sBIB8s", index % users + 1, str(index % users + 1).encode(), 1,
+             encode_time(start + timedelta(minutes=index)), index % 2, b"")
+        for index in range(records)
+    )
+
+def legacy_path(buffer: bytes) -> bytes:
+    """Camino anterior: dicts decodificados, validación pydantic y codificación de FastAPI"""
+    records = [
+        {"user_id": _text(user_id), "timestamp": decode_time(pack("<I", timestamp)), "status": status, "punch": punch}
+        for _, user_id, status, timestamp, punch, _ in iter_unpack("<H24sBIB8s", buffer)
+    ]
+    models = [AttendanceRecord(**record) for record in records]
+    return json.dumps(jsonable_encoder(models)).encode()
+
+def batch_path(buffer: bytes) -> bytes:
+    batch: AttendanceBatch = AsyncZK._decode_attendance(memoryview(buffer), 40, {}, 0, len(buffer) // 40)
+    return batch.to_json()
+
+def measure(func: Callable[[bytes], bytes], buffer: bytes, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(buffer)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Serialización de asistencia: camino anterior vs lote columnar")
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Guarda los resultados en este archivo")
+    args = parser.parse_args()
+
+    buffer = make_buffer(args.records, args.users)
+    if json.loads(legacy_path(buffer)) != json.loads(batch_path(buffer)):
+        raise SystemExit("Las dos rutas producen JSON distinto")
+
+    results: List[Dict[str, Any]] = []
+    for name, func in (("legacy", legacy_path), ("batch", batch_path)):
+        timings = measure(func, buffer, args.repeat)
+        best = min(timings)
+        results.append({
+            "scenario": name,
+            "records": args.records,
+            "best_ms": round(best * 1000, 1),
+            "mean_ms": round(statistics.mean(timings) * 1000, 1),
+            "records_per_s": round(args.records / best)
+        })
+    speedup = results[0]["best_ms"] / max(results[1]["best_ms"], 1e-6)
+    print(f"codificador: {'orjson' if orjson is not None else 'json (stdlib)'}")
+    for result in results:
+        print(f"{result['scenario']:>8}: {result['best_ms']:>9} ms  {result['records_per_s']:>10} registros/s")
+    print(f"mejora: {speedup:.1f}x")
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Receptor HTTP de prueba para los webhooks, sin dependencias externas.
+
+Uso:
+    python -m benchmarks.webhook_receiver --port 9000 --latency 0.05 --fail-rate 0.1
+
+Acepta POST con {"events": [...]} sobre conexiones keep-alive, responde 500 con la
+probabilidad indicada para ejercitar los reintentos, y cada --report segundos imprime
+eventos recibidos, lotes, duplicados (por tipo, dispositivo y offset o marca) y retraso
+medio desde la hora del evento.
+"""
+from datetime import datetime
+from typing import Dict, Set, Tuple
+import argparse
+import asyncio
+import json
+import random
+import time
+
+class ReceiverStats:
+    def __init__(self):
+        self.events = 0
+        self.batches = 0
+        self.failures = 0
+        self.duplicates = 0
+        self.lag_total = 0.0
+        self.seen: Set[Tuple] = set()
+
+    def record(self, events):
+        self.batches += 1
+        now = datetime.now()
+        for event in events:
+            key = (event.get("type"), event.get("device_ip"), event.get("offset"),
+                   event.get("user_id"), event.get("timestamp"))
+            if key in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(key)
+            self.events += 1
+            try:
+                self.lag_total += (now - datetime.fromisoformat(event["timestamp"])).total_seconds()
+            except (KeyError, TypeError, ValueError):
+                pass
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "events": self.events,
+            "batches": self.batches,
+            "failures": self.failures,
+            "duplicates": self.duplicates,
+            "mean_lag_s": round(self.lag_total / self.events, 3) if self.events else 0.0
+        }
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, stats: ReceiverStats, args):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", "0")))
+            if args.latency:
+                await asyncio.sleep(args.latency)
+            if random.random() < args.fail_rate:
+                stats.failures += 1
+                status = b"500 Internal Server Error"
+            else:
+                stats.record(json.loads(body).get("events", []))
+                status = b"200 OK"
+            writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Length: 0\r\nConnection: keep-alive\r\n\r\n")
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def report(stats: ReceiverStats, interval: float):
+    last = 0
+    while True:
+        await asyncio.sleep(interval)
+        summary = stats.summary()
+        summary["events_per_s"] = round((stats.events - last) / interval, 1)
+        last = stats.events
+        print(json.dumps(summary), flush=True)
+
+async def serve(args):
+    stats = ReceiverStats()
+    server = await asyncio.start_server(lambda r, w: handle(r, w, stats, args), args.host, args.port)
+    print(f"READY http://{args.host}:{args.port}", flush=True)
+    async with server:
+        await asyncio.gather(server.serve_forever(), report(stats, args.report))
+
+def main():
+    parser = argparse.ArgumentParser(description="Receptor de webhooks de prueba")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos de espera por petición")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Probabilidad de responder 500")
+    parser.add_argument("--report", type=float, default=5.0, help="Segundos entre resúmenes")
+    asyncio.run(serve(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""Simulador de terminales ZKTeco que habla el protocolo TCP usado por la librería zk.
+
+Uso:
+    python -m benchmarks.zk_simulator --devices 5 --host 127.0.0.2 --users 500 --records 80000
+
+Cada dispositivo escucha en su propia IP de loopback (127.0.0.2, 127.0.0.3, ...) y en el
+mismo puerto, igual que una flota real con DEVICE_PORT común.
+"""
+from datetime import datetime, timedelta
+from struct import pack, unpack
+from typing import Dict, List, Optional, Tuple
+from zk import const
+from zk.base import make_commkey
+import argparse
+import asyncio
+import ipaddress
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+FIRMWARE = "Ver 6.60 Apr 28 2018"
+PLATFORM = "ZEM600_TFT"
+
+def checksum(payload: bytes) -> int:
+    """Mismo algoritmo de suma que zkemsdk.c"""
+    if len(payload) % 2:
+        payload += b"\x00"
+    total = sum(unpack(f"<{len(payload) // 2}H", payload))
+    while total > const.USHRT_MAX:
+        total -= const.USHRT_MAX
+    total = ~total
+    while total < 0:
+        total += const.USHRT_MAX
+    return total
+
+def frame(command: int, session_id: int, reply_id: int, data: bytes = b"") -> bytes:
+    body = pack("<4H", command, 0, session_id, reply_id) + data
+    body = pack("<4H", command, checksum(body), session_id, reply_id) + data
+    return pack("<HHI", const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, len(body)) + body
+
+def encode_time(t: datetime) -> int:
+    return (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) *
+        (24 * 60 * 60) + (t.hour * 60 + t.minute) * 60 + t.second
+    )
+
+def encode_timehex(t: datetime) -> bytes:
+    return pack("6B", t.year - 2000, t.month, t.day, t.hour, t.minute, t.second)
+
+class SimulatedUser:
+    def __init__(self, uid: int, user_id: str, name: str, privilege: int = const.USER_DEFAULT,
+                 password: str = "", group_id: str = "1", card: int = 0):
+        self.uid = uid
+        self.user_id = user_id
+        self.name = name
+        self.privilege = privilege
+        self.password = password
+        self.group_id = group_id
+        self.card = card
+
+    def pack72(self) -> bytes:
+        return pack(
+            "<HB8s24sIx7sx24s", self.uid, self.privilege, self.password.encode(), self.name.encode(),
+            self.card, self.group_id.encode(), self.user_id.encode()
+        )
+
+    def pack28(self) -> bytes:
+        return pack(
+            "<HB5s8sIxBhI", self.uid, self.privilege, self.password.encode()[:5], self.name.encode()[:8],
+            self.card, int(self.group_id or 0), 0, int(self.user_id)
+        )
+
+class SimulatedDevice:
+    """Estado de un terminal: usuarios, plantillas, log de asistencia y opciones"""
+    def __init__(self, serial: str, users: int = 100, records: int = 1000, fingers_per_user: int = 0,
+                 latency: float = 0.0, jitter: float = 0.0, loss: float = 0.0,
+                 event_interval: float = 1.0, password: int = 0, seed: Optional[int] = None,
+                 buffer_limit: int = 1024, user_format: int = 72):
+        self.serial = serial
+        # Registro de usuario de 72 bytes o el corto de 28 (user_id numérico, nombre de 8 bytes)
+        self.user_format = user_format
+        # Como en los terminales reales, un buffer más grande se prepara y se lee por tramos (CMD_READ_BUFFER)
+        self.buffer_limit = buffer_limit
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.event_interval = event_interval
+        self.password = password
+        self.random = random.Random(seed)
+        self.mac = "00:17:61:" + ":".join(f"{self.random.randrange(256):02x}" for _ in range(3))
+        self.users: Dict[int, SimulatedUser] = {}
+        self.templates: Dict[Tuple[int, int], bytes] = {}
+        self.attendance: List[Tuple[int, str, int, datetime, int]] = []
+        self._attendance_buffer: Optional[bytes] = None
+
+        for uid in range(1, users + 1):
+            self.users[uid] = SimulatedUser(uid, str(uid), f"Usuario {uid}")
+            for fid in range(fingers_per_user):
+                self.templates[(uid, fid)] = bytes(self.random.getrandbits(8) for _ in range(512))
+        start = datetime.now().replace(microsecond=0) - timedelta(minutes=records)
+        uids = list(self.users) or [1]
+        for index in range(records):
+            uid = self.random.choice(uids)
+            self.attendance.append((uid, str(uid), 1, start + timedelta(minutes=index), index % 2))
+
+    def add_punch(self, uid: int, status: int = 1, punch: int = 0) -> Tuple[int, str, int, datetime, int]:
+        record = (uid, str(uid), status, datetime.now().replace(microsecond=0), punch)
+        self.attendance.append(record)
+        self._attendance_buffer = None
+        return record
+
+    def sizes(self) -> bytes:
+        fields = [0] * 20
+        fields[4] = len(self.users)
+        fields[6] = len(self.templates)
+        fields[8] = len(self.attendance)
+        fields[14] = 3000
+        fields[15] = 3000
+        fields[16] = 100000
+        fields[17] = fields[14] - fields[6]
+        fields[18] = fields[15] - fields[4]
+        fields[19] = fields[16] - fields[8]
+        return pack("20i", *fields) + pack("3i", 0, 0, 0)
+
+    def users_buffer(self) -> bytes:
+        data = b"".join(user.pack28() if self.user_format == 28 else user.pack72() for user in self.users.values())
+        return pack("I", len(data)) + data
+
+    def attendance_buffer(self) -> bytes:
+        if self._attendance_buffer is None:
+            data = b"".join(
+                pack("<H24sB4sB8s", uid & 0xFFFF, user_id.encode(), status, pack("<I", encode_time(timestamp)),
+                     punch, b"")
+                for uid, user_id, status, timestamp, punch in self.attendance
+            )
+            self._attendance_buffer = pack("I", len(data)) + data
+        return self._attendance_buffer
+
+    def templates_buffer(self) -> bytes:
+        data = b"".join(
+            pack("<HHbb", len(template) + 6, uid, fid, 1) + template
+            for (uid, fid), template in self.templates.items()
+        )
+        return pack("i", len(data)) + data
+
+    def option(self, name: bytes) -> bytes:
+        values = {
+            b"~SerialNumber": self.serial,
+            b"~Platform": PLATFORM,
+            b"MAC": self.mac,
+            b"~DeviceName": f"SIM-{self.serial}",
+        }
+        key = name.split(b"\x00")[0]
+        return key + b"=" + values.get(key, "").encode() + b"\x00"
+
+    def clear_attendance(self):
+        self.attendance.clear()
+        self._attendance_buffer = None
+
+    def save_upload(self, buffer: bytes):
+        """Procesa un save_user_template o un lote: usuarios (73 bytes c/u; 29 en el formato corto),
+        tabla y plantillas"""
+        upack_size, table_size, fpack_size = unpack("III", buffer[:12])
+        upack = buffer[12:12 + upack_size]
+        table = buffer[12 + upack_size:12 + upack_size + table_size]
+        fpack = buffer[12 + upack_size + table_size:]
+        if self.user_format == 28:
+            for offset in range(0, len(upack) - 28, 29):
+                _, uid, privilege, password, name, card, group_id, _, user_id = unpack(
+                    "<BHB5s8sIxBhI", upack[offset:offset + 29]
+                )
+                self.users[uid] = SimulatedUser(
+                    uid, str(user_id), name.split(b"\x00")[0].decode(errors="ignore"), privilege,
+                    password.split(b"\x00")[0].decode(errors="ignore"), str(group_id), card
+                )
+        else:
+            for offset in range(0, len(upack) - 72, 73):
+                _, uid, privilege, password, name, card, _, group_id, user_id = unpack(
+                    "<BHB8s24sIB7sx24s", upack[offset:offset + 73]
+                )
+                self.users[uid] = SimulatedUser(
+                    uid, user_id.split(b"\x00")[0].decode(), name.split(b"\x00")[0].decode(), privilege,
+                    password.split(b"\x00")[0].decode(), group_id.split(b"\x00")[0].decode(), card
+                )
+        for offset in range(0, len(table), 8):
+            _, uid, fnum, tstart = unpack("<bHbI", table[offset:offset + 8])
+            size = unpack("<H", fpack[tstart:tstart + 2])[0]
+            self.templates[(uid, fnum - 0x10)] = fpack[tstart + 2:tstart + 2 + size]
+
+    def set_user(self, data: bytes):
+        uid, privilege, password, name, card, group_id, user_id = unpack("<HB8s24s4sx7sx24s", data[:72])
+        self.users[uid] = SimulatedUser(
+            uid, user_id.split(b"\x00")[0].decode(), name.split(b"\x00")[0].decode(), privilege,
+            password.split(b"\x00")[0].decode(), group_id.split(b"\x00")[0].decode(), unpack("<I", card)[0]
+        )
+
+class DeviceSession:
+    """Una conexión TCP de un cliente contra el dispositivo simulado"""
+    def __init__(self, device: SimulatedDevice, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.device = device
+        self.reader = reader
+        self.writer = writer
+        self.session_id = device.random.randint(1, 0xFFFE)
+        self.authenticated = not device.password
+        self.upload = b""
+        self.prepared: Optional[bytes] = None
+        self.events: Optional[asyncio.Task] = None
+
+    async def serve(self):
+        try:
+            while True:
+                top = await self.reader.readexactly(8)
+                magic_1, magic_2, length = unpack("<HHI", top)
+                if (magic_1, magic_2) != (const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2):
+                    return
+                packet = await self.reader.readexactly(length)
+                command, _, _, reply_id = unpack("<4H", packet[:8])
+                if command == const.CMD_ACK_OK:
+                    # Confirmación de un evento en vivo: no lleva respuesta
+                    continue
+                if self.device.loss and self.device.random.random() < self.device.loss:
+                    continue
+                if self.device.latency or self.device.jitter:
+                    await asyncio.sleep(self.device.latency + self.device.random.uniform(0, self.device.jitter))
+                code, data = self.handle(command, packet[8:])
+                self.writer.write(frame(code, self.session_id, reply_id, data))
+                await self.writer.drain()
+                if command == const.CMD_EXIT:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if self.events:
+                self.events.cancel()
+            self.writer.close()
+
+    def handle(self, command: int, data: bytes) -> Tuple[int, bytes]:
+        device = self.device
+        if command == const.CMD_CONNECT:
+            return (const.CMD_ACK_OK if self.authenticated else const.CMD_ACK_UNAUTH), b""
+        if command == const.CMD_AUTH:
+            self.authenticated = data == make_commkey(device.password, self.session_id)
+            return (const.CMD_ACK_OK if self.authenticated else const.CMD_ACK_UNAUTH), b""
+        if not self.authenticated:
+            return const.CMD_ACK_UNAUTH, b""
+        if command == const.CMD_FREE_DATA:
+            self.prepared = None
+            return const.CMD_ACK_OK, b""
+        if command in (const.CMD_EXIT, const.CMD_ENABLEDEVICE, const.CMD_DISABLEDEVICE,
+                       const.CMD_REFRESHDATA, const.CMD_TESTVOICE, const.CMD_CANCELCAPTURE,
+                       const.CMD_STARTVERIFY, const.CMD_SET_TIME):
+            return const.CMD_ACK_OK, b""
+        if command == const.CMD_GET_VERSION:
+            return const.CMD_ACK_OK, FIRMWARE.encode() + b"\x00"
+        if command == const.CMD_OPTIONS_RRQ:
+            return const.CMD_ACK_OK, device.option(data)
+        if command == const.CMD_GET_TIME:
+            return const.CMD_ACK_OK, pack("<I", encode_time(datetime.now()))
+        if command == const.CMD_GET_FREE_SIZES:
+            return const.CMD_ACK_OK, device.sizes()
+        if command == 1503:
+            # read_with_buffer: un bloque pequeño va directo en CMD_DATA; uno grande queda preparado
+            _, requested, fct, _ = unpack("<bhii", data[:11])
+            if requested == const.CMD_USERTEMP_RRQ:
+                buffer = device.users_buffer()
+            elif requested == const.CMD_ATTLOG_RRQ:
+                buffer = device.attendance_buffer()
+            elif requested == const.CMD_DB_RRQ and fct == const.FCT_FINGERTMP:
+                buffer = device.templates_buffer()
+            else:
+                return const.CMD_ACK_ERROR, b""
+            if len(buffer) <= device.buffer_limit:
+                return const.CMD_DATA, buffer
+            self.prepared = buffer
+            return const.CMD_ACK_OK, pack("<BI", 0, len(buffer))
+        if command == 1504:
+            # read_buffer: un tramo [start, start + size) del buffer preparado
+            if self.prepared is None:
+                return const.CMD_ACK_ERROR, b""
+            start, size = unpack("<ii", data[:8])
+            return const.CMD_DATA, self.prepared[start:start + size]
+        if command == const.CMD_CLEAR_ATTLOG:
+            device.clear_attendance()
+            return const.CMD_ACK_OK, b""
+        if command == const.CMD_USER_WRQ:
+            device.set_user(data)
+            return const.CMD_ACK_OK, b""
+        if command == const.CMD_DELETE_USER:
+            uid = unpack("h", data[:2])[0]
+            device.users.pop(uid, None)
+            for key in [key for key in device.templates if key[0] == uid]:
+                del device.templates[key]
+            return const.CMD_ACK_OK, b""
+        if command == const.CMD_DELETE_USERTEMP:
+            uid, fid = unpack("hb", data[:3])
+            device.templates.pop((uid, fid), None)
+            return const.CMD_ACK_OK, b""
+        if command == const.CMD_PREPARE_DATA:
+            self.upload = b""
+            return const.CMD_ACK_OK, b""
+        if command == const.CMD_DATA:
+            self.upload += data
+            return const.CMD_ACK_OK, b""
+        if command == 110:
+            device.save_upload(self.upload)
+            self.upload = b""
+            return const.CMD_ACK_OK, b""
+        if command == const.CMD_REG_EVENT:
+            flags = unpack("I", data[:4])[0]
+            if self.events:
+                self.events.cancel()
+                self.events = None
+            if flags & const.EF_ATTLOG:
+                self.events = asyncio.create_task(self.emit_events())
+            return const.CMD_ACK_OK, b""
+        return const.CMD_ACK_UNKNOWN, b""
+
+    async def emit_events(self):
+        """Genera marcaciones en vivo con la cadencia configurada"""
+        device = self.device
+        uids = list(device.users) or [1]
+        while True:
+            await asyncio.sleep(device.event_interval)
+            uid, user_id, status, timestamp, punch = device.add_punch(device.random.choice(uids))
+            event = pack("<24sBB6s", user_id.encode(), status, punch, encode_timehex(timestamp))
+            self.writer.write(frame(const.CMD_REG_EVENT, self.session_id, 0, event))
+
+async def serve_device(device: SimulatedDevice, host: str, port: int) -> asyncio.AbstractServer:
+    async def handler(reader, writer):
+        await DeviceSession(device, reader, writer).serve()
+    return await asyncio.start_server(handler, host, port)
+
+async def serve_fleet(count: int, host: str, port: int, **options) -> List[asyncio.AbstractServer]:
+    base = ipaddress.ip_address(host)
+    servers = []
+    for index in range(count):
+        ip = str(base + index)
+        device = SimulatedDevice(serial=f"SIM{index:05d}", seed=index, **options)
+        servers.append(await serve_device(device, ip, port))
+        logger.info(f"Dispositivo simulado {device.serial} escuchando en {ip}:{port}")
+    return servers
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador de flota ZKTeco")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--host", default="127.0.0.2", help="IP del primer dispositivo; las demás son consecutivas")
+    parser.add_argument("--port", type=int, default=4370)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--fingers", type=int, default=0, help="Plantillas por usuario")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia por comando en segundos")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--loss", type=float, default=0.0, help="Probabilidad de no responder un comando")
+    parser.add_argument("--event-interval", type=float, default=1.0, help="Segundos entre eventos en vivo")
+    parser.add_argument("--password", type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    async def run():
+        servers = await serve_fleet(
+            args.devices, args.host, args.port, users=args.users, records=args.records,
+            fingers_per_user=args.fingers, latency=args.latency, jitter=args.jitter, loss=args.loss,
+            event_interval=args.event_interval, password=args.password
+        )
+        print("READY", flush=True)
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Entorno común de las pruebas.
+
+La configuración se lee al importar app.config, así que los directorios de datos se
+apuntan a un temporal antes de que ningún módulo de la aplicación se importe. Los
+dispositivos simulados escuchan cada uno en su propia IP de loopback, como la flota real.
+"""
+from contextlib import asynccontextmanager
+import itertools
+import os
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix="fastbio-tests-")
+os.environ.update(
+    ATTENDANCE_DB_PATH=os.path.join(DATA_DIR, "attendance.db"),
+    SHARED_STATE_PATH=os.path.join(DATA_DIR, "shared.db"),
+    WEBHOOK_OUTBOX_PATH=os.path.join(DATA_DIR, "webhooks.db"),
+    EVENT_LOG_DIR=os.path.join(DATA_DIR, "events"),
+    LEADER_SOCKET_PATH=os.path.join(DATA_DIR, "leader.sock"),
+    API_KEY="test-key",
+    DEVICE_REGISTRY_FILE="",
+    KNOWN_DEVICES="",
+    MULTI_WORKER="false",
+    # Fuera del puerto real para no chocar con un simulador o terminal en la máquina
+    DEVICE_PORT="14370",
+    DEVICE_TIMEOUT="2"
+)
+
+from app.config import settings  # noqa: E402
+from app.services import zk_service  # noqa: E402
+from app.services.zk_async import AsyncZK  # noqa: E402
+from benchmarks.zk_simulator import SimulatedDevice, serve_device  # noqa: E402
+import pytest  # noqa: E402
+
+_hosts = itertools.count(2)
+
+@pytest.fixture
+def simulator():
+    """Fábrica de dispositivos simulados: async with simulator(records=10) as (ip, device)
+
+    Cada dispositivo tiene una IP nueva, así que el almacén, la caché y las marcas de agua
+    no se comparten entre pruebas. Al salir se cierran las sesiones y colas del servicio,
+    que quedan ligadas al loop de la prueba.
+    """
+    @asynccontextmanager
+    async def start(**options):
+        index = next(_hosts)
+        ip = f"127.0.{index // 250}.{index % 250 + 2}"
+        options.setdefault("seed", index)
+        device = SimulatedDevice(serial=f"TEST{index:04d}", **options)
+        server = await serve_device(device, ip, settings.DEVICE_PORT)
+        try:
+            yield ip, device
+        finally:
+            await zk_service.cleanup_devices()
+            server.close()
+            await server.wait_closed()
+
+    return start
+
+@pytest.fixture
+def buffer_reads(monkeypatch):
+    """Tramos [start, stop) del buffer preparado que el cliente asyncio pide con CMD_READ_BUFFER"""
+    reads = []
+    read_buffer = AsyncZK.read_buffer
+
+    async def spy(self, start, stop):
+        reads.append((start, stop))
+        return await read_buffer(self, start, stop)
+
+    monkeypatch.setattr(AsyncZK, "read_buffer", spy)
+    return reads
@@ -0,0 +1,92 @@
+from app.services.attendance_analytics import AttendanceAnalytics, compute_days, day_number
+from app.services.attendance_batch import AttendanceBatch, to_epoch
+from app.services.attendance_store import store
+from datetime import date, datetime, timedelta
+import numpy as np
+
+DAY = date(2024, 3, 4)
+
+def punches(*entries):
+    """(user_id, "HH:MM:SS" o datetime) a las columnas que recibe compute_days"""
+    user_ids, timestamps = [], []
+    for user_id, moment in entries:
+        if isinstance(moment, str):
+            moment = datetime.combine(DAY, datetime.strptime(moment, "%H:%M:%S").time())
+        user_ids.append(user_id)
+        timestamps.append(to_epoch(moment))
+    return np.array(user_ids, dtype=object), np.array(timestamps, dtype=np.int64)
+
+def rows(table):
+    return {
+        user_id: (int(punches), int(worked))
+        for user_id, punches, worked in zip(table.user_ids, table.punches, table.worked)
+    }
+
+def test_pairs_and_odd_punch_count():
+    tables = compute_days(*punches(
+        ("1", "08:00:00"), ("1", "12:00:00"), ("1", "13:00:00"), ("1", "17:30:00"),
+        # Sin la salida: el último tramo queda abierto y no suma horas
+        ("2", "09:00:00"), ("2", "13:00:00"), ("2", "14:00:00")
+    ))
+    table = tables[day_number(DAY)]
+    assert rows(table) == {"1": (4, (4 * 60 + 4 * 60 + 30) * 60), "2": (3, 4 * 3600)}
+    assert list(table.first) == [to_epoch(datetime.combine(DAY, datetime.min.time()) + timedelta(hours=8)),
+                                 to_epoch(datetime.combine(DAY, datetime.min.time()) + timedelta(hours=9))]
+
+def test_duplicates_within_and_just_outside_window():
+    entries = (("1", "08:00:00"), ("1", "08:01:00"), ("1", "17:00:00"))
+    # 60 s desde la anterior cuenta como la misma marcación; 61 s ya es otra
+    assert rows(compute_days(*punches(*entries), duplicate_window=60)[day_number(DAY)]) == {"1": (2, 9 * 3600)}
+    entries = (("1", "08:00:00"), ("1", "08:01:01"), ("1", "17:00:00"))
+    assert rows(compute_days(*punches(*entries), duplicate_window=60)[day_number(DAY)]) == {"1": (3, 61)}
+    # Sin ventana, ninguna se descarta
+    entries = (("1", "08:00:00"), ("1", "08:00:30"))
+    assert rows(compute_days(*punches(*entries))[day_number(DAY)]) == {"1": (2, 30)}
+
+def test_two_devices_are_merged_in_time_order():
+    first_device = punches(("1", "17:00:00"), ("2", "08:30:00"))
+    second_device = punches(("1", "08:00:00"), ("1", "08:00:20"), ("2", "16:30:00"))
+    # Las marcaciones llegan por dispositivo, no en orden: se ordenan y se deduplican juntas
+    user_ids = np.concatenate([first_device[0], second_device[0]])
+    timestamps = np.concatenate([first_device[1], second_device[1]])
+    table = compute_days(user_ids, timestamps, duplicate_window=60)[day_number(DAY)]
+    assert rows(table) == {"1": (2, 9 * 3600), "2": (2, 8 * 3600)}
+
+def test_day_boundaries():
+    midnight = datetime.combine(DAY + timedelta(days=1), datetime.min.time())
+    tables = compute_days(*punches(
+        ("1", "22:00:00"), ("1", midnight - timedelta(seconds=1)),
+        ("1", midnight), ("1", midnight + timedelta(hours=6))
+    ), duplicate_window=60)
+    # Cada día se calcula por separado aunque las marcaciones estén a un segundo
+    assert sorted(tables) == [day_number(DAY), day_number(DAY) + 1]
+    assert rows(tables[day_number(DAY)]) == {"1": (2, 2 * 3600 - 1)}
+    assert rows(tables[day_number(DAY) + 1]) == {"1": (2, 6 * 3600)}
+    assert compute_days(*punches()) == {}
+
+def test_invalidate_from_drops_days_from_the_affected_one():
+    device = "192.0.2.77"
+    batch = AttendanceBatch()
+    for offset in range(5):
+        day = datetime.combine(DAY + timedelta(days=offset), datetime.min.time())
+        batch.append("1", day + timedelta(hours=8), 1, 0)
+        batch.append("1", day + timedelta(hours=16), 1, 1)
+    store.add_records(device, batch, len(batch))
+
+    analytics = AttendanceAnalytics(max_days=100)
+    since, until = DAY, DAY + timedelta(days=4)
+    assert len(analytics.day_tables(since, until, [device])) == 5
+    assert (analytics.hits, analytics.misses) == (0, 5)
+    analytics.day_tables(since, until, [device])
+    assert analytics.hits == 5
+
+    # Llega una marcación atrasada del tercer día: desde ahí se recalcula, lo anterior sigue en caché
+    moment = datetime.combine(DAY + timedelta(days=2), datetime.min.time()) + timedelta(hours=20)
+    late = AttendanceBatch()
+    late.append("1", moment, 1, 0)
+    store.add_records(device, late, len(batch) + 1)
+    analytics.invalidate_from(moment)
+    assert sorted(day for _, day in analytics._days) == [day_number(DAY), day_number(DAY) + 1]
+    tables = analytics.day_tables(since, until, [device])
+    assert (analytics.hits, analytics.misses) == (7, 8)
+    assert int(tables[day_number(DAY) + 2].punches[0]) == 3
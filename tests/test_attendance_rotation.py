@@ -0,0 +1,179 @@
+from app.services import zk_service
+from app.services.attendance_batch import AttendanceBatch
+from app.services.attendance_store import store
+from benchmarks.zk_simulator import SimulatedDevice
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from struct import pack, unpack
+import asyncio
+import pytest
+
+def device_batch(device: SimulatedDevice) -> AttendanceBatch:
+    batch = AttendanceBatch()
+    for _, user_id, status, timestamp, punch in device.attendance:
+        batch.append(user_id, timestamp, status, punch)
+    return batch
+
+def archived(ip: str, device: SimulatedDevice) -> int:
+    return store.verify_archived(ip, device_batch(device))[0]
+
+def replace_log(device: SimulatedDevice, count: int):
+    """El log se vacía desde el teclado del terminal y vuelve a llenarse con otras marcaciones"""
+    device.clear_attendance()
+    start = datetime(2020, 1, 1, 8, 0)
+    for index in range(count):
+        device.attendance.append((3, "3", 1, start + timedelta(minutes=index), 0))
+
+def test_rotation_archives_verifies_and_clears(simulator):
+    async def main():
+        async with simulator(users=5, records=40) as (ip, device):
+            snapshot = device_batch(device)
+            result = await zk_service.rotate_attendance(ip)
+            assert result["status"] == "rotated"
+            assert result["records"] == result["inserted"] == 40
+            assert result["digest"] == snapshot.digest()
+            assert device.attendance == []
+            assert store.verify_archived(ip, snapshot)[0] == 40
+            history = store.rotations(ip)
+            assert [(entry["records"], entry["digest"]) for entry in history] == [(40, snapshot.digest())]
+            assert store.get_sync_state(ip)["record_count"] == 0
+
+            # Lo que entra después se sincroniza desde el principio del log vaciado
+            device.add_punch(1)
+            assert await zk_service.sync_attendance(ip) == 1
+            assert store.get_sync_state(ip)["record_count"] == 1
+
+    asyncio.run(main())
+
+def test_rotation_of_empty_log(simulator):
+    async def main():
+        async with simulator(users=5, records=0) as (ip, device):
+            assert await zk_service.rotate_attendance(ip) == {"device_ip": ip, "status": "empty", "records": 0}
+            assert store.rotations(ip) == []
+
+    asyncio.run(main())
+
+def test_rotation_after_sync_archives_only_new_records(simulator):
+    async def main():
+        async with simulator(users=5, records=30) as (ip, device):
+            assert await zk_service.sync_attendance(ip) == 30
+            device.add_punch(1)
+            device.add_punch(2)
+            result = await zk_service.rotate_attendance(ip)
+            assert result["status"] == "rotated"
+            assert (result["records"], result["inserted"]) == (32, 2)
+            assert device.attendance == []
+
+    asyncio.run(main())
+
+def test_rotation_after_replaced_log_archives_everything(simulator):
+    async def main():
+        async with simulator(users=5, records=10) as (ip, device):
+            assert await zk_service.sync_attendance(ip) == 10
+            # Más registros que la marca de agua: sin comprobarla se saltarían los 10 primeros
+            replace_log(device, 15)
+            result = await zk_service.rotate_attendance(ip)
+            assert (result["records"], result["inserted"]) == (15, 15)
+
+    asyncio.run(main())
+
+def test_downloaded_count_mismatch_keeps_log(simulator, monkeypatch):
+    async def main():
+        async with simulator(users=5, records=20) as (ip, device):
+            real_sizes = device.sizes
+
+            def sizes():
+                fields = list(unpack("23i", real_sizes()))
+                fields[8] += 1
+                return pack("23i", *fields)
+
+            monkeypatch.setattr(device, "sizes", sizes)
+            with pytest.raises(HTTPException) as error:
+                await zk_service.rotate_attendance(ip)
+            assert error.value.status_code == 503
+            assert "se descargaron 20" in error.value.detail
+            assert len(device.attendance) == 20
+            assert archived(ip, device) == 0
+            assert store.rotations(ip) == []
+
+    asyncio.run(main())
+
+def test_failed_verification_keeps_log(simulator, monkeypatch):
+    async def main():
+        async with simulator(users=5, records=20) as (ip, device):
+            real_verify = store.verify_archived
+
+            def verify_archived(device_ip, records):
+                count, digest = real_verify(device_ip, records)
+                # Un registro no llegó al archivo
+                return count - 1, digest
+
+            monkeypatch.setattr(store, "verify_archived", verify_archived)
+            with pytest.raises(HTTPException) as error:
+                await zk_service.rotate_attendance(ip)
+            assert error.value.status_code == 503
+            assert "Verificación fallida: 19 de 20" in error.value.detail
+            assert len(device.attendance) == 20
+            assert store.rotations(ip) == []
+
+            # Con el archivo en orden, la siguiente rotación vacía el log sin duplicar nada
+            monkeypatch.setattr(store, "verify_archived", real_verify)
+            result = await zk_service.rotate_attendance(ip)
+            assert (result["status"], result["records"], result["inserted"]) == ("rotated", 20, 0)
+            assert device.attendance == []
+
+    asyncio.run(main())
+
+def test_log_changed_during_rotation_keeps_log(simulator, monkeypatch):
+    async def main():
+        async with simulator(users=5, records=20) as (ip, device):
+            real_verify = store.verify_archived
+
+            def verify_archived(device_ip, records):
+                # Entra una marcación mientras se verifica el archivo
+                device.add_punch(1)
+                return real_verify(device_ip, records)
+
+            monkeypatch.setattr(store, "verify_archived", verify_archived)
+            with pytest.raises(HTTPException) as error:
+                await zk_service.rotate_attendance(ip)
+            assert error.value.status_code == 503
+            assert "cambió durante la rotación" in error.value.detail
+            assert len(device.attendance) == 21
+            assert store.rotations(ip) == []
+
+    asyncio.run(main())
+
+def test_sync_detects_replaced_log(simulator):
+    async def main():
+        async with simulator(users=5, records=10) as (ip, device):
+            assert await zk_service.sync_attendance(ip) == 10
+            device.add_punch(1)
+            device.add_punch(2)
+            assert await zk_service.sync_attendance(ip) == 2
+            assert await zk_service.sync_attendance(ip) == 0
+
+            replace_log(device, 15)
+            assert await zk_service.sync_attendance(ip) == 15
+            assert store.get_sync_state(ip)["record_count"] == 15
+            assert archived(ip, device) == 15
+
+    asyncio.run(main())
+
+def test_rotation_and_sync_are_serialized(simulator):
+    async def main():
+        async with simulator(users=5, records=50) as (ip, device):
+            assert await zk_service.sync_attendance(ip) == 50
+            for uid in range(1, 6):
+                device.add_punch(uid)
+            snapshot = device_batch(device)
+            rotated, synced = await asyncio.gather(
+                zk_service.rotate_attendance(ip), zk_service.sync_attendance(ip)
+            )
+            # Lo nuevo se archiva una sola vez, lo haga la rotación o la sincronización
+            assert rotated["status"] == "rotated"
+            assert rotated["inserted"] + synced == 5
+            assert store.verify_archived(ip, snapshot)[0] == 55
+            assert device.attendance == []
+
+    asyncio.run(main())
@@ -0,0 +1,37 @@
+from app.config import settings
+from app.services import zk_service
+import asyncio
+import json
+
+def test_slow_client_does_not_hold_device(simulator, monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_BATCH_SIZE", 50)
+
+    async def main():
+        async with simulator(users=5, records=2000) as (ip, device):
+            stream = zk_service.stream_attendance(ip)
+            chunks = [await stream.__anext__()]
+
+            async def operation(device):
+                return await device.get_sizes()
+
+            # El cliente no lee más, pero el dispositivo ya quedó libre para otras operaciones
+            sizes = await asyncio.wait_for(zk_service.with_device(ip, operation, name="sizes"), 1)
+            assert sizes.records == 2000
+            chunks.extend([chunk async for chunk in stream])
+            assert len(chunks) == 40
+
+            lines = [json.loads(line) for chunk in chunks for line in chunk.splitlines()]
+            assert [(line["user_id"], line["timestamp"]) for line in lines] == [
+                (user_id, timestamp.isoformat()) for _, user_id, _, timestamp, _ in device.attendance
+            ]
+
+    asyncio.run(main())
+
+def test_stream_reports_device_error():
+    async def main():
+        # Nada escucha en esta dirección: el error llega como última línea del flujo
+        lines = [json.loads(chunk) async for chunk in zk_service.stream_attendance("127.0.9.9")]
+        assert len(lines) == 1
+        assert "error" in lines[0]
+
+    asyncio.run(main())
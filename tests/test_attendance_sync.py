@@ -0,0 +1,104 @@
+from app.main import app
+from app.services import zk_service
+from app.services.attendance_store import store
+from datetime import datetime, timedelta
+from starlette.testclient import TestClient
+import asyncio
+
+HEADERS = {"X-API-Key": "test-key"}
+
+def stored(ip: str):
+    records, _ = store.query(ip, limit=100000)
+    return [(record["user_id"], record["timestamp"]) for record in records]
+
+def expected(device):
+    return sorted((user_id, timestamp) for _, user_id, _, timestamp, _ in device.attendance)
+
+def test_sync_archives_only_after_watermark(simulator):
+    async def main():
+        async with simulator(users=4, records=30) as (ip, device):
+            assert await zk_service.sync_attendance(ip) == 30
+            assert store.get_sync_state(ip)["record_count"] == 30
+            # Sin registros nuevos no se descarga nada
+            assert await zk_service.sync_attendance(ip) == 0
+
+            for uid in (1, 2, 3):
+                device.add_punch(uid)
+            assert await zk_service.sync_attendance(ip) == 3
+            assert store.get_sync_state(ip)["record_count"] == 33
+            assert sorted(stored(ip)) == expected(device)
+
+    asyncio.run(main())
+
+def test_incremental_sync_reads_only_new_records(simulator, buffer_reads):
+    async def main():
+        async with simulator(users=4, records=100) as (ip, device):
+            assert await zk_service.sync_attendance(ip) == 100
+            assert buffer_reads == [(4, 4 + 100 * 40)]
+            buffer_reads.clear()
+            for uid in (1, 2, 3):
+                device.add_punch(uid, punch=uid)
+            # Se transfiere desde el último registro ya archivado, que sirve de ancla
+            assert await zk_service.sync_attendance(ip) == 3
+            assert buffer_reads == [(4 + 99 * 40, 4 + 103 * 40)]
+            assert sorted(stored(ip)) == expected(device)
+
+    asyncio.run(main())
+
+def test_read_from_index_of_directly_sent_buffer(simulator):
+    async def main():
+        # Log pequeño: llega completo en la respuesta y se decodifica desde el índice pedido
+        async with simulator(users=2, records=5, buffer_limit=4096) as (ip, device):
+            async def operation(device):
+                return await device.get_attendance(3)
+
+            records = await zk_service.with_device(ip, operation, name="attendance")
+            assert list(records.tuples()) == [
+                (user_id, timestamp.isoformat(), status, punch)
+                for _, user_id, status, timestamp, punch in device.attendance[3:]
+            ]
+
+    asyncio.run(main())
+
+def test_sync_rearchives_log_replaced_outside_service(simulator):
+    async def main():
+        async with simulator(users=4, records=10) as (ip, device):
+            assert await zk_service.sync_attendance(ip) == 10
+            # Vaciado en el terminal y vuelto a llenar con más registros: el ancla no coincide
+            old = list(device.attendance)
+            device.clear_attendance()
+            start = datetime(2020, 1, 1, 8, 0)
+            for index in range(12):
+                device.attendance.append((3, "3", 1, start + timedelta(minutes=index), 0))
+            assert await zk_service.sync_attendance(ip) == 12
+            assert store.get_sync_state(ip)["record_count"] == 12
+            assert sorted(stored(ip)) == sorted(
+                [(user_id, timestamp) for _, user_id, _, timestamp, _ in old]
+                + [(user_id, timestamp) for _, user_id, _, timestamp, _ in device.attendance]
+            )
+
+    asyncio.run(main())
+
+def test_pages_follow_next_cursor(simulator):
+    async def main():
+        async with simulator(users=3, records=25) as (ip, device):
+            await zk_service.sync_attendance(ip)
+            return ip, [(user_id, timestamp.isoformat()) for _, user_id, _, timestamp, _ in device.attendance]
+
+    ip, records = asyncio.run(main())
+    client = TestClient(app)
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 10, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"/devices/{ip}/attendance", params=params, headers=HEADERS)
+        assert response.status_code == 200
+        pages.append([(record["user_id"], record["timestamp"]) for record in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    # Las páginas siguen el orden (timestamp, id) sin repetir ni saltar registros
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [record for page in pages for record in page] == records
+
+    response = client.get(f"/devices/{ip}/attendance", params={"cursor": "no-es-un-cursor"}, headers=HEADERS)
+    assert response.status_code == 400
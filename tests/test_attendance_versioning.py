@@ -0,0 +1,55 @@
+from app.services import zk_service
+from app.services.change_tracker import attendance_etag
+from datetime import datetime, timedelta
+import asyncio
+
+def refill(device, count: int):
+    """Log vaciado en el terminal y vuelto a llenar hasta el mismo número de registros"""
+    device.clear_attendance()
+    start = datetime(2020, 1, 1, 8, 0)
+    for index in range(count):
+        device.attendance.append((3, "3", 1, start + timedelta(minutes=index), 0))
+
+def test_cached_attendance_follows_replaced_log(simulator, buffer_reads):
+    async def main():
+        async with simulator(users=5, records=100) as (ip, device):
+            state, first = await zk_service.get_attendance_versioned(ip)
+            buffer_reads.clear()
+            cached_state, cached = await zk_service.get_attendance_versioned(ip)
+            # Sin cambios solo viaja el último registro
+            assert cached is first
+            assert buffer_reads == [(4 + 99 * 40, 4 + 100 * 40)]
+            assert attendance_etag(cached_state) == attendance_etag(state)
+
+            refill(device, 100)
+            replaced_state, replaced = await zk_service.get_attendance_versioned(ip)
+            assert replaced_state["records"] == 100
+            assert attendance_etag(replaced_state) != attendance_etag(state)
+            assert replaced_state["generation"] == state["generation"] + 1
+            assert list(replaced.tuples())[0] == ("3", "2020-01-01T08:00:00", 1, 0)
+
+    asyncio.run(main())
+
+def test_conditional_check_reads_the_log_tail(simulator):
+    async def main():
+        async with simulator(users=5, records=100) as (ip, device):
+            etag = attendance_etag(await zk_service.check_changes(ip, tail=True))
+            assert attendance_etag(await zk_service.check_changes(ip, tail=True)) == etag
+            refill(device, 100)
+            # Los contadores solos no ven el cambio; el final del log sí
+            assert attendance_etag(await zk_service.check_changes(ip)) == etag
+            assert attendance_etag(await zk_service.check_changes(ip, tail=True)) != etag
+
+    asyncio.run(main())
+
+def test_tail_of_directly_sent_buffer(simulator):
+    async def main():
+        # Log pequeño: el dispositivo envía todo el buffer en la respuesta y se toma el final
+        async with simulator(users=2, records=3, buffer_limit=4096) as (ip, device):
+            first = await zk_service.check_changes(ip, tail=True)
+            device.attendance[-1] = device.attendance[-1][:3] + (datetime(2021, 5, 5), 1)
+            device._attendance_buffer = None
+            second = await zk_service.check_changes(ip, tail=True)
+            assert (second["records"], second["generation"]) == (3, first["generation"] + 1)
+
+    asyncio.run(main())
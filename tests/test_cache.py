@@ -0,0 +1,89 @@
+from app.main import app
+from app.models.schemas import User
+from app.services import cache as cache_module
+from app.services.cache import MISSING, SharedTTLCache, TTLCache, wants_fresh
+from benchmarks.zk_simulator import SimulatedUser
+import asyncio
+import httpx
+
+HEADERS = {"X-API-Key": "test-key"}
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+
+    async def main():
+        cache = TTLCache(ttl=10, max_entries=10)
+        await cache.set(("10.0.0.1", "users"), ["ana"])
+        await cache.set(("10.0.0.1", "info"), {"serial": "X"}, ttl=60)
+        clock.now += 10
+        assert await cache.get(("10.0.0.1", "users")) == ["ana"]
+        clock.now += 1
+        # Vencida se descarta al leerla; la de plazo propio sigue
+        assert await cache.get(("10.0.0.1", "users")) is MISSING
+        assert await cache.get(("10.0.0.1", "info")) == {"serial": "X"}
+        assert cache.stats() == {"entries": 1, "hits": 2, "misses": 1}
+
+    asyncio.run(main())
+
+def test_least_recently_used_is_dropped_and_device_invalidated():
+    async def main():
+        cache = TTLCache(ttl=60, max_entries=3)
+        for ip in ("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+            await cache.set((ip, "users"), ip)
+        # Leerla la vuelve la más reciente: sale la siguiente
+        await cache.get(("10.0.0.1", "users"))
+        await cache.set(("10.0.0.1", "info"), "info")
+        assert await cache.get(("10.0.0.2", "users")) is MISSING
+        assert await cache.get(("10.0.0.1", "users")) == "10.0.0.1"
+
+        await cache.invalidate_device("10.0.0.1")
+        assert await cache.get(("10.0.0.1", "users")) is MISSING
+        assert await cache.get(("10.0.0.1", "info")) is MISSING
+        assert await cache.get(("10.0.0.3", "users")) == "10.0.0.3"
+
+    asyncio.run(main())
+
+def test_shared_cache_round_trip():
+    async def main():
+        cache = SharedTTLCache(ttl=60)
+        users = [User(uid=1, user_id="1", name="Ana", privilege="User", password="", group_id="1")]
+        await cache.set(("192.0.2.40", "users"), users)
+        assert await cache.get(("192.0.2.40", "users")) == users
+        await cache.invalidate_device("192.0.2.40")
+        assert await cache.get(("192.0.2.40", "users")) is MISSING
+
+    asyncio.run(main())
+
+def test_wants_fresh():
+    assert wants_fresh("no-cache")
+    assert wants_fresh("max-age=0, No-Store")
+    assert not wants_fresh("max-age=60")
+    assert not wants_fresh(None)
+
+def test_no_cache_header_reads_the_device(simulator):
+    async def main():
+        async with simulator(users=2, records=0) as (ip, device):
+            async with httpx.AsyncClient(app=app, base_url="http://test", headers=HEADERS) as client:
+                first = await client.get(f"/devices/{ip}/users")
+                assert len(first.json()) == 2
+                device.users[3] = SimulatedUser(3, "3", "Nuevo")
+                # Desde la caché no se ve el usuario nuevo hasta pedirlo sin caché
+                assert (await client.get(f"/devices/{ip}/users")).json() == first.json()
+                fresh = await client.get(f"/devices/{ip}/users", headers={"Cache-Control": "no-cache"})
+                assert len(fresh.json()) == 3
+                # La lectura fresca también renueva la caché
+                assert len((await client.get(f"/devices/{ip}/users")).json()) == 3
+
+                device.users.pop(3)
+                assert (await client.delete(f"/devices/{ip}/cache")).status_code == 200
+                assert len((await client.get(f"/devices/{ip}/users")).json()) == 2
+
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+from app.services.device_pool import DevicePool
+from app.services.zk_service import AsyncDeviceConnection
+import asyncio
+import pytest
+
+class CountingFactory:
+    """Fábrica del backend asyncio que cuenta los handshakes por IP"""
+    multiplexed = True
+
+    def __init__(self):
+        self.connects = {}
+
+    def __call__(self, ip, password=None):
+        self.connects[ip] = self.connects.get(ip, 0) + 1
+        return AsyncDeviceConnection(ip, password)
+
+def test_sessions_are_reused(simulator):
+    async def main():
+        factory = CountingFactory()
+        pool = DevicePool(factory, max_sessions=5)
+        async with simulator(users=3, records=10) as (ip, device):
+            for _ in range(3):
+                async with pool.session(ip) as session:
+                    assert (await session.get_sizes()).records == 10
+            assert factory.connects == {ip: 1}
+            assert pool.stats()[ip]["uses"] == 3
+            await pool.close_all()
+            assert pool.stats() == {}
+
+    asyncio.run(main())
+
+def test_lru_and_idle_sessions_are_evicted(simulator):
+    async def main():
+        factory = CountingFactory()
+        pool = DevicePool(factory, max_sessions=2, idle_timeout=60)
+        async with simulator(records=1) as (first, _), simulator(records=1) as (second, _), \
+                simulator(records=1) as (third, _):
+            for ip in (first, second, first):
+                async with pool.session(ip) as session:
+                    await session.get_sizes()
+            # Sin lugar, se cierra la sesión usada hace más tiempo
+            async with pool.session(third) as session:
+                await session.get_sizes()
+            assert sorted(pool.stats()) == sorted([first, third])
+
+            # Una sesión prestada no se cierra aunque lleve rato sin uso
+            pool._sessions[first].last_used -= 120
+            pool._sessions[third].last_used -= 120
+            async with pool.session(third):
+                await pool.evict_idle()
+            assert list(pool.stats()) == [third]
+            await pool.close_all()
+
+    asyncio.run(main())
+
+def test_failed_session_is_discarded(simulator):
+    async def main():
+        factory = CountingFactory()
+        pool = DevicePool(factory, max_sessions=5, health_check_interval=60)
+        async with simulator(records=5) as (ip, device):
+            with pytest.raises(RuntimeError):
+                async with pool.session(ip) as session:
+                    await session.get_sizes()
+                    raise RuntimeError("estado desconocido")
+            assert pool.stats() == {}
+            async with pool.session(ip) as session:
+                await session.get_sizes()
+            assert factory.connects == {ip: 2}
+
+            # Un socket caído se detecta en la comprobación de salud y se reconecta
+            entry = pool._sessions[ip]
+            await entry.device.conn.close()
+            entry.last_checked -= 120
+            async with pool.session(ip) as session:
+                assert (await session.get_sizes()).records == 5
+            assert factory.connects == {ip: 3}
+            await pool.close_all()
+
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+from app.main import app
+from app.routers import devices as devices_router
+from app.services.device_registry import DeviceRegistry, normalize_ip
+from starlette.testclient import TestClient
+import json
+import os
+import pytest
+
+HEADERS = {"X-API-Key": "test-key"}
+
+def rewrite(path, devices):
+    """Edición externa del archivo; se adelanta el mtime para no depender de su resolución"""
+    previous = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(devices, f)
+    os.utime(path, ns=(previous + 10 ** 9, previous + 10 ** 9))
+
+def test_normalize_ip():
+    assert normalize_ip(" 10.0.0.5 ") == "10.0.0.5"
+    assert normalize_ip("2001:DB8::0:1") == "2001:db8::1"
+    with pytest.raises(ValueError):
+        normalize_ip("10.0.0.300")
+
+def test_add_and_remove_persist_to_file(tmp_path):
+    path = str(tmp_path / "devices.json")
+    registry = DeviceRegistry(path, ["10.0.0.1"])
+    entry = registry.add(" 10.0.0.2", name="Recepción")
+    assert (entry["ip"], entry["name"], entry["source"]) == ("10.0.0.2", "Recepción", "api")
+    # Actualizar conserva lo que ya tenía y no duplica
+    assert registry.add("10.0.0.2")["name"] == "Recepción"
+    assert registry.ips() == ["10.0.0.1", "10.0.0.2"]
+
+    # Otro worker con el mismo archivo ve la misma flota
+    other = DeviceRegistry(path, ["10.0.0.1"])
+    assert other.ips() == ["10.0.0.1", "10.0.0.2"]
+
+    with pytest.raises(ValueError):
+        registry.remove("10.0.0.1")
+    assert registry.remove("10.0.0.2")
+    assert not registry.remove("10.0.0.2")
+    assert other.reload()
+    assert other.ips() == ["10.0.0.1"]
+
+def test_file_changes_are_reloaded(tmp_path):
+    path = str(tmp_path / "devices.json")
+    rewrite(path, {"devices": ["10.0.1.1", {"ip": "10.0.1.2", "name": "Planta"}]})
+    registry = DeviceRegistry(path, [])
+    assert registry.ips() == ["10.0.1.1", "10.0.1.2"]
+    assert registry.get("10.0.1.2") == {"ip": "10.0.1.2", "name": "Planta", "source": "file"}
+    assert not registry.reload()
+
+    rewrite(path, ["10.0.1.2", "10.0.1.3"])
+    assert registry.reload()
+    assert registry.ips() == ["10.0.1.2", "10.0.1.3"]
+
+    # Un archivo inválido no vacía la flota
+    rewrite(path, ["10.0.1.2", "no-es-ip"])
+    assert not registry.reload()
+    assert registry.ips() == ["10.0.1.2", "10.0.1.3"]
+
+    os.remove(path)
+    assert registry.reload()
+    assert registry.ips() == []
+
+def test_registry_api(tmp_path, monkeypatch):
+    registry = DeviceRegistry(str(tmp_path / "devices.json"), ["10.0.2.1"])
+    monkeypatch.setattr(devices_router, "registry", registry)
+    client = TestClient(app)
+
+    response = client.post("/devices/registry", json={"ip": "10.0.2.2", "name": "Almacén"}, headers=HEADERS)
+    assert response.status_code == 201
+    assert response.json()["ip"] == "10.0.2.2"
+    assert [device["ip"] for device in client.get("/devices/registry", headers=HEADERS).json()] == [
+        "10.0.2.1", "10.0.2.2"
+    ]
+    assert client.post("/devices/registry", json={"ip": "10.0.2"}, headers=HEADERS).status_code == 400
+
+    # Los de KNOWN_DEVICES no se quitan en caliente
+    assert client.delete("/devices/registry/10.0.2.1", headers=HEADERS).status_code == 409
+    assert client.delete("/devices/registry/no-es-ip", headers=HEADERS).status_code == 400
+    assert client.delete("/devices/registry/10.0.2.2", headers=HEADERS).status_code == 200
+    assert client.delete("/devices/registry/10.0.2.2", headers=HEADERS).status_code == 404
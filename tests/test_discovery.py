@@ -0,0 +1,39 @@
+from app.config import settings
+from app.services import discovery
+from app.services.device_registry import DeviceRegistry
+from app.services.discovery import discover, expand_networks
+import asyncio
+import pytest
+
+def test_expand_networks():
+    assert expand_networks(["10.0.0.0/30", "10.0.0.2", "10.0.0.9/32"]) == ["10.0.0.1", "10.0.0.2", "10.0.0.9"]
+    with pytest.raises(ValueError):
+        expand_networks(["10.0.0.0/16"], max_hosts=1000)
+    with pytest.raises(ValueError):
+        expand_networks([])
+
+@pytest.mark.parametrize("backend", ["asyncio", "zk"])
+def test_discover_identifies_with_configured_backend(simulator, monkeypatch, tmp_path, backend):
+    monkeypatch.setattr(settings, "ZK_BACKEND", backend)
+    registry = DeviceRegistry(str(tmp_path / "devices.json"), [])
+    monkeypatch.setattr(discovery, "registry", registry)
+    clients = []
+    identify_blocking = discovery.identify_blocking
+
+    def spy(*args):
+        clients.append("zk")
+        return identify_blocking(*args)
+
+    monkeypatch.setattr(discovery, "identify_blocking", spy)
+
+    async def main():
+        async with simulator(users=1, records=0) as (ip, device):
+            result = await discover([f"{ip}/32"], timeout=1, register=True)
+            [hit] = result["devices"]
+            assert (hit["ip"], hit["serial_number"], hit["device_name"]) == (ip, device.serial, f"SIM-{device.serial}")
+            assert hit["platform"]
+            assert result["added"] == [ip]
+            assert registry.get(ip)["source"] == "discovery"
+
+    asyncio.run(main())
+    assert clients == (["zk"] if backend == "zk" else [])
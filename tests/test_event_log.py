@@ -0,0 +1,245 @@
+from app.config import settings
+from app.services import event_log as event_log_module, ws_service
+from app.services.event_log import EventLog
+import asyncio
+import json
+import os
+import threading
+
+def append_events(log: EventLog, count: int, devices=("10.0.0.1", "10.0.0.2")):
+    return [log.append({"device_ip": devices[index % len(devices)], "user_id": str(index)})
+            for index in range(count)]
+
+def collect(log: EventLog, start: int, device_ip=None, stop=None):
+    async def main():
+        return [event async for event in log.replay(start, device_ip, stop)]
+    return asyncio.run(main())
+
+def test_offsets_and_replay_filters(tmp_path):
+    log = EventLog(str(tmp_path))
+    records = append_events(log, 10)
+    assert [record["offset"] for record in records] == list(range(10))
+    assert log.next_offset == 10
+
+    assert [event["user_id"] for event in collect(log, 0)] == [str(index) for index in range(10)]
+    assert [event["offset"] for event in collect(log, 3, stop=6)] == [3, 4, 5]
+    assert [event["offset"] for event in collect(log, 0, "10.0.0.2")] == [1, 3, 5, 7, 9]
+    assert collect(log, 10) == []
+    log.close()
+
+def test_replay_reads_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EVENT_LOG_REPLAY_BATCH", 3)
+    log = EventLog(str(tmp_path))
+    append_events(log, 10)
+    # El filtro por dispositivo no corta la repetición aunque un lote no traiga ninguno
+    assert [event["offset"] for event in collect(log, 0, "10.0.0.3")] == []
+    assert [event["offset"] for event in collect(log, 2, "10.0.0.1")] == [2, 4, 6, 8]
+    events, position = log.read(0, limit=3)
+    assert [event["offset"] for event in events] == [0, 1, 2]
+    assert position == 3
+    log.close()
+
+def test_reopen_continues_offsets(tmp_path):
+    log = EventLog(str(tmp_path))
+    append_events(log, 5)
+    log.close()
+
+    reopened = EventLog(str(tmp_path))
+    assert reopened.append({"device_ip": "10.0.0.1"})["offset"] == 5
+    assert [event["offset"] for event in collect(reopened, 0)] == list(range(6))
+    reopened.close()
+
+def test_recovery_truncates_torn_write(tmp_path):
+    log = EventLog(str(tmp_path))
+    append_events(log, 5)
+    path = log.segments[-1].path
+    log.close()
+    intact = os.path.getsize(path)
+    with open(path, "ab") as file:
+        file.write(b'{"offset": 5, "device_ip": "10.0.')
+
+    # Un lector no modifica el archivo y no ve la línea a medias
+    reader = EventLog(str(tmp_path))
+    reader.set_writer(False)
+    reader.refresh()
+    assert reader.next_offset == 5
+    assert [event["offset"] for event in collect(reader, 0)] == list(range(5))
+    assert os.path.getsize(path) > intact
+
+    # El escritor la descarta y sigue desde el último evento completo
+    writer = EventLog(str(tmp_path))
+    assert writer.append({"device_ip": "10.0.0.1", "user_id": "after"})["offset"] == 5
+    writer.close()
+    with open(path, "rb") as file:
+        lines = file.read().splitlines()
+    assert [json.loads(line)["offset"] for line in lines] == list(range(6))
+    assert json.loads(lines[-1])["user_id"] == "after"
+
+def test_segments_roll_and_retention(tmp_path, monkeypatch):
+    line = len(json.dumps({"offset": 0, "device_ip": "10.0.0.1", "user_id": "0"})) + 1
+    monkeypatch.setattr(settings, "EVENT_LOG_SEGMENT_BYTES", line * 4)
+    monkeypatch.setattr(settings, "EVENT_LOG_RETENTION_BYTES", line * 10)
+    log = EventLog(str(tmp_path))
+    append_events(log, 30, devices=("10.0.0.1",))
+    log.sync()
+
+    names = sorted(name for name in os.listdir(tmp_path) if name.endswith(".log"))
+    assert names == [os.path.basename(segment.path) for segment in log.segments]
+    assert names[0] == f"{log.earliest_offset:020d}.log"
+    # Se conservan a lo sumo los bytes de retención más el segmento activo
+    assert 0 < log.earliest_offset < 30
+    assert sum(segment.size for segment in log.segments) <= line * 14
+
+    # Lo borrado por retención simplemente no se repite
+    events = collect(log, 0)
+    assert [event["offset"] for event in events] == list(range(log.earliest_offset, 30))
+    log.close()
+
+    reopened = EventLog(str(tmp_path))
+    assert reopened.earliest_offset == int(names[0][:-4])
+    assert reopened.append({"device_ip": "10.0.0.1"})["offset"] == 30
+    reopened.close()
+
+def test_reader_follows_writer(tmp_path):
+    writer = EventLog(str(tmp_path))
+    writer.set_writer(True)
+    append_events(writer, 3)
+    reader = EventLog(str(tmp_path))
+    reader.set_writer(False)
+
+    async def main():
+        await reader.catch_up()
+        assert reader.next_offset == 3
+        append_events(writer, 2)
+        # Hasta releer, el lector solo conoce lo que ya había
+        assert [event["offset"] async for event in reader.replay(0)] == [0, 1, 2]
+        await reader.catch_up()
+        assert [event["offset"] async for event in reader.replay(0)] == [0, 1, 2, 3, 4]
+
+    asyncio.run(main())
+    writer.close()
+    reader.close()
+
+def test_replay_seeks_through_sparse_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_log_module, "INDEX_INTERVAL", 4)
+    line = len(json.dumps({"offset": 0, "device_ip": "10.0.0.1", "user_id": "0"})) + 1
+    monkeypatch.setattr(settings, "EVENT_LOG_SEGMENT_BYTES", line * 10)
+    log = EventLog(str(tmp_path))
+    append_events(log, 45)
+    # El escritor indexa al anexar: una entrada cada INDEX_INTERVAL líneas
+    active = log.segments[-1]
+    assert active.lines == 45 - active.base
+    assert len(active.index) == (active.lines + 3) // 4
+    for start in (0, 3, 4, 9, 10, 11, 27, 44):
+        assert [event["offset"] for event in collect(log, start)] == list(range(start, 45))
+        assert [event["offset"] for event in collect(log, start, stop=start + 5)] == list(range(start, min(start + 5, 45)))
+    log.close()
+
+    # Al reabrir, el índice se arma leyendo el archivo la primera vez que hace falta
+    reopened = EventLog(str(tmp_path))
+    assert [event["offset"] for event in collect(reopened, 22, "10.0.0.1")] == list(range(22, 45, 2))
+    assert reopened.append({"device_ip": "10.0.0.1"})["offset"] == 45
+    assert [event["offset"] for event in collect(reopened, 40)] == list(range(40, 46))
+    reopened.close()
+
+def test_reader_index_follows_appends(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_log_module, "INDEX_INTERVAL", 4)
+    writer = EventLog(str(tmp_path))
+    append_events(writer, 10)
+    reader = EventLog(str(tmp_path))
+    reader.set_writer(False)
+    reader.refresh()
+    assert [event["offset"] for event in collect(reader, 7)] == [7, 8, 9]
+    append_events(writer, 10)
+    reader.refresh()
+    # El segmento releído conserva el índice y lo extiende con lo nuevo
+    assert [event["offset"] for event in collect(reader, 17)] == [17, 18, 19]
+    assert reader.segments[-1].lines == 20
+    writer.close()
+    reader.close()
+
+def test_fsync_runs_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "EVENT_LOG_FSYNC_BATCH", 5)
+    threads = []
+    fsync = os.fsync
+
+    def spy(fd):
+        threads.append(threading.current_thread())
+        fsync(fd)
+
+    monkeypatch.setattr(event_log_module.os, "fsync", spy)
+    log = EventLog(str(tmp_path))
+
+    async def main():
+        append_events(log, 12)
+        while log._syncs:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+    log.close()
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text: str):
+        # Cliente lento: la cola se llena mientras dura la repetición
+        await asyncio.sleep(0.002)
+        self.sent.append(json.loads(text))
+
+class FakeManager:
+    def __init__(self):
+        self.disconnected = False
+
+    async def disconnect(self, websocket):
+        self.disconnected = True
+
+def test_resume_refills_evicted_live_events(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "WS_CLIENT_QUEUE_SIZE", 5)
+    monkeypatch.setattr(settings, "WS_SLOW_CLIENT_POLICY", "disconnect")
+    log = EventLog(str(tmp_path))
+    monkeypatch.setattr(ws_service, "event_log", log)
+
+    def device(index: int) -> str:
+        return "10.0.0.2" if index % 3 == 0 else "10.0.0.1"
+
+    for index in range(60):
+        log.append({"device_ip": device(index), "user_id": str(index)})
+    replays = []
+    replay = log.replay
+
+    def spy(start, device_ip=None, stop=None):
+        replays.append((start, device_ip, stop))
+        return replay(start, device_ip, stop)
+
+    monkeypatch.setattr(log, "replay", spy)
+
+    async def main():
+        manager = FakeManager()
+        websocket = FakeWebSocket()
+        client = ws_service.ClientConnection(websocket, manager)
+        client.topics.add(("10.0.0.1", None))
+        resume = asyncio.create_task(client.resume("10.0.0.1", 0))
+        # Llegan muchos más eventos en vivo de los que caben retenidos durante la repetición
+        for index in range(60, 120):
+            record = log.append({"device_ip": device(index), "user_id": str(index)})
+            if client.wants(device(index), "attendance"):
+                assert client.offer(json.dumps({"type": "attendance", **record}), record["offset"], device(index))
+            await asyncio.sleep(0.001)
+        await resume
+        while not client.queue.empty():
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        client.sender.cancel()
+        return websocket.sent, client, manager
+
+    sent, client, manager = asyncio.run(main())
+    # Todo lo del dispositivo, en orden, sin duplicados ni pérdidas
+    assert [message["offset"] for message in sent] == [index for index in range(120) if device(index) == "10.0.0.1"]
+    assert client.dropped == 0
+    assert not manager.disconnected
+    # Lo que no cupo retenido se volvió a leer del registro
+    assert any(device_ip is None for _, device_ip, _ in replays)
+    log.close()
@@ -0,0 +1,79 @@
+from app.config import settings
+from app.services.fleet_service import fan_out, ndjson_results, resolve_devices, subnet_of
+from fastapi import HTTPException
+import asyncio
+import json
+
+class Tracker:
+    """Operación falsa que registra cuántas llamadas corren a la vez, en total y por subred"""
+    def __init__(self, delay: float = 0.02):
+        self.delay = delay
+        self.running = {}
+        self.peak = {}
+        self.peak_total = 0
+
+    async def __call__(self, ip: str):
+        subnet = subnet_of(ip, 24)
+        self.running[subnet] = self.running.get(subnet, 0) + 1
+        self.peak[subnet] = max(self.peak.get(subnet, 0), self.running[subnet])
+        self.peak_total = max(self.peak_total, sum(self.running.values()))
+        try:
+            await asyncio.sleep(self.delay)
+            if ip.endswith(".13"):
+                raise HTTPException(status_code=503, detail="Error ZK: sin respuesta")
+            return ip
+        finally:
+            self.running[subnet] -= 1
+
+def collect(devices, operation, concurrency=None, subnet_concurrency=None):
+    async def main():
+        return [result async for result in fan_out(devices, operation, concurrency, subnet_concurrency)]
+    return asyncio.run(main())
+
+def test_global_and_subnet_limits(monkeypatch):
+    monkeypatch.setattr(settings, "BULK_SUBNET_PREFIX", 24)
+    devices = [f"10.0.{subnet}.{host}" for subnet in range(3) for host in range(10, 20)]
+    tracker = Tracker()
+    results = collect(devices, tracker, concurrency=5, subnet_concurrency=2)
+    assert sorted(result["device_ip"] for result in results) == sorted(devices)
+    assert tracker.peak_total == 5
+    assert max(tracker.peak.values()) == 2
+
+    # Una sola subred no pasa de su cupo aunque sobre cupo global
+    tracker = Tracker()
+    collect(devices[:10], tracker, concurrency=8, subnet_concurrency=3)
+    assert tracker.peak == {"10.0.0.0/24": 3}
+
+def test_errors_are_reported_per_device():
+    devices = ["10.1.0.12", "10.1.0.13", "10.1.1.13"]
+    results = {result["device_ip"]: result for result in collect(devices, Tracker(0), 4, 4)}
+    assert results["10.1.0.12"]["status"] == "ok"
+    assert results["10.1.0.13"] == {
+        "device_ip": "10.1.0.13", "status": "error", "error": "Error ZK: sin respuesta",
+        "elapsed_ms": results["10.1.0.13"]["elapsed_ms"]
+    }
+    assert results["10.1.1.13"]["status"] == "error"
+
+def test_closing_stream_cancels_pending_devices():
+    async def slow(ip: str):
+        await asyncio.sleep(0 if ip.endswith(".1") else 10)
+        return ip
+
+    async def main():
+        devices = [f"10.2.{subnet}.1" for subnet in range(2)] + [f"10.2.{subnet}.2" for subnet in range(2)]
+        lines = ndjson_results(fan_out(devices, slow, 4, 4))
+        first = json.loads(await lines.__anext__())
+        # El cliente se va: lo que queda en curso no sigue ocupando dispositivos
+        await lines.aclose()
+        await asyncio.sleep(0.01)
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        return first, pending
+
+    first, pending = asyncio.run(main())
+    assert first["status"] == "ok"
+    assert pending == []
+
+def test_resolve_devices_dedupes():
+    assert resolve_devices([" 10.0.0.1", "10.0.0.1", "", "10.0.0.2"]) == ["10.0.0.1", "10.0.0.2"]
+    assert subnet_of("10.3.7.9", 16) == "10.3.0.0/16"
+    assert subnet_of("no-es-ip") == "no-es-ip"
@@ -0,0 +1,47 @@
+from app.background import tasks
+from app.config import settings
+from app.services.device_registry import registry
+from app.services.shared_state import shared_state
+import asyncio
+import time
+
+class FakeHub:
+    def __init__(self):
+        self.pinned = set()
+
+    def pin(self, ip: str):
+        self.pinned.add(ip)
+
+    def unpin(self, ip: str):
+        self.pinned.discard(ip)
+
+def test_leader_pins_only_requested_captures(monkeypatch):
+    monkeypatch.setattr(settings, "LEADER_RENEW_INTERVAL", 0.05)
+    hub = FakeHub()
+    monkeypatch.setattr(tasks, "capture_hub", hub)
+    for ip in ("198.51.100.20", "198.51.100.21", "198.51.100.22"):
+        registry.add(ip)
+
+    async def main():
+        shared_state.put_document("capture", "198.51.100.21", {"worker": "otro"})
+        holder = asyncio.create_task(tasks.hold_captures())
+        try:
+            await asyncio.sleep(0.02)
+            # Los demás dispositivos del registro no se capturan si ningún worker los sigue
+            assert hub.pinned == {"198.51.100.21"}
+
+            # Sin renovar el aviso, vence y la captura se suelta
+            deadline = time.monotonic() + 2
+            while hub.pinned and time.monotonic() < deadline:
+                await asyncio.sleep(0.02)
+            assert hub.pinned == set()
+            assert shared_state.list_documents("capture") == {}
+        finally:
+            holder.cancel()
+            await asyncio.gather(holder, return_exceptions=True)
+
+    try:
+        asyncio.run(main())
+    finally:
+        for ip in ("198.51.100.20", "198.51.100.21", "198.51.100.22"):
+            registry.remove(ip)
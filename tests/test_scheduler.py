@@ -0,0 +1,352 @@
+from app.config import settings
+from app.services import zk_service
+from app.services.scheduler import (
+    DeadlineExceeded, DeviceScheduler, Overloaded, SingleFlight, request_deadline, set_deadline,
+    PRIORITY_BACKGROUND, PRIORITY_CAPTURE, PRIORITY_INTERACTIVE
+)
+from fastapi import HTTPException
+import asyncio
+import pytest
+import time
+
+IP = "10.0.0.1"
+
+async def settle():
+    """Deja correr a las tareas pendientes hasta que se encolen o queden esperando"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def blocking_job(release: asyncio.Event):
+    async def job():
+        await release.wait()
+        return "blocker"
+    return job
+
+def test_priority_order_within_device():
+    async def main():
+        scheduler = DeviceScheduler(idle_timeout=1)
+        release = asyncio.Event()
+        order = []
+
+        def job(name):
+            async def run():
+                order.append(name)
+                return name
+            return run
+
+        blocker = asyncio.create_task(scheduler.submit(IP, blocking_job(release)))
+        await settle()
+        waiting = [
+            asyncio.create_task(scheduler.submit(IP, job("background-1"), PRIORITY_BACKGROUND)),
+            asyncio.create_task(scheduler.submit(IP, job("capture"), PRIORITY_CAPTURE)),
+            asyncio.create_task(scheduler.submit(IP, job("background-2"), PRIORITY_BACKGROUND)),
+            asyncio.create_task(scheduler.submit(IP, job("interactive"), PRIORITY_INTERACTIVE))
+        ]
+        await settle()
+        assert scheduler.stats()[IP] == {"queued": 4, "pending": 5, "running": True}
+        release.set()
+        assert await blocker == "blocker"
+        assert await asyncio.gather(*waiting) == ["background-1", "capture", "background-2", "interactive"]
+        assert order == ["interactive", "capture", "background-1", "background-2"]
+        assert scheduler.stats()[IP]["pending"] == 0
+        await scheduler.shutdown()
+
+    asyncio.run(main())
+
+def test_devices_run_in_parallel():
+    async def main():
+        scheduler = DeviceScheduler(idle_timeout=1)
+        release = asyncio.Event()
+        blocker = asyncio.create_task(scheduler.submit(IP, blocking_job(release)))
+        await settle()
+
+        async def other():
+            return "other"
+
+        # Otra IP no espera a que se libere la cola de la primera
+        assert await asyncio.wait_for(scheduler.submit("10.0.0.2", other), 1) == "other"
+        release.set()
+        await blocker
+        await scheduler.shutdown()
+
+    asyncio.run(main())
+
+def test_deadline_already_expired_is_rejected_before_enqueue():
+    async def main():
+        scheduler = DeviceScheduler(idle_timeout=1)
+        calls = []
+
+        async def job():
+            calls.append(1)
+
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.submit(IP, job, deadline=time.monotonic() - 1)
+        assert calls == []
+        assert scheduler.stats() == {}
+        await scheduler.shutdown()
+
+    asyncio.run(main())
+
+def test_deadline_expires_while_queued():
+    async def main():
+        scheduler = DeviceScheduler(idle_timeout=1)
+        release = asyncio.Event()
+        calls = []
+
+        async def job():
+            calls.append(1)
+
+        blocker = asyncio.create_task(scheduler.submit(IP, blocking_job(release)))
+        await settle()
+        queued = asyncio.create_task(scheduler.submit(IP, job, deadline=time.monotonic() + 0.05))
+        await asyncio.sleep(0.1)
+        release.set()
+        await blocker
+        with pytest.raises(DeadlineExceeded, match="cola"):
+            await queued
+        # La operación vencida nunca llega a ejecutarse
+        assert calls == []
+        await scheduler.shutdown()
+
+    asyncio.run(main())
+
+def test_deadline_expires_during_operation_cancels_it():
+    async def main():
+        scheduler = DeviceScheduler(idle_timeout=1)
+        cancelled = asyncio.Event()
+
+        async def job():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded, match="durante"):
+            await scheduler.submit(IP, job, deadline=time.monotonic() + 0.05)
+        assert time.monotonic() - started < 1
+        assert cancelled.is_set()
+
+        # La cola sigue atendiendo después del plazo vencido
+        async def after():
+            return "ok"
+        assert await scheduler.submit(IP, after) == "ok"
+        await scheduler.shutdown()
+
+    asyncio.run(main())
+
+def test_cancelled_requester_aborts_running_operation():
+    async def main():
+        scheduler = DeviceScheduler(idle_timeout=1)
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def job():
+            started.set()
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        request = asyncio.create_task(scheduler.submit(IP, job))
+        await started.wait()
+        request.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert scheduler.stats()[IP]["pending"] == 0
+        await scheduler.shutdown()
+
+    asyncio.run(main())
+
+def test_admission_control(monkeypatch):
+    monkeypatch.setattr(settings, "DEVICE_QUEUE_MAX_DEPTH", 2)
+    monkeypatch.setattr(settings, "QUEUE_MAX_DEPTH", 3)
+
+    async def main():
+        scheduler = DeviceScheduler(idle_timeout=1)
+        release = asyncio.Event()
+        tasks = [
+            asyncio.create_task(scheduler.submit(IP, blocking_job(release))),
+            asyncio.create_task(scheduler.submit(IP, blocking_job(release)))
+        ]
+        await settle()
+        with pytest.raises(Overloaded) as device_full:
+            await scheduler.submit(IP, blocking_job(release))
+        assert not device_full.value.global_limit
+        assert device_full.value.retry_after >= 1
+
+        tasks.append(asyncio.create_task(scheduler.submit("10.0.0.2", blocking_job(release))))
+        await settle()
+        with pytest.raises(Overloaded) as service_full:
+            await scheduler.submit("10.0.0.3", blocking_job(release))
+        assert service_full.value.global_limit
+
+        # Al terminar las operaciones se vuelve a admitir
+        release.set()
+        await asyncio.gather(*tasks)
+        assert await scheduler.submit(IP, blocking_job(release)) == "blocker"
+        await scheduler.shutdown()
+
+    asyncio.run(main())
+
+def test_single_flight_shares_one_call():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def factory():
+            calls.append(1)
+            await release.wait()
+            return "users"
+
+        waiters = [asyncio.create_task(flight.run("users", factory)) for _ in range(3)]
+        await settle()
+        assert flight.in_flight("users")
+        release.set()
+        assert await asyncio.gather(*waiters) == ["users"] * 3
+        assert calls == [1]
+        assert not flight.in_flight("users")
+
+    asyncio.run(main())
+
+def test_single_flight_deadline_is_per_waiter():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def factory():
+            # La llamada compartida no hereda el plazo de quien la inició
+            assert request_deadline.get() is None
+            await release.wait()
+            return "users"
+
+        async def hurried():
+            set_deadline(0.05)
+            return await flight.run("users", factory)
+
+        patient = asyncio.create_task(flight.run("users", factory))
+        await settle()
+        with pytest.raises(DeadlineExceeded):
+            await asyncio.create_task(hurried())
+        # Quien no tiene prisa sigue esperando la misma llamada
+        assert flight.in_flight("users")
+        release.set()
+        assert await patient == "users"
+
+    asyncio.run(main())
+
+def test_single_flight_cancels_call_without_waiters():
+    async def main():
+        flight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def factory():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def hurried():
+            set_deadline(0.05)
+            return await flight.run("users", factory)
+
+        with pytest.raises(DeadlineExceeded):
+            await asyncio.create_task(hurried())
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await settle()
+        assert not flight.in_flight("users")
+
+    asyncio.run(main())
+
+def test_single_flight_shares_errors():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def factory():
+            calls.append(1)
+            await release.wait()
+            raise ConnectionError("Error de conexión: sin respuesta")
+
+        waiters = [asyncio.create_task(flight.run("users", factory)) for _ in range(3)]
+        await settle()
+        release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert [str(result) for result in results] == ["Error de conexión: sin respuesta"] * 3
+        assert calls == [1]
+        # El error no queda guardado: la siguiente lectura vuelve a consultar
+        release.clear()
+        retry = asyncio.create_task(flight.run("users", factory))
+        await settle()
+        assert flight.in_flight("users")
+        release.set()
+        with pytest.raises(ConnectionError):
+            await retry
+        assert calls == [1, 1]
+
+    asyncio.run(main())
+
+def test_single_flight_survives_one_cancelled_waiter():
+    async def main():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def factory():
+            await release.wait()
+            return "users"
+
+        leaving = asyncio.create_task(flight.run("users", factory))
+        staying = asyncio.create_task(flight.run("users", factory))
+        await settle()
+        leaving.cancel()
+        await settle()
+        # Mientras alguien espere, la llamada compartida sigue
+        assert leaving.cancelled()
+        assert flight.in_flight("users")
+        release.set()
+        assert await staying == "users"
+
+    asyncio.run(main())
+
+def test_concurrent_reads_reach_the_device_once(simulator, monkeypatch):
+    calls = []
+    get_users = zk_service.AsyncDeviceConnection.get_users
+
+    async def counting(self):
+        calls.append(self.ip)
+        return await get_users(self)
+
+    monkeypatch.setattr(zk_service.AsyncDeviceConnection, "get_users", counting)
+
+    async def main():
+        async with simulator(users=4, records=0, latency=0.05) as (ip, device):
+            results = await asyncio.gather(*(zk_service.get_users(ip, use_cache=False) for _ in range(5)))
+            assert [len(users) for users in results] == [4] * 5
+            assert calls == [ip]
+
+    asyncio.run(main())
+
+def test_with_device_maps_deadline_to_504(simulator):
+    async def main():
+        async with simulator(users=2, records=5, latency=0.3) as (ip, device):
+            async def operation(device):
+                return await device.get_sizes()
+
+            # El plazo es de cada petición: corre en su propia tarea, como una petición HTTP
+            async def request():
+                set_deadline(0.2)
+                return await zk_service.with_device(ip, operation, name="sizes")
+
+            with pytest.raises(HTTPException) as error:
+                await asyncio.create_task(request())
+            assert error.value.status_code == 504
+
+            # Sin plazo la misma operación termina y la sesión se vuelve a abrir
+            sizes = await zk_service.with_device(ip, operation, name="sizes")
+            assert sizes.records == 5
+
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+from app.services import zk_service
+from app.services.template_sync import index_enrollment, plan_sync, template_sync
+from app.services.zk_async import ZKTemplate, ZKUser, stored_user
+from benchmarks.zk_simulator import SimulatedUser
+from fastapi import HTTPException
+import asyncio
+
+def user(uid: int, user_id: str, name: str = "Ana", group_id: str = "1") -> ZKUser:
+    return ZKUser(uid, user_id, name, 0, "", group_id, 0)
+
+def finger(uid: int, fid: int, data: bytes = b"\x01" * 8) -> ZKTemplate:
+    return ZKTemplate(uid, fid, 1, data)
+
+def enrollment(*entries):
+    users = [entry[0] for entry in entries]
+    templates = [template for entry in entries for template in entry[1]]
+    return index_enrollment(users, templates)
+
+def test_plan_pushes_missing_users_with_free_uids():
+    source = enrollment((user(1, "100"), [finger(1, 0)]), (user(2, "200"), []), (user(3, "300"), []))
+    target = enrollment((user(1, "100"), [finger(1, 0)]), (user(2, "900"), []))
+    plan = plan_sync(source, target)
+    assert plan.unchanged == 1
+    # El uid es local a cada equipo: los nuevos toman los libres del destino
+    assert [(pushed.user_id, pushed.uid) for pushed, _ in plan.upserts] == [("200", 3), ("300", 4)]
+    assert (plan.stale_templates, plan.deletes) == ([], [])
+
+def test_plan_updates_changed_user_and_drops_stale_templates():
+    source = enrollment((user(1, "100", "Ana María"), [finger(1, 0), finger(1, 3, b"\x02" * 8)]))
+    target = enrollment((user(7, "100"), [finger(7, 0), finger(7, 5)]))
+    plan = plan_sync(source, target)
+    [(pushed, templates)] = plan.upserts
+    assert (pushed.uid, pushed.name) == (7, "Ana María")
+    assert [(template.uid, template.fid) for template in templates] == [(7, 0), (7, 3)]
+    # La huella que ya no está en el origen se borra aparte; la carga no la pisa
+    assert plan.stale_templates == [(7, 5)]
+
+def test_plan_changed_template_only():
+    source = enrollment((user(1, "100"), [finger(1, 0, b"\x09" * 8)]))
+    target = enrollment((user(4, "100"), [finger(4, 0)]))
+    plan = plan_sync(source, target)
+    assert [(pushed.uid, templates[0].template) for pushed, templates in plan.upserts] == [(4, b"\x09" * 8)]
+    assert plan.stale_templates == []
+
+def test_plan_deletes_only_when_asked():
+    source = enrollment((user(1, "100"), []))
+    target = enrollment((user(1, "100"), []), (user(2, "200"), []), (user(5, "500"), []))
+    assert plan_sync(source, target).deletes == []
+    assert plan_sync(source, target, delete_missing=True).deletes == [2, 5]
+
+def test_plan_compares_in_the_target_user_format():
+    source_user = user(1, "100", "Nombre Largo", group_id="")
+    stored = stored_user(source_user, 28)
+    # En 28 bytes el nombre se trunca a 8 y el grupo vacío queda en 0
+    assert (stored.name, stored.group_id) == ("Nombre L", "0")
+    source = enrollment((source_user, [finger(1, 0)]))
+    target = enrollment((stored._replace(uid=9), [finger(9, 0)]))
+    assert plan_sync(source, target, packet_size=28).unchanged == 1
+    # Comparado tal cual se volvería a enviar en cada ejecución
+    assert len(plan_sync(source, target).upserts) == 1
+    # Un user_id que no cabe en el formato corto no se normaliza: se rechaza al cargarlo
+    assert stored_user(user(1, "A-1"), 28) == user(1, "A-1")
+
+def test_sync_to_short_format_device_converges(simulator):
+    async def main():
+        async with simulator(users=6, records=0, fingers_per_user=1) as (source_ip, source):
+            for uid in source.users:
+                source.users[uid].name = f"Empleado número {uid}"
+            # El formato se reconoce por los usuarios que ya tiene: uno basta
+            async with simulator(users=1, records=0, user_format=28) as (target_ip, target):
+                job = template_sync.start(source_ip, [target_ip])
+                await job.task
+                progress = job.devices[target_ip]
+                assert (job.status, progress.pushed, progress.rejected) == ("completed", 6, {})
+                assert target.users[1].name == "Empleado"
+                assert target.templates.keys() == source.templates.keys()
+
+                # La segunda ejecución no encuentra nada que enviar
+                again = template_sync.start(source_ip, [target_ip])
+                await again.task
+                assert (again.devices[target_ip].unchanged, again.devices[target_ip].to_push) == (6, 0)
+
+    asyncio.run(main())
+
+def test_resume_sends_only_what_is_missing(simulator, monkeypatch):
+    async def main():
+        async with simulator(users=7, records=0, fingers_per_user=1) as (source_ip, source):
+            async with simulator(users=0, records=0) as (target_ip, target):
+                save_enrollment = zk_service.save_enrollment
+                batches = []
+
+                async def flaky(ip, user_templates, *args, **kwargs):
+                    batches.append([pushed.user_id for pushed, _ in user_templates])
+                    if len(batches) == 3:
+                        raise HTTPException(status_code=503, detail="Error ZK: sin respuesta")
+                    return await save_enrollment(ip, user_templates, *args, **kwargs)
+
+                monkeypatch.setattr(zk_service, "save_enrollment", flaky)
+                job = template_sync.start(source_ip, [target_ip], batch_size=2)
+                await job.task
+                assert job.status == "partial"
+                assert job.devices[target_ip].status == "error"
+                assert len(target.users) == 4
+
+                # Se reanuda desde lo guardado, como tras un reinicio: vuelve a leer origen y destino
+                monkeypatch.setattr(zk_service, "save_enrollment", save_enrollment)
+                del template_sync.jobs[job.job_id]
+                resumed = await template_sync.resume(job.job_id)
+                await resumed.task
+                progress = resumed.devices[target_ip]
+                assert (resumed.status, resumed.runs) == ("completed", 2)
+                assert (progress.unchanged, progress.to_push, progress.pushed) == (4, 3, 3)
+                assert {user.user_id for user in target.users.values()} == {str(uid) for uid in range(1, 8)}
+                assert target.templates.keys() == source.templates.keys()
+
+    asyncio.run(main())
+
+def test_resume_unknown_job():
+    async def main():
+        assert await template_sync.resume("no-existe") is None
+
+    asyncio.run(main())
+
+def test_short_format_rejects_non_numeric_user(simulator):
+    async def main():
+        async with simulator(users=2, records=0) as (source_ip, source):
+            source.users[3] = SimulatedUser(3, "EMP-3", "Externo")
+            async with simulator(users=1, records=0, user_format=28) as (target_ip, target):
+                job = template_sync.start(source_ip, [target_ip])
+                await job.task
+                progress = job.devices[target_ip]
+                # "Usuario 1" ya está guardado como "Usuario" en 8 bytes: no cuenta como cambio
+                assert (progress.unchanged, progress.pushed) == (1, 1)
+                assert "28 bytes" in progress.rejected["EMP-3"]
+                assert sorted(user.user_id for user in target.users.values()) == ["1", "2"]
+
+    asyncio.run(main())
@@ -0,0 +1,47 @@
+from app.main import app
+from app.services.device_registry import registry
+from app.services.ws_service import manager
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+import pytest
+
+HEADERS = {"X-API-Key": "test-key"}
+
+def test_ws_requires_api_key():
+    client = TestClient(app)
+    for url, headers in (("/ws", {}), ("/ws", {"X-API-Key": "wrong"}), ("/ws?api_key=wrong", {})):
+        with pytest.raises(WebSocketDisconnect) as error:
+            with client.websocket_connect(url, headers=headers) as websocket:
+                websocket.receive_text()
+        assert error.value.code == 1008
+
+def test_ws_accepts_header_or_query_key():
+    client = TestClient(app)
+    for url, headers in (("/ws", HEADERS), ("/ws?api_key=test-key", {})):
+        with client.websocket_connect(url, headers=headers) as websocket:
+            websocket.send_json({"action": "subscribe", "device_ip": "not-an-ip"})
+            assert websocket.receive_json()["type"] == "error"
+
+def test_ws_rejects_devices_outside_registry():
+    client = TestClient(app)
+    with client.websocket_connect("/ws", headers=HEADERS) as websocket:
+        websocket.send_json({"action": "subscribe", "device_ip": "203.0.113.7"})
+        assert websocket.receive_json() == {
+            "type": "error", "message": "El dispositivo no está en el registro", "device_ip": "203.0.113.7"
+        }
+        # No se abrió captura para la IP desconocida
+        assert manager.stats()["device_feeds"] == []
+
+def test_ws_subscribes_registered_device_topics():
+    registry.add("198.51.100.9")
+    try:
+        client = TestClient(app)
+        with client.websocket_connect("/ws", headers=HEADERS) as websocket:
+            # Un tópico que no es de asistencia no abre captura
+            websocket.send_json({"action": "subscribe", "device_ip": "198.51.100.9", "event_type": "template_sync"})
+            websocket.send_json({"action": "subscribe", "device_ip": "203.0.113.7"})
+            assert websocket.receive_json()["device_ip"] == "203.0.113.7"
+            client_topics = [connection.topics for connection in manager.active_connections.values()]
+            assert client_topics == [{("198.51.100.9", "template_sync")}]
+    finally:
+        registry.remove("198.51.100.9")
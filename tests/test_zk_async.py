@@ -0,0 +1,227 @@
+from app.config import settings
+from app.services.attendance_batch import to_epoch
+from app.services.zk_async import (
+    AsyncZK, ZKProtocolError, ZKTemplate, ZKUser, checksum, decode_epoch, decode_time, decode_timehex,
+    make_commkey, user_format_error, CMD_ACK_OK, CMD_CONNECT, CMD_GET_VERSION
+)
+from benchmarks import zk_simulator
+from benchmarks.zk_simulator import encode_time, encode_timehex, frame
+from datetime import datetime
+from struct import pack, unpack
+from zk import base
+import asyncio
+import pytest
+
+MOMENT = datetime(2024, 2, 29, 23, 59, 58)
+
+def client(ip: str, **options) -> AsyncZK:
+    return AsyncZK(ip, port=settings.DEVICE_PORT, timeout=2, **options)
+
+def test_checksum_and_commkey_match_reference():
+    for payload in (b"", b"\x01", b"\xe8\x03\x00\x00\x00\x00\xfd\xff", bytes(range(255))):
+        assert checksum(payload) == zk_simulator.checksum(payload)
+    for key, session_id in ((0, 1), (1234, 0x5A5A), (999999, 0xFFFE)):
+        assert make_commkey(key, session_id) == base.make_commkey(key, session_id)
+
+def test_time_decoding():
+    assert decode_time(pack("<I", encode_time(MOMENT))) == MOMENT
+    assert decode_epoch(encode_time(MOMENT)) == to_epoch(MOMENT)
+    assert decode_timehex(encode_timehex(MOMENT)) == MOMENT
+
+def test_decode_attendance_record_formats():
+    timestamp = encode_time(MOMENT)
+    short = pack("<HBIB", 7, 1, timestamp, 0) + pack("<HBIB", 9, 4, timestamp, 1)
+    # El formato de 8 bytes solo trae el uid: se resuelve con los usuarios y si no, queda el uid
+    batch = AsyncZK._decode_attendance(memoryview(short), 8, {7: "A7"}, 0, 2)
+    assert list(batch.tuples()) == [("A7", MOMENT.isoformat(), 1, 0), ("9", MOMENT.isoformat(), 4, 1)]
+
+    medium = pack("<IIBB2sI", 1001, timestamp, 15, 2, b"", 0)
+    batch = AsyncZK._decode_attendance(memoryview(medium), 16, {}, 0, 1)
+    assert list(batch.tuples()) == [("1001", MOMENT.isoformat(), 15, 2)]
+
+    full = b"".join(pack("<H24sBIB8s", uid, f"EMP-{uid}".encode(), 1, timestamp, 0, b"") for uid in range(5))
+    batch = AsyncZK._decode_attendance(memoryview(full), 40, {}, 2, 4)
+    assert batch.user_ids == ["EMP-2", "EMP-3"]
+    assert list(batch.timestamps) == [to_epoch(MOMENT)] * 2
+
+def test_parse_event_formats():
+    timehex = encode_timehex(MOMENT)
+    short = pack("<IBB6s", 42, 1, 0, timehex)
+    assert AsyncZK._parse_events(short) == [{"user_id": "42", "timestamp": MOMENT, "status": 1, "punch": 0}]
+    for padding in (b"", b"\x00" * 4, b"\x00" * 20):
+        data = pack("<24sBB6s", b"EMP-1", 15, 1, timehex) + padding
+        assert AsyncZK._parse_events(data) == [{"user_id": "EMP-1", "timestamp": MOMENT, "status": 15, "punch": 1}]
+    # Varios eventos de 52 bytes en un mismo paquete
+    many = b"".join(pack("<24sBB6s20s", f"{index}".encode(), 1, 0, timehex, b"") for index in range(3))
+    assert [event["user_id"] for event in AsyncZK._parse_events(many)] == ["0", "1", "2"]
+    assert AsyncZK._parse_events(b"\x00" * 8) == []
+
+def test_user_format_error():
+    user = ZKUser(1, "123", "Ana", 0, "", "1", 0)
+    assert user_format_error(user, 72) is None
+    assert user_format_error(user, 28) is None
+    assert user_format_error(user._replace(user_id="X9"), 72) is None
+    assert "28 bytes" in user_format_error(user._replace(user_id="X9"), 28)
+    assert "28 bytes" in user_format_error(user._replace(user_id=str(0x100000000)), 28)
+    assert "28 bytes" in user_format_error(user._replace(group_id="300"), 28)
+    assert "24 bytes" in user_format_error(user._replace(user_id="9" * 25), 72)
+
+def test_reads_match_simulator(simulator):
+    async def main():
+        async with simulator(users=20, records=300, fingers_per_user=2) as (ip, device):
+            zk = await client(ip).connect()
+            try:
+                users = await zk.get_users()
+                assert zk.user_packet_size == 72
+                assert [(user.uid, user.user_id, user.name) for user in users] == [
+                    (user.uid, user.user_id, user.name) for user in device.users.values()
+                ]
+
+                records = await zk.read_attendance()
+                expected = [(user_id, timestamp.isoformat(), status, punch)
+                            for _, user_id, status, timestamp, punch in device.attendance]
+                assert list(records.tuples()) == expected
+                assert list((await zk.read_attendance(250)).tuples()) == expected[250:]
+                batches = [len(batch) async for batch in zk.iter_attendance(100, batch=64)]
+                assert batches == [64, 64, 64, 8]
+
+                templates = await zk.get_templates()
+                assert {(template.uid, template.fid): template.template for template in templates} == device.templates
+
+                assert await zk.get_option(b"~SerialNumber") == device.serial
+                assert await zk.get_firmware_version() == zk_simulator.FIRMWARE
+            finally:
+                await zk.disconnect()
+
+    asyncio.run(main())
+
+def test_save_user_templates_round_trip(simulator):
+    async def main():
+        async with simulator(users=2, records=0) as (ip, device):
+            zk = await client(ip).connect()
+            try:
+                await zk.get_users()
+                user = ZKUser(50, "EMP-50", "Nueva", 0, "12", "3", 777)
+                fingers = [ZKTemplate(50, 0, 1, b"\x01" * 300), ZKTemplate(50, 6, 1, b"\x02" * 700)]
+                # Más grande que un fragmento de carga para pasar por varios CMD_DATA
+                await zk.save_user_templates([(user, fingers)])
+                saved = device.users[50]
+                assert (saved.user_id, saved.name, saved.password, saved.group_id, saved.card) == \
+                       ("EMP-50", "Nueva", "12", "3", 777)
+                assert device.templates[(50, 0)] == b"\x01" * 300
+                assert device.templates[(50, 6)] == b"\x02" * 700
+                assert "EMP-50" in [user.user_id for user in await zk.get_users()]
+            finally:
+                await zk.disconnect()
+
+    asyncio.run(main())
+
+def test_live_events_between_commands(simulator):
+    async def main():
+        async with simulator(users=3, records=0, event_interval=0.02) as (ip, device):
+            zk = await client(ip).connect()
+            try:
+                await zk.start_events()
+                events = []
+                while len(events) < 3:
+                    events.extend(await zk.next_events(1))
+                # Los comandos se intercalan con los eventos de la misma sesión
+                await zk.pause_events()
+                assert await zk.get_option(b"~SerialNumber") == device.serial
+                await zk.resume_events()
+                events.extend(await zk.next_events(1))
+                await zk.stop_events()
+                recorded = {(user_id, timestamp) for _, user_id, _, timestamp, _ in device.attendance}
+                assert {(event["user_id"], event["timestamp"]) for event in events} <= recorded
+            finally:
+                await zk.disconnect()
+
+    asyncio.run(main())
+
+def test_password_authentication(simulator):
+    async def main():
+        async with simulator(users=1, records=0, password=1234) as (ip, device):
+            zk = await client(ip, password=1234).connect()
+            assert await zk.get_option(b"~SerialNumber") == device.serial
+            await zk.disconnect()
+            with pytest.raises(ZKProtocolError, match="Unauthenticated"):
+                await client(ip, password=1).connect()
+
+    asyncio.run(main())
+
+async def fake_device(respond):
+    """Servidor TCP que responde a cada paquete con lo que devuelva respond(command, reply_id)"""
+    async def handler(reader, writer):
+        try:
+            while True:
+                _, _, length = unpack("<HHI", await reader.readexactly(8))
+                body = await reader.readexactly(length)
+                command, _, _, reply_id = unpack("<4H", body[:8])
+                writer.write(respond(command, reply_id))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handler, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+def test_stale_reply_is_not_taken_for_current_command():
+    def respond(command, reply_id):
+        # Antes de cada respuesta llega la de un comando anterior que ya venció
+        stale = frame(CMD_ACK_OK, 7, (reply_id - 1) % 65535, b"stale\x00")
+        data = b"fresh\x00" if command == CMD_GET_VERSION else b""
+        return stale + frame(CMD_ACK_OK, 7, reply_id, data)
+
+    async def main():
+        server, port = await fake_device(respond)
+        zk = AsyncZK("127.0.0.1", port=port, timeout=1)
+        try:
+            await zk.connect()
+            assert zk.session_id == 7
+            assert await zk.get_firmware_version() == "fresh"
+            assert await zk.get_firmware_version() == "fresh"
+        finally:
+            await zk.close()
+            server.close()
+
+    asyncio.run(main())
+
+def test_missing_reply_times_out():
+    def respond(command, reply_id):
+        # Solo contesta el connect; el resto se pierde
+        return frame(CMD_ACK_OK, 7, reply_id) if command == CMD_CONNECT else b""
+
+    async def main():
+        server, port = await fake_device(respond)
+        zk = AsyncZK("127.0.0.1", port=port, timeout=0.2)
+        try:
+            await zk.connect()
+            with pytest.raises(ZKProtocolError, match="Sin respuesta"):
+                await zk.get_firmware_version()
+        finally:
+            await zk.close()
+            server.close()
+
+    asyncio.run(main())
+
+def test_invalid_header_fails_pending_command():
+    def respond(command, reply_id):
+        if command == CMD_CONNECT:
+            return frame(CMD_ACK_OK, 7, reply_id)
+        return b"\x00" * 16
+
+    async def main():
+        server, port = await fake_device(respond)
+        zk = AsyncZK("127.0.0.1", port=port, timeout=1)
+        try:
+            await zk.connect()
+            with pytest.raises(ZKProtocolError, match="Cabecera"):
+                await zk.get_firmware_version()
+            assert not zk.connected
+        finally:
+            await zk.close()
+            server.close()
+
+    asyncio.run(main())